@@ -42,15 +42,20 @@ def create_app(config_class=Config):
     # 应用启动时同步tmux实例
     with app.app_context():
         from app.services.instance_manager import instance_manager
+        from app.services.instance_registry import instance_registry
+        from app.services.status_index import status_index
+        from app.services.utilization import utilization_recorder
         from app.services.web_terminal import web_terminal_manager
         import threading
         import time
         
         def startup_sync():
             time.sleep(1)  # Wait for app to fully start
-            print("Syncing tmux instances on startup...")
-            instance_manager.sync_screen_instances()
-            time.sleep(2)
+            print("Starting instance registry...")
+            instance_registry.start()
+            instance_registry.wait_ready(timeout=15)
+            status_index.start()
+            utilization_recorder.start()
             instances = instance_manager.get_instances()
             print("Found {} existing tmux instances".format(len(instances)))
             for inst in instances:
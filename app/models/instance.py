@@ -27,6 +27,7 @@ class QInstance:
     screen_session: str = ''
     pid: str = ''
     namespace: str = ''  # 新增namespace字段
+    pane_size: str = ''  # tmux窗格大小，如 120x40
     
     def __post_init__(self):
         if self.created_at is None:
@@ -48,7 +49,8 @@ class QInstance:
             'role': self.role,
             'screen_session': self.screen_session,
             'pid': self.pid,
-            'namespace': self.namespace  # 添加缺失的 namespace 字段
+            'namespace': self.namespace,  # 添加缺失的 namespace 字段
+            'pane_size': self.pane_size
         }
     
     def is_running(self) -> bool:
@@ -59,6 +61,16 @@ class QInstance:
             return False
         return self.process.poll() is None
     
+    def apply_session_info(self, session_info):
+        """合并tmux会话快照中的PID、创建时间、最后活动时间和窗格大小"""
+        if session_info.created:
+            self.created_at = session_info.created
+        if session_info.activity:
+            self.last_activity = session_info.activity
+        if not self.pid and session_info.pane_pid:
+            self.pid = str(session_info.pane_pid)
+        self.pane_size = session_info.pane_size
+    
     def update_activity(self):
         """更新最后活动时间"""
         self.last_activity = datetime.now()
@@ -71,6 +83,7 @@ class ChatMessage:
     timestamp: datetime
     instance_id: Optional[str] = None
     message_type: str = 'chat'  # chat, system, error
+    id: Optional[int] = None  # 聊天历史中单调递增的消息ID
     
     def __post_init__(self):
         if self.timestamp is None:
@@ -83,5 +96,6 @@ class ChatMessage:
             'message': self.message,
             'timestamp': self.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
             'instance_id': self.instance_id,
-            'message_type': self.message_type
+            'message_type': self.message_type,
+            'id': self.id
         }
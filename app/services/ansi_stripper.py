@@ -0,0 +1,46 @@
+"""
+ANSI / VT 控制序列去除
+按 ECMA-48 语法一次扫描去除终端输出中的控制序列，正则在模块加载时编译一次：
+- CSI：ESC [ 参数字节 中间字节 结束字节（颜色、光标移动、清屏、私有模式 ?25h 等），以及8位的 0x9B
+- 控制字符串：OSC（ESC ]）、DCS（ESC P）、SOS（ESC X）、PM（ESC ^）、APC（ESC _），以 BEL 或 ST 结束
+- 其它转义：ESC 中间字节 结束字节（字符集选择 ESC ( B、ESC 7 / ESC 8、ESC = 等）
+- 除制表符和换行外的 C0 控制字符、DEL 和 C1 控制字符
+控制序列和控制字符串都不跨越换行，去除前后行数不变，便于与原始行对应。
+bytes 版本直接处理原始日志字节：UTF-8 多字节字符的后续字节落在 0x80-0xBF，
+与8位C1控制字符重叠，因此只识别7位形式；不含 ESC 的数据只需删除控制字节，不经过正则
+"""
+import re
+
+# 控制字符串的内容：不含终止符、ESC 和换行；缺少终止符时到下一个 ESC 或行尾为止
+_STRING_BODY = r'[^\x07\x1b\x9c\n]*(?:\x07|\x1b\\|\x9c)?'
+
+# 整个正则以一个字符类开头，匹配时先在C中快速跳过普通文本，
+# 命中控制字符后再按其种类（后顾断言）匹配序列的剩余部分
+ANSI_PATTERN = re.compile(
+    r'[\x00-\x08\x0b-\x1f\x7f-\x9f]'                    # C0 / DEL / C1 控制字符（含 ESC）
+    r'(?:(?<=\x1b)(?:\[[0-?]*[ -/]*[@-~]?'                # CSI：ESC [ 参数字节 中间字节 结束字节
+    r'|[\]PX^_]' + _STRING_BODY +                          # OSC / DCS / SOS / PM / APC
+    r'|[ -/]*[0-~])'                                      # nF / Fp / Fe / Fs 转义
+    r'|(?<=\x9b)[0-?]*[ -/]*[@-~]?'                        # 8位 CSI
+    r'|(?<=[\x90\x98\x9d\x9e\x9f])' + _STRING_BODY + r')?'  # 8位控制字符串
+)
+
+ANSI_BYTES_PATTERN = re.compile(
+    rb'[\x00-\x08\x0b-\x1f\x7f]'
+    rb'(?:(?<=\x1b)(?:\[[0-?]*[ -/]*[@-~]?'
+    rb'|[\]PX^_][^\x07\x1b\n]*(?:\x07|\x1b\\)?'
+    rb'|[ -/]*[0-~]))?'
+)
+
+# bytes 快速路径：不含 ESC 时只需删除这些控制字节
+_CONTROL_BYTES = bytes(range(0x00, 0x09)) + bytes(range(0x0b, 0x20)) + b'\x7f'
+
+def strip_ansi(text: str) -> str:
+    """移除ANSI/VT控制序列和控制字符（保留制表符和换行）"""
+    return ANSI_PATTERN.sub('', text)
+
+def strip_ansi_bytes(data: bytes) -> bytes:
+    """移除原始字节中的7位ANSI/VT控制序列和控制字节（保留制表符和换行）"""
+    if b'\x1b' not in data:
+        return data.translate(None, _CONTROL_BYTES)
+    return ANSI_BYTES_PATTERN.sub(b'', data)
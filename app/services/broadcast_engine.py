@@ -0,0 +1,164 @@
+"""
+并行广播
+从实例注册表解析目标实例（指定namespace、角色或全部），为每个实例向发送队列提交一条消息：
+- 并发数受发送队列工作线程数限制，总耗时接近单个实例的最大耗时而不是所有实例耗时之和
+- 与普通发送共用每个实例的投递顺序，广播不会插到已排队的消息之前
+- 每个实例的结果（成功/失败、耗时）通过 broadcast_result 事件推送，全部结束后推送 broadcast_complete 汇总；
+  发起方未知时结果只推送到对应实例的房间，不推送汇总
+"""
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Any
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 不接收广播的实例状态
+STOPPED_STATUSES = ('Not Running', 'Stopped', 'Terminated', 'stopped')
+
+class _Broadcast:
+    """一次广播的进度"""
+
+    def __init__(self, message: str, targets: List[str], scope: Dict[str, Any], owner: Optional[str]):
+        self.broadcast_id = uuid.uuid4().hex
+        self.message = message
+        self.targets = targets
+        self.scope = scope
+        self.owner = owner
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.done = threading.Event()
+
+    def summary(self) -> Dict[str, Any]:
+        results = list(self.results.values())
+        failed = [r for r in results if not r['success']]
+        latencies = [r['latency'] for r in results]
+        return {
+            'broadcast_id': self.broadcast_id,
+            **self.scope,
+            'total': len(self.targets),
+            'completed': len(results),
+            'sent_count': len(results) - len(failed),
+            'failed_count': len(failed),
+            'failed': failed,
+            'finished': self.done.is_set(),
+            'elapsed': round((self.finished_at or time.time()) - self.started_at, 3),
+            'max_latency': max(latencies) if latencies else 0
+        }
+
+class BroadcastEngine:
+    """通过发送队列并行广播消息"""
+
+    def __init__(self, queue=None, registry=None):
+        self._queue = queue
+        self._registry = registry
+        self._broadcasts: OrderedDict = OrderedDict()  # broadcast_id -> _Broadcast（最近的广播）
+        self._lock = threading.Lock()
+        self._emitter: Optional[Callable[[str, Dict, Optional[str]], None]] = None
+
+    @property
+    def queue(self):
+        if self._queue is None:
+            from app.services.send_queue import send_queue
+            self._queue = send_queue
+        return self._queue
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            from app.services.instance_registry import instance_registry
+            self._registry = instance_registry
+        return self._registry
+
+    def set_emitter(self, emitter: Callable[[str, Dict, Optional[str]], None]):
+        """设置事件推送函数 emitter(event, data, room)，room为发起方socket或实例房间"""
+        self._emitter = emitter
+
+    def resolve_targets(self, namespace: str = None, role: str = None, broadcast_all: bool = True) -> List[str]:
+        """解析广播目标：指定namespace时只取该namespace；未指定且broadcast_all=False时只取default"""
+        if not namespace and not broadcast_all:
+            namespace = 'default'
+        instances = self.registry.get_instances(namespace)
+        return sorted(
+            inst['id'] for inst in instances
+            if inst.get('status') not in STOPPED_STATUSES and (not role or inst.get('role') == role)
+        )
+
+    def start(self, message: str, namespace: str = None, role: str = None, broadcast_all: bool = True,
+              owner: str = None) -> Dict[str, Any]:
+        """开始广播，立即返回广播ID和目标实例列表"""
+        targets = self.resolve_targets(namespace, role, broadcast_all)
+        scope = {'namespace': namespace or None, 'role': role or None,
+                 'broadcast_all': bool(broadcast_all) and not namespace}
+        broadcast = _Broadcast(message, targets, scope, owner)
+        with self._lock:
+            self._broadcasts[broadcast.broadcast_id] = broadcast
+            while len(self._broadcasts) > Config.BROADCAST_HISTORY_SIZE:
+                self._broadcasts.popitem(last=False)
+
+        logger.info(f'📢 开始广播 {broadcast.broadcast_id}，目标 {len(targets)} 个实例')
+        if not targets:
+            self._finish(broadcast)
+        for instance_id in targets:
+            self.queue.submit(instance_id, message, owner=owner, notify=False,
+                              on_finished=lambda result, b=broadcast: self._on_result(b, result))
+        return {'broadcast_id': broadcast.broadcast_id, 'targets': targets}
+
+    def broadcast(self, message: str, namespace: str = None, role: str = None, broadcast_all: bool = True,
+                  owner: str = None, timeout: float = None) -> Dict[str, Any]:
+        """广播并等待全部实例完成，返回汇总（超时时返回当前进度，finished为False）"""
+        broadcast_id = self.start(message, namespace, role, broadcast_all, owner)['broadcast_id']
+        with self._lock:
+            broadcast = self._broadcasts[broadcast_id]
+        broadcast.done.wait(timeout or Config.BROADCAST_TIMEOUT)
+        return broadcast.summary()
+
+    def get(self, broadcast_id: str) -> Optional[Dict[str, Any]]:
+        """查询广播进度，包含各实例的结果"""
+        with self._lock:
+            broadcast = self._broadcasts.get(broadcast_id)
+        if broadcast is None:
+            return None
+        return {**broadcast.summary(), 'results': list(broadcast.results.values())}
+
+    def _on_result(self, broadcast: _Broadcast, job: Dict[str, Any]):
+        result = {
+            'broadcast_id': broadcast.broadcast_id,
+            'instance_id': job['instance_id'],
+            'message_id': job['message_id'],
+            'success': job['status'] == 'delivered',
+            'status': job['status'],
+            'error': job['error'],
+            'attempts': job['attempts'],
+            'latency': job['elapsed']
+        }
+        with self._lock:
+            broadcast.results[job['instance_id']] = result
+            finished = len(broadcast.results) == len(broadcast.targets)
+        self._emit('broadcast_result', result, broadcast.owner or f'instance_{job["instance_id"]}')
+        if finished:
+            self._finish(broadcast)
+
+    def _finish(self, broadcast: _Broadcast):
+        broadcast.finished_at = time.time()
+        broadcast.done.set()
+        summary = broadcast.summary()
+        logger.info(f'📢 广播 {broadcast.broadcast_id} 完成：成功 {summary["sent_count"]}/{summary["total"]}，'
+                    f'耗时 {summary["elapsed"] * 1000:.0f}ms')
+        self._emit('broadcast_complete', summary, broadcast.owner)
+
+    def _emit(self, event: str, data: Dict[str, Any], room: Optional[str]):
+        if self._emitter is None or room is None:
+            return
+        try:
+            self._emitter(event, data, room)
+        except Exception as e:
+            logger.debug(f'推送广播结果失败: {e}')
+
+# 全局广播引擎
+broadcast_engine = BroadcastEngine()
@@ -4,21 +4,201 @@ Chat Manager Service - 支持对话记录持久化
 import re
 import os
 import json
+import time
+import itertools
+import threading
 from typing import List, Dict, Tuple
 from datetime import datetime, timezone, timezone
-from collections import deque
+from collections import deque, OrderedDict
 
 from app.models.instance import ChatMessage
 from config.config import Config
 
+class ChatHistoryBuffer:
+    """固定容量的聊天记录环形缓冲区
+    
+    附带 (instance_id, message, 秒级时间桶) 哈希索引，重复检查为O(1)；
+    记录按消息ID（即加入顺序）保存，读取最近的记录只需切取尾部，
+    按ID游标读取增量或向前翻页时二分查找，不再复制和排序整个缓冲区
+    """
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._slots = [None] * capacity
+        self._start = 0
+        self._size = 0
+        self._index = {}  # (instance_id, message, 时间桶) -> [ChatMessage]
+        self._ordered = True
+        self.latest_id = 0  # 最近加入的消息ID
+    
+    def __len__(self):
+        return self._size
+    
+    def __iter__(self):
+        for i in range(self._size):
+            yield self._slots[(self._start + i) % self.capacity]
+    
+    def clear(self):
+        self._slots = [None] * self.capacity
+        self._start = 0
+        self._size = 0
+        self._index.clear()
+        self._ordered = True
+    
+    @staticmethod
+    def _key(msg: ChatMessage, bucket: int):
+        return (msg.instance_id, msg.message, bucket)
+    
+    def is_duplicate(self, msg: ChatMessage) -> bool:
+        """是否已有同一实例、相同内容且时间相差不到1秒的消息"""
+        ts = msg.timestamp.timestamp()
+        bucket = int(ts)
+        for candidate in (bucket - 1, bucket, bucket + 1):
+            for existing in self._index.get(self._key(msg, candidate), ()):
+                if abs(existing.timestamp.timestamp() - ts) < 1:
+                    return True
+        return False
+    
+    def append(self, msg: ChatMessage):
+        """追加消息，缓冲区已满时淘汰最旧的消息"""
+        if self._size == self.capacity:
+            self._evict_oldest()
+        
+        if msg.id is not None and self._size and msg.id < (self._get(self._size - 1).id or 0):
+            # 沿用之前分配的较小ID，下次读取时再按ID排序一次
+            self._ordered = False
+        
+        self._slots[(self._start + self._size) % self.capacity] = msg
+        self._size += 1
+        if msg.id is not None:
+            self.latest_id = max(self.latest_id, msg.id)
+        self._index.setdefault(self._key(msg, int(msg.timestamp.timestamp())), []).append(msg)
+    
+    def _get(self, position: int) -> ChatMessage:
+        return self._slots[(self._start + position) % self.capacity]
+    
+    def _evict_oldest(self):
+        if not self._ordered:
+            self._sort()
+        oldest = self._slots[self._start]
+        self._slots[self._start] = None
+        self._start = (self._start + 1) % self.capacity
+        self._size -= 1
+        
+        key = self._key(oldest, int(oldest.timestamp.timestamp()))
+        bucket = self._index.get(key)
+        if bucket is not None:
+            bucket.remove(oldest)
+            if not bucket:
+                del self._index[key]
+    
+    def _sort(self):
+        messages = sorted(self, key=lambda msg: msg.id or 0)
+        self._slots = messages + [None] * (self.capacity - len(messages))
+        self._start = 0
+        self._ordered = True
+    
+    def _slice(self, first: int, last: int) -> List[ChatMessage]:
+        return [self._get(i) for i in range(first, last)]
+    
+    def _bisect(self, message_id: int, right: bool) -> int:
+        """二分查找ID为message_id的位置（right为True时返回其后的位置）"""
+        if not self._ordered:
+            self._sort()
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            middle_id = self._get(middle).id or 0
+            if middle_id < message_id or (right and middle_id == message_id):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+    
+    def tail(self, limit: int = None) -> List[ChatMessage]:
+        """按ID顺序返回最近的limit条消息"""
+        if not self._ordered:
+            self._sort()
+        count = min(limit, self._size) if limit else self._size
+        return self._slice(self._size - count, self._size)
+    
+    def after(self, message_id: int, limit: int = None) -> Tuple[List[ChatMessage], bool]:
+        """按ID顺序返回ID大于message_id的前limit条消息，以及是否还有更多"""
+        if message_id >= self.latest_id:
+            # 长轮询的常见情况：没有新消息
+            return [], False
+        first = self._bisect(message_id, right=True)
+        last = min(first + limit, self._size) if limit else self._size
+        return self._slice(first, last), last < self._size
+    
+    def before(self, message_id: int, limit: int = None) -> Tuple[List[ChatMessage], bool]:
+        """按ID顺序返回ID小于message_id的最后limit条消息，以及是否还有更早的消息"""
+        last = self._bisect(message_id, right=False)
+        first = max(last - limit, 0) if limit else 0
+        return self._slice(first, last), first > 0
+
+class _NamespaceHistory:
+    """单个namespace已解析的聊天历史"""
+    
+    def __init__(self, capacity: int):
+        self.buffer = ChatHistoryBuffer(capacity)
+        self.loaded = False
+        self.file_state = None  # 缓存文件的 (mtime, size)
+        self.parsed_count = 0  # 已解析的 message_history 条目数
+        self.last_entry = None  # 最后一条已解析的原始条目，用于确认文件只是追加了新条目
+        # 缓存消息 (instance_id, message, timestamp) -> 消息ID，重新加载后同一条消息沿用原来的ID
+        self.message_ids: Dict[tuple, int] = {}
+        self.load_lock = threading.Lock()  # 串行化缓存文件解析，解析期间不占用全局锁
+    
+    def reset(self):
+        """清空已解析的记录（保留消息ID映射）"""
+        self.buffer.clear()
+        self.loaded = False
+        self.file_state = None
+        self.parsed_count = 0
+        self.last_entry = None
+
 class ChatManager:
     """聊天管理器 - 支持对话记录持久化"""
     
     def __init__(self):
         self.config = Config()
-        self.chat_history = deque(maxlen=self.config.MAX_CHAT_HISTORY)
         self.system_logs = deque(maxlen=self.config.MAX_SYSTEM_LOGS)
-        self.namespace_cache_loaded = False
+        # 默认namespace（未指定namespace的请求和没有实例的消息使用），不随请求改变
+        self.current_namespace = 'q_cli'
+        # namespace -> _NamespaceHistory，按最近使用排序
+        self._namespace_histories = OrderedDict()
+        self._lock = threading.RLock()
+        # 有新消息加入任意namespace时通知长轮询的请求
+        self._new_messages = threading.Condition(self._lock)
+        self._message_ids = itertools.count(1)
+    
+    @property
+    def chat_history(self) -> ChatHistoryBuffer:
+        """当前namespace的聊天历史"""
+        with self._lock:
+            return self._get_namespace_history(self.current_namespace).buffer
+    
+    @property
+    def namespace_cache_loaded(self) -> bool:
+        return self.is_namespace_cache_loaded(self.current_namespace)
+    
+    def is_namespace_cache_loaded(self, namespace: str) -> bool:
+        with self._lock:
+            history = self._namespace_histories.get(namespace)
+            return history is not None and history.loaded
+    
+    def _get_namespace_history(self, namespace: str) -> _NamespaceHistory:
+        """获取namespace的历史记录（LRU，调用方持有self._lock）"""
+        history = self._namespace_histories.get(namespace)
+        if history is None:
+            history = _NamespaceHistory(self.config.MAX_CHAT_HISTORY)
+            self._namespace_histories[namespace] = history
+            while len(self._namespace_histories) > self.config.CHAT_NAMESPACE_CACHE_SIZE:
+                self._namespace_histories.popitem(last=False)
+        else:
+            self._namespace_histories.move_to_end(namespace)
+        return history
     
     def _normalize_datetime(self, dt):
         """标准化datetime对象，确保都是UTC时区"""
@@ -32,30 +212,69 @@ class ChatManager:
             # 如果有时区信息，转换为UTC
             return dt.astimezone(timezone.utc)
     
-    def add_chat_message(self, sender: str, message: str, instance_id: str = None):
-        """添加聊天消息并保存到持久化存储"""
+    def add_chat_message(self, sender: str, message: str, instance_id: str = None, message_type: str = 'chat',
+                         namespace: str = None):
+        """添加聊天消息并保存到持久化存储
+        
+        Args:
+            namespace: 消息所属namespace，为空时使用实例所属的namespace，没有实例时使用默认namespace
+        """
         chat_msg = ChatMessage(
             sender=sender,
             message=message,
             timestamp=self._normalize_datetime(datetime.now()),
             instance_id=instance_id,
-            message_type='chat'
+            message_type=message_type
         )
-        self.chat_history.append(chat_msg)
+        namespace = namespace or self._resolve_namespace(instance_id)
+        with self._lock:
+            # 只有已缓存的namespace需要加入内存历史，其它namespace在读取时从缓存文件加载
+            history = self._namespace_histories.get(namespace)
+            if history is not None:
+                self._append_message(history.buffer, chat_msg)
         
         # 如果有实例ID，保存到对话记录
         if instance_id:
-            self._save_to_persistent_storage(sender, message, instance_id)
+            self._save_to_persistent_storage(sender, message, instance_id, message_type)
+        else:
+            self._record_to_database(chat_msg, namespace)
+    
+    def _resolve_namespace(self, instance_id: str = None) -> str:
+        """消息所属的namespace：实例所属namespace，没有实例或无法解析时为默认namespace"""
+        if instance_id:
+            try:
+                from app.services.instance_manager import instance_manager
+                namespace = instance_manager.get_instance_namespace(instance_id)
+                if namespace:
+                    return namespace
+            except Exception:
+                pass
+        return self.current_namespace
+    
+    def _append_message(self, buffer: ChatHistoryBuffer, chat_msg: ChatMessage):
+        """分配消息ID并加入历史记录（调用方持有self._lock）"""
+        chat_msg.id = next(self._message_ids)
+        buffer.append(chat_msg)
+        self._new_messages.notify_all()
     
-    def _save_to_persistent_storage(self, sender: str, message: str, instance_id: str):
+    def _save_to_persistent_storage(self, sender: str, message: str, instance_id: str, message_type: str = 'chat'):
         """保存消息到持久化存储"""
         try:
             from app.services.instance_manager import instance_manager
-            instance_manager.save_conversation_message(instance_id, sender, message)
+            instance_manager.save_conversation_message(instance_id, sender, message, message_type=message_type)
         except Exception as e:
             # 如果保存失败，记录到系统日志但不影响主流程
             self.add_system_log('保存对话记录失败: {}'.format(str(e)))
     
+    def _record_to_database(self, chat_msg: ChatMessage, namespace: str):
+        """没有实例ID的聊天消息只写入对话记录数据库"""
+        try:
+            from app.services.conversation_db import conversation_db
+            conversation_db.record(namespace, None, chat_msg.sender, chat_msg.message,
+                                   chat_msg.timestamp, message_type=chat_msg.message_type, source='chat')
+        except Exception as e:
+            self.add_system_log('写入对话记录数据库失败: {}'.format(str(e)))
+    
     def add_system_log(self, message: str):
         """添加系统日志"""
         log_msg = ChatMessage(
@@ -66,125 +285,185 @@ class ChatManager:
         )
         self.system_logs.append(log_msg)
     
-    def load_namespace_cache_history(self, namespace: str = 'q_cli'):
-        """从 namespace 缓存文件加载历史记录"""
-        # 检查是否是同一个namespace，如果是则避免重复加载
-        if (self.namespace_cache_loaded and 
-            getattr(self, 'current_namespace', None) == namespace):
-            return
-            
-        try:
-            # 构建缓存文件路径
-            cache_file = os.path.expanduser(
-                '~/Library/Application Support/cliExtra/namespaces/{}/namespace_cache.json'.format(namespace)
-            )
-            
-            print('尝试加载缓存文件: {}'.format(cache_file))
-            
-            # 清空现有历史记录，准备加载新namespace的数据
-            self.chat_history.clear()
-            
-            if not os.path.exists(cache_file):
-                self.add_system_log('Namespace 缓存文件不存在: {}'.format(cache_file))
-                print('缓存文件不存在: {}'.format(cache_file))
-                self.namespace_cache_loaded = True  # 标记为已加载，即使是空的
-                return
-            
-            with open(cache_file, 'r') as f:
-                cache_data = json.load(f)
-            
-            print('缓存文件加载成功，数据键: {}'.format(list(cache_data.keys())))
-            
-            # 加载消息历史
-            message_history = cache_data.get('message_history', [])
-            print('找到 {} 条历史消息'.format(len(message_history)))
-            
-            # 转换为 ChatMessage 对象并添加到历史记录
-            loaded_count = 0
-            for i, msg_data in enumerate(message_history):
-                try:
-                    # 解析时间戳
-                    timestamp_str = msg_data.get('timestamp', '')
-                    if timestamp_str:
-                        # 处理 ISO 格式的时间戳
-                        if timestamp_str.endswith('Z'):
-                            timestamp_str = timestamp_str[:-1] + '+00:00'
-                        try:
-                            timestamp = datetime.fromisoformat(timestamp_str)
-                        except:
-                            # 如果解析失败，尝试其他格式
-                            timestamp = datetime.strptime(timestamp_str.replace('Z', ''), '%Y-%m-%dT%H:%M:%S')
-                            timestamp = timestamp.replace(tzinfo=timezone.utc)
-                    else:
-                        timestamp = datetime.now(timezone.utc)
-                    
-                    # 标准化时间戳
-                    timestamp = self._normalize_datetime(timestamp)
-                    
-                    # 创建聊天消息对象
-                    chat_msg = ChatMessage(
-                        sender=msg_data.get('instance_id', 'unknown'),
-                        message=msg_data.get('message', ''),
-                        timestamp=timestamp,
-                        instance_id=msg_data.get('instance_id'),
-                        message_type='chat'
-                    )
-                    
-                    # 添加到历史记录（如果不重复）
-                    if not self._is_duplicate_message(chat_msg):
-                        self.chat_history.append(chat_msg)
-                        loaded_count += 1
-                        
-                    if i < 3:  # 打印前3条消息用于调试
-                        print('消息 {}: {} - {}'.format(i+1, msg_data.get('instance_id', 'unknown'), msg_data.get('message', '')[:50]))
-                        
-                except Exception as e:
-                    print('解析消息 {} 失败: {}'.format(i, str(e)))
-                    self.add_system_log('解析消息失败: {}'.format(str(e)))
-                    continue
-            
-            self.namespace_cache_loaded = True
-            success_msg = '从 namespace 缓存加载了 {} 条历史消息'.format(loaded_count)
-            self.add_system_log(success_msg)
-            print(success_msg)
-            
-        except Exception as e:
-            error_msg = '加载 namespace 缓存失败: {}'.format(str(e))
-            self.add_system_log(error_msg)
-            print(error_msg)
-            import traceback
-            traceback.print_exc()
+    def _namespace_cache_file(self, namespace: str) -> str:
+        return os.path.expanduser(
+            '~/Library/Application Support/cliExtra/namespaces/{}/namespace_cache.json'.format(namespace)
+        )
     
-    def _is_duplicate_message(self, new_msg: ChatMessage) -> bool:
-        """检查是否为重复消息"""
-        for existing_msg in self.chat_history:
-            if (existing_msg.instance_id == new_msg.instance_id and 
-                existing_msg.message == new_msg.message):
+    def load_namespace_cache_history(self, namespace: str = 'q_cli', force: bool = False):
+        """从 namespace 缓存文件加载历史记录
+        
+        缓存文件的 mtime 和大小未变化时直接使用已解析的记录；
+        文件只是追加了新消息时只解析新增的条目。
+        读取和解析文件时只持有该namespace的加载锁，长轮询的请求不会被阻塞
+        """
+        with self._lock:
+            history = self._get_namespace_history(namespace)
+        
+        with history.load_lock:
+            try:
+                cache_file = self._namespace_cache_file(namespace)
+                try:
+                    stat = os.stat(cache_file)
+                except FileNotFoundError:
+                    with self._lock:
+                        if force or not history.loaded or history.file_state is not None:
+                            history.reset()
+                            self.add_system_log('Namespace 缓存文件不存在: {}'.format(cache_file))
+                            print('缓存文件不存在: {}'.format(cache_file))
+                        history.loaded = True  # 标记为已加载，即使是空的
+                    return
                 
-                # 标准化时间戳后再比较
-                existing_time = self._normalize_datetime(existing_msg.timestamp)
-                new_time = self._normalize_datetime(new_msg.timestamp)
+                file_state = (stat.st_mtime_ns, stat.st_size)
+                if not force and history.loaded and history.file_state == file_state:
+                    return
                 
-                if abs((existing_time - new_time).total_seconds()) < 1:
-                    return True
-        return False
+                with open(cache_file, 'r') as f:
+                    cache_data = json.load(f)
+                message_history = cache_data.get('message_history', [])
+                
+                # 清空历史只在持有 self._lock 时发生，加载锁保证解析期间 parsed_count 不被其它加载修改
+                start = 0
+                if (not force and history.parsed_count
+                        and len(message_history) >= history.parsed_count
+                        and message_history[history.parsed_count - 1] == history.last_entry):
+                    # 只追加了新条目，增量解析
+                    start = history.parsed_count
+                else:
+                    print('重新加载缓存文件: {}，共 {} 条历史消息'.format(cache_file, len(message_history)))
+                parsed_messages = self._parse_messages(message_history[start:])
+                
+                with self._lock:
+                    if start and history.parsed_count != start:
+                        # 解析期间历史被清空，整体重新加载
+                        start = 0
+                        parsed_messages = self._parse_messages(message_history)
+                    if start == 0:
+                        history.buffer.clear()
+                    loaded_count = self._load_messages(history, parsed_messages, prune=start == 0)
+                    history.loaded = True
+                    history.file_state = file_state
+                    history.parsed_count = len(message_history)
+                    history.last_entry = message_history[-1] if message_history else None
+                
+                if loaded_count or start == 0:
+                    self.add_system_log('从 namespace {} 缓存加载了 {} 条历史消息'.format(namespace, loaded_count))
+                
+            except Exception as e:
+                error_msg = '加载 namespace 缓存失败: {}'.format(str(e))
+                self.add_system_log(error_msg)
+                print(error_msg)
+                import traceback
+                traceback.print_exc()
     
-    def get_chat_history(self, limit: int = None, namespace: str = 'q_cli') -> List[Dict]:
-        """获取聊天历史，支持动态切换namespace"""
-        # 检查是否需要重新加载不同namespace的缓存
-        if not self.namespace_cache_loaded or getattr(self, 'current_namespace', None) != namespace:
-            self.load_namespace_cache_history(namespace)
-            self.current_namespace = namespace  # 记录当前加载的namespace
+    def _parse_messages(self, entries: List[Dict]) -> List[ChatMessage]:
+        """把缓存条目转换为 ChatMessage，按时间排序"""
+        parsed_messages = []
+        for i, msg_data in enumerate(entries):
+            try:
+                parsed_messages.append(self._parse_cache_message(msg_data))
+            except Exception as e:
+                print('解析消息 {} 失败: {}'.format(i, str(e)))
+                self.add_system_log('解析消息失败: {}'.format(str(e)))
+        parsed_messages.sort(key=lambda msg: msg.timestamp)
+        return parsed_messages
+    
+    def _load_messages(self, history: _NamespaceHistory, parsed_messages: List[ChatMessage], prune: bool = False) -> int:
+        """按时间顺序为消息分配ID（已加载过的消息沿用原ID）并加入历史记录，跳过重复消息（调用方持有self._lock）
         
-        if limit:
-            history = list(self.chat_history)[-limit:]
+        Args:
+            prune: 整体重新加载时为True，只保留仍在缓存文件中的消息的ID映射
+        """
+        buffer = history.buffer
+        message_ids = {} if prune else history.message_ids
+        accepted = []
+        for chat_msg in parsed_messages:
+            if buffer.is_duplicate(chat_msg):
+                continue
+            key = (chat_msg.instance_id, chat_msg.message, chat_msg.timestamp)
+            chat_msg.id = history.message_ids.get(key) or next(self._message_ids)
+            message_ids[key] = chat_msg.id
+            # 先加入索引，同一批中的重复消息也能被发现
+            buffer.append(chat_msg)
+            accepted.append(chat_msg)
+        history.message_ids = message_ids
+        if len(message_ids) > 2 * buffer.capacity:
+            # 只保留仍在缓冲区中的消息
+            kept = {msg.id for msg in buffer}
+            history.message_ids = {key: message_id for key, message_id in message_ids.items() if message_id in kept}
+        if accepted:
+            self._new_messages.notify_all()
+        return len(accepted)
+    
+    def _parse_cache_message(self, msg_data: Dict) -> ChatMessage:
+        """解析namespace缓存中的一条消息"""
+        # 解析时间戳
+        timestamp_str = msg_data.get('timestamp', '')
+        if timestamp_str:
+            # 处理 ISO 格式的时间戳
+            if timestamp_str.endswith('Z'):
+                timestamp_str = timestamp_str[:-1] + '+00:00'
+            try:
+                timestamp = datetime.fromisoformat(timestamp_str)
+            except:
+                # 如果解析失败，尝试其他格式
+                timestamp = datetime.strptime(timestamp_str.replace('Z', ''), '%Y-%m-%dT%H:%M:%S')
+                timestamp = timestamp.replace(tzinfo=timezone.utc)
         else:
-            history = list(self.chat_history)
+            timestamp = datetime.now(timezone.utc)
         
-        # 按时间排序
-        history.sort(key=lambda msg: msg.timestamp)
+        return ChatMessage(
+            sender=msg_data.get('instance_id', 'unknown'),
+            message=msg_data.get('message', ''),
+            timestamp=self._normalize_datetime(timestamp),
+            instance_id=msg_data.get('instance_id'),
+            message_type='chat'
+        )
+    
+    def _is_duplicate_message(self, new_msg: ChatMessage) -> bool:
+        """检查是否为重复消息（时间戳在加入前已标准化，通过哈希索引O(1)查找）"""
+        return self.chat_history.is_duplicate(new_msg)
+    
+    def get_chat_history(self, limit: int = None, namespace: str = 'q_cli') -> List[Dict]:
+        """获取聊天历史，各namespace的记录分别缓存，切换namespace不再清空重新解析"""
+        return self.get_chat_page(namespace, limit)['history']
+    
+    def get_chat_page(self, namespace: str = 'q_cli', limit: int = None, since_id: int = None,
+                      before_id: int = None, wait: float = 0) -> Dict:
+        """按消息ID游标获取聊天历史
         
-        return [msg.to_dict() for msg in history]
+        Args:
+            since_id: 只返回ID大于since_id的新消息（增量轮询）
+            before_id: 返回ID小于before_id的更早消息（向前翻页）
+            wait: 指定since_id且暂无新消息时，最多等待的秒数（长轮询）
+            
+        Returns:
+            {'history': [...], 'latest_id': 当前最新消息ID, 'has_more': 游标方向上是否还有更多消息}
+        """
+        deadline = time.time() + wait
+        while True:
+            # 检查和解析缓存文件时不持有全局锁
+            self.load_namespace_cache_history(namespace)
+            with self._lock:
+                buffer = self._get_namespace_history(namespace).buffer
+                if since_id is not None:
+                    messages, has_more = buffer.after(since_id, limit)
+                elif before_id is not None:
+                    messages, has_more = buffer.before(before_id, limit)
+                else:
+                    # 历史记录已按ID顺序保存，只取尾部
+                    messages = buffer.tail(limit)
+                    has_more = len(buffer) > len(messages)
+                
+                remaining = deadline - time.time()
+                if messages or since_id is None or remaining <= 0:
+                    return {
+                        'history': [msg.to_dict() for msg in messages],
+                        'latest_id': buffer.latest_id,
+                        'has_more': has_more
+                    }
+                # 缓存文件由cliExtra写入，不会触发通知，等待期间定期重新检查
+                self._new_messages.wait(min(remaining, self.config.CHAT_LONG_POLL_CHECK_INTERVAL))
     
     def get_persistent_chat_history(self, instance_id: str, namespace: str = None) -> List[Dict]:
         """从持久化存储获取聊天历史"""
@@ -231,19 +510,18 @@ class ChatManager:
         
         return matches, clean_message
     
-    def clear_chat_history(self):
-        """清空聊天历史"""
-        self.chat_history.clear()
-        self.namespace_cache_loaded = False
+    def clear_chat_history(self, namespace: str = None):
+        """清空namespace（为空时为默认namespace）的聊天历史（下次读取时重新加载缓存文件）"""
+        with self._lock:
+            self._get_namespace_history(namespace or self.current_namespace).reset()
     
     def clear_system_logs(self):
         """清空系统日志"""
         self.system_logs.clear()
     
     def refresh_cache_history(self, namespace: str = 'q_cli'):
-        """刷新缓存历史记录"""
-        self.namespace_cache_loaded = False
-        self.load_namespace_cache_history(namespace)
+        """刷新缓存历史记录（强制重新解析整个缓存文件）"""
+        self.load_namespace_cache_history(namespace, force=True)
 
 # 全局聊天管理器
 chat_manager = ChatManager()
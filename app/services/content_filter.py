@@ -3,7 +3,65 @@
 用于清理Q CLI输出，只保留实际的AI回复内容
 """
 import re
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+from app.services.ansi_stripper import strip_ansi
+
+_LEADING_PROMPT = re.compile(r'^[\s>]*')
+_TRAILING_CONTROLS = re.compile(r'[\x00-\x1f\x7f-\x9f]*$')
+_EXTRA_EMPTY_LINES = re.compile(r'\n\s*\n\s*\n+')
+
+# 发言者标识，按 用户输入 -> AI输出 -> 系统消息 的顺序检测
+_SPEAKER_PATTERNS = [(speaker_type, re.compile('|'.join(patterns))) for speaker_type, patterns in (
+    ('user', [
+        r'^!>\s*(.*)$',                     # !> 用户输入
+        r'^User:\s*(.*)$',                  # User: 格式
+        r'^你:\s*(.*)$',                    # 中文用户标识
+        r'^Question:\s*(.*)$',              # Question: 格式
+        r'^>\s+(.+)$'                       # > 后面跟内容（用户输入）
+    ]),
+    ('assistant', [
+        r'^>\s*$',                          # 单独的 > （AI开始响应）
+        r'^>\[0m\s*(.*)$',                  # >[0m AI响应
+        r'^Assistant:\s*(.*)$',             # Assistant: 格式
+        r'^AI:\s*(.*)$',                    # AI: 格式
+        r'^回答:\s*(.*)$',                  # 中文回答标识
+        r'^Answer:\s*(.*)$'                 # Answer: 格式
+    ]),
+    ('system', [
+        r'^System:\s*(.*)$',                # System: 格式
+        r'^系统:\s*(.*)$',                  # 中文系统标识
+        r'^\[系统\]\s*(.*)$',               # [系统] 格式
+        r'^\[INFO\]\s*(.*)$',               # [INFO] 格式
+        r'^\[ERROR\]\s*(.*)$'               # [ERROR] 格式
+    ])
+)]
+
+# 不属于消息继续行的内容：分隔符、系统信息、时间、新的发言者标识
+_NOT_CONTINUATION = re.compile('|'.join([
+    r'^=+$',                            # 等号分隔符
+    r'^-+$',                            # 减号分隔符
+    r'^\[.*\]$',                        # 方括号包围的系统信息
+    r'Thinking\.\.\.',                  # Thinking... (完全匹配)
+    r'Loading\.\.\.',                   # Loading... (完全匹配)
+    r'^\d{4}-\d{2}-\d{2}',             # 日期格式
+    r'^\d{2}:\d{2}:\d{2}',             # 时间格式
+    r'^[>!>]\s*',                       # 新的发言者标识
+    r'^(?:User|Assistant|AI|System|你|回答|系统):\s*'  # 角色标识
+]))
+
+# 常见的时间格式
+_TIMESTAMP_PATTERNS = [re.compile(pattern) for pattern in (
+    r'(\d{2}:\d{2}:\d{2})',             # HH:MM:SS
+    r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})',  # YYYY-MM-DD HH:MM:SS
+    r'\[(\d{2}:\d{2}:\d{2})\]'          # [HH:MM:SS]
+)]
+
+# 纯系统噪音消息
+_SYSTEM_NOISE = ('Thinking...', 'Loading...', 'Please wait...', '请稍等...', 'hi', '...')
+
+# 解析结果中每条对话的字段
+_CONVERSATION_FIELDS = ('type', 'content', 'timestamp', 'raw_content', 'needs_rich_text', 'id')
 
 class ContentFilter:
     """内容过滤器"""
@@ -39,8 +97,8 @@ class ContentFilter:
             r'^[\x1b\[\d;]*[mK]*$',
         ]
         
-        # 编译正则表达式以提高性能
-        self.compiled_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in self.ui_patterns]
+        # 合并编译为一个正则，每行只匹配一次
+        self.ui_pattern = re.compile('|'.join(f'(?:{pattern})' for pattern in self.ui_patterns), re.IGNORECASE)
     
     def clean_content(self, raw_content: str) -> str:
         """
@@ -55,13 +113,11 @@ class ContentFilter:
         if not raw_content:
             return ""
         
-        lines = raw_content.split('\n')
+        # 整段内容一次性移除ANSI转义序列（控制序列不跨行，行数不变）
+        lines = self._remove_ansi_sequences(raw_content).split('\n')
         cleaned_lines = []
         
-        for line in lines:
-            # 移除ANSI转义序列
-            clean_line = self._remove_ansi_sequences(line)
-            
+        for clean_line in lines:
             # 检查是否是UI元素
             if not self._is_ui_element(clean_line):
                 # 进一步清理内容
@@ -76,34 +132,27 @@ class ContentFilter:
         return result.strip()
     
     def _remove_ansi_sequences(self, text: str) -> str:
-        """移除ANSI转义序列"""
-        # 移除ANSI颜色和控制序列
-        ansi_pattern = re.compile(r'\x1b\[[0-9;]*[mK]')
-        text = ansi_pattern.sub('', text)
-        
-        # 移除其他控制字符
-        control_pattern = re.compile(r'\x1b\[[?]?\d*[hl]')
-        text = control_pattern.sub('', text)
-        
-        return text
+        """移除ANSI转义序列（CSI、OSC、DCS、光标控制、8位CSI等）和控制字符"""
+        return strip_ansi(text)
     
     def _is_ui_element(self, line: str) -> bool:
         """检查是否是UI元素"""
-        for pattern in self.compiled_patterns:
-            if pattern.match(line):
-                return True
-        return False
+        return self.ui_pattern.match(line) is not None
     
     def _process_content_line(self, line: str) -> str:
         """处理内容行"""
         # 移除行首的特殊字符（如 > 提示符）
-        line = re.sub(r'^[\s>]*', '', line)
+        line = _LEADING_PROMPT.sub('', line)
         
         # 移除行尾的控制字符
-        line = re.sub(r'[\x00-\x1f\x7f-\x9f]*$', '', line)
+        line = _TRAILING_CONTROLS.sub('', line)
         
         return line
     
+    def _merge_empty_lines(self, content: str) -> str:
+        """合并连续的空行，最多保留一个空行"""
+        return _EXTRA_EMPTY_LINES.sub('\n\n', content)
+    
     def parse_conversation(self, raw_content: str) -> List[Dict[str, Any]]:
         """
         解析对话内容，区分AI输出和用户输入
@@ -117,64 +166,16 @@ class ContentFilter:
         if not raw_content:
             return []
         
-        lines = raw_content.split('\n')
-        conversations = []
-        current_message = {
-            'type': None,
-            'content': '',
-            'timestamp': None,
-            'raw_lines': []
-        }
-        
-        for line in lines:
-            # 清理ANSI序列
-            clean_line = self._remove_ansi_sequences(line)
-            
-            # 检测发言者标识
-            speaker_info = self._detect_speaker(clean_line)
-            
-            if speaker_info:
-                # 保存之前的消息
-                if current_message['type'] and current_message['content'].strip():
-                    conversations.append({
-                        'type': current_message['type'],
-                        'content': current_message['content'].strip(),
-                        'timestamp': current_message['timestamp'] or self._extract_timestamp(line),
-                        'raw_content': '\n'.join(current_message['raw_lines'])
-                    })
-                
-                # 开始新消息
-                current_message = {
-                    'type': speaker_info['type'],
-                    'content': speaker_info['content'],
-                    'timestamp': speaker_info['timestamp'] or self._extract_timestamp(line),
-                    'raw_lines': [line]
-                }
-            elif current_message['type'] and self._is_message_continuation(clean_line):
-                # 继续当前消息
-                current_message['content'] += '\n' + clean_line
-                current_message['raw_lines'].append(line)
-            elif current_message['type']:
-                # 消息结束，保存当前消息
-                if current_message['content'].strip():
-                    conversations.append({
-                        'type': current_message['type'],
-                        'content': current_message['content'].strip(),
-                        'timestamp': current_message['timestamp'],
-                        'raw_content': '\n'.join(current_message['raw_lines'])
-                    })
-                current_message = {'type': None, 'content': '', 'timestamp': None, 'raw_lines': []}
-        
-        # 保存最后一条消息
-        if current_message['type'] and current_message['content'].strip():
-            conversations.append({
-                'type': current_message['type'],
-                'content': current_message['content'].strip(),
-                'timestamp': current_message['timestamp'],
-                'raw_content': '\n'.join(current_message['raw_lines'])
-            })
+        # 与实时流式解析共用同一个解析器，整段内容一次送入
+        from app.services.conversation_stream import ConversationParser
+        parser = ConversationParser(content_filter=self)
+        events = parser.feed(raw_content) + parser.flush()
         
-        return self._filter_conversations(conversations)
+        conversations = []
+        for event, data in events:
+            if event == 'message_completed' and not data['discarded']:
+                conversations.append({key: data[key] for key in _CONVERSATION_FIELDS})
+        return conversations
     
     def _detect_speaker(self, line: str) -> Dict[str, Any]:
         """
@@ -186,61 +187,14 @@ class ContentFilter:
         Returns:
             发言者信息字典，包含 type, content, timestamp
         """
-        # 用户输入标识：!> 开头
-        user_patterns = [
-            r'^!>\s*(.*)$',                     # !> 用户输入
-            r'^User:\s*(.*)$',                  # User: 格式
-            r'^你:\s*(.*)$',                    # 中文用户标识
-            r'^Question:\s*(.*)$',              # Question: 格式
-            r'^>\s+(.+)$'                       # > 后面跟内容（用户输入）
-        ]
-        
-        # AI输出标识：> 开头（但不是用户输入）
-        ai_patterns = [
-            r'^>\s*$',                          # 单独的 > （AI开始响应）
-            r'^>\[0m\s*(.*)$',                  # >[0m AI响应
-            r'^Assistant:\s*(.*)$',             # Assistant: 格式
-            r'^AI:\s*(.*)$',                    # AI: 格式
-            r'^回答:\s*(.*)$',                  # 中文回答标识
-            r'^Answer:\s*(.*)$'                 # Answer: 格式
-        ]
-        
-        # 系统消息标识
-        system_patterns = [
-            r'^System:\s*(.*)$',                # System: 格式
-            r'^系统:\s*(.*)$',                  # 中文系统标识
-            r'^\[系统\]\s*(.*)$',               # [系统] 格式
-            r'^\[INFO\]\s*(.*)$',               # [INFO] 格式
-            r'^\[ERROR\]\s*(.*)$'               # [ERROR] 格式
-        ]
-        
-        # 检测用户输入
-        for pattern in user_patterns:
-            match = re.match(pattern, line)
-            if match:
-                return {
-                    'type': 'user',
-                    'content': match.group(1).strip() if match.group(1) else '',
-                    'timestamp': self._extract_timestamp(line)
-                }
-        
-        # 检测AI输出
-        for pattern in ai_patterns:
-            match = re.match(pattern, line)
+        # 依次检测用户输入、AI输出和系统消息
+        for speaker_type, pattern in _SPEAKER_PATTERNS:
+            match = pattern.match(line)
             if match:
+                content = next((group for group in match.groups() if group), '')
                 return {
-                    'type': 'assistant',
-                    'content': match.group(1).strip() if len(match.groups()) > 0 and match.group(1) else '',
-                    'timestamp': self._extract_timestamp(line)
-                }
-        
-        # 检测系统消息
-        for pattern in system_patterns:
-            match = re.match(pattern, line)
-            if match:
-                return {
-                    'type': 'system',
-                    'content': match.group(1).strip() if match.group(1) else '',
+                    'type': speaker_type,
+                    'content': content.strip(),
                     'timestamp': self._extract_timestamp(line)
                 }
         
@@ -257,21 +211,8 @@ class ContentFilter:
             是否为消息继续
         """
         # 排除明显的分隔符和系统信息
-        exclude_patterns = [
-            r'^=+$',                            # 等号分隔符
-            r'^-+$',                            # 减号分隔符
-            r'^\[.*\]$',                        # 方括号包围的系统信息
-            r'Thinking\.\.\.',                  # Thinking... (完全匹配)
-            r'Loading\.\.\.',                   # Loading... (完全匹配)
-            r'^\d{4}-\d{2}-\d{2}',             # 日期格式
-            r'^\d{2}:\d{2}:\d{2}',             # 时间格式
-            r'^[>!>]\s*',                       # 新的发言者标识
-            r'^(User|Assistant|AI|System|你|回答|系统):\s*'  # 角色标识
-        ]
-        
-        for pattern in exclude_patterns:
-            if re.match(pattern, line):
-                return False
+        if _NOT_CONTINUATION.match(line):
+            return False
         
         return line.strip() != ''
     
@@ -285,15 +226,8 @@ class ContentFilter:
         Returns:
             时间戳字符串
         """
-        # 匹配常见的时间格式
-        time_patterns = [
-            r'(\d{2}:\d{2}:\d{2})',             # HH:MM:SS
-            r'(\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2})',  # YYYY-MM-DD HH:MM:SS
-            r'\[(\d{2}:\d{2}:\d{2})\]'          # [HH:MM:SS]
-        ]
-        
-        for pattern in time_patterns:
-            match = re.search(pattern, line)
+        for pattern in _TIMESTAMP_PATTERNS:
+            match = pattern.search(line)
             if match:
                 return match.group(1)
         
@@ -314,34 +248,40 @@ class ContentFilter:
         filtered = []
         
         for conv in conversations:
-            # 过滤掉太短的消息
-            if len(conv['content']) < 2:
-                continue
-            
-            # 过滤掉纯系统噪音
-            system_noise = [
-                'Thinking...',
-                'Loading...',
-                'Please wait...',
-                '请稍等...',
-                'hi',
-                '...'
-            ]
-            
-            if any(noise in conv['content'] for noise in system_noise):
-                continue
-            
-            # 清理内容
-            conv['content'] = self._clean_conversation_content(conv['content'])
-            
-            # 添加处理标记
-            conv['needs_rich_text'] = self._needs_rich_text_rendering(conv['content'])
-            conv['id'] = f"{conv['type']}_{len(filtered)}_{hash(conv['content']) % 10000}"
-            
-            filtered.append(conv)
+            conv = self._finalize_conversation(conv, len(filtered))
+            if conv is not None:
+                filtered.append(conv)
         
         return filtered
     
+    def _finalize_conversation(self, conv: Dict[str, Any], index: int) -> Optional[Dict[str, Any]]:
+        """
+        过滤和清理单条对话消息
+        
+        Args:
+            conv: 对话消息
+            index: 该消息在已保留消息中的序号
+            
+        Returns:
+            清理后的消息，太短或为系统噪音时返回None
+        """
+        # 过滤掉太短的消息
+        if len(conv['content']) < 2:
+            return None
+        
+        # 过滤掉纯系统噪音
+        if any(noise in conv['content'] for noise in _SYSTEM_NOISE):
+            return None
+        
+        # 清理内容
+        conv['content'] = self._clean_conversation_content(conv['content'])
+        
+        # 添加处理标记
+        conv['needs_rich_text'] = self._needs_rich_text_rendering(conv['content'])
+        conv['id'] = f"{conv['type']}_{index}_{hash(conv['content']) % 10000}"
+        
+        return conv
+    
     def _clean_conversation_content(self, content: str) -> str:
         """
         清理对话内容
@@ -353,7 +293,7 @@ class ContentFilter:
             清理后的内容
         """
         # 移除多余的空行
-        content = re.sub(r'\n\s*\n\s*\n+', '\n\n', content)
+        content = self._merge_empty_lines(content)
         
         # 移除行首的提示符残留
         lines = content.split('\n')
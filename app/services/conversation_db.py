@@ -0,0 +1,324 @@
+"""
+对话记录数据库
+所有实例的对话记录和聊天消息写入同一个本地SQLite数据库（WAL模式）：
+- 写入只放入队列，由唯一的写线程批量插入，不阻塞调用方
+- 按 namespace / 实例 / 时间范围的查询走复合索引
+- FTS5（trigram分词，支持中文子串）全文搜索
+- 同一实例、同一时间、同一发送者和内容的消息只保存一次，回填与实时写入重叠时不会重复
+读取使用每个线程独立的连接，WAL模式下读写互不阻塞
+"""
+import os
+import time
+import hashlib
+import queue
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Union
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+TABLE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    instance_id TEXT,
+    sender TEXT,
+    message_type TEXT,
+    source TEXT,
+    message TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    message_hash INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_messages_namespace_time ON messages(namespace, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_instance_time ON messages(instance_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_time ON messages(timestamp);
+'''
+
+TRIGGER_SCHEMA = '''
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+'''
+
+# 去重键，须在旧数据库补齐 message_hash 之后创建
+UNIQUE_SCHEMA = '''
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_unique ON messages(instance_id, timestamp, message_hash);
+'''
+
+INSERT_SQL = ('INSERT OR IGNORE INTO messages '
+              '(namespace, instance_id, sender, message_type, source, message, timestamp, message_hash) '
+              'VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+
+# PRAGMA user_version 达到该值表示已完成从对话记录存储的回填
+BACKFILL_DONE_VERSION = 1
+
+# trigram分词器的最短匹配长度，更短的关键词用LIKE扫描
+MIN_FTS_QUERY_CHARS = 3
+
+def message_hash(sender: Optional[str], message: str) -> int:
+    """发送者和消息内容的64位摘要（有符号，可直接存入SQLite INTEGER）"""
+    digest = hashlib.blake2b(f'{sender or ""}\0{message}'.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+def to_epoch(value: Union[str, int, float, datetime, None]) -> Optional[float]:
+    """把ISO时间字符串、datetime或数字时间戳转换为秒级时间戳（不带时区的时间按本地时间处理）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value).timestamp()
+
+class ConversationDatabase:
+    """对话记录数据库"""
+
+    def __init__(self, path: str = None, manager=None, batch_size: int = None, flush_interval: float = None,
+                 backfill: bool = True):
+        self._path = path or Config.CONVERSATION_DB_PATH
+        self._manager = manager
+        self.backfill = backfill  # 是否导入对话记录存储中已有的记录（直到完成一次为止）
+        self.batch_size = batch_size or Config.CONVERSATION_DB_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.CONVERSATION_DB_FLUSH_INTERVAL
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+        self._available = False
+        self._writer = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            if self._manager is None:
+                from app.services.instance_manager import instance_manager
+                self._manager = instance_manager
+            self._path = os.path.join(self._manager.work_dir, 'conversations.db')
+        return self._path
+
+    def _ensure_initialized(self) -> bool:
+        """首次使用时建表并启动写线程，数据库无法打开时返回False"""
+        if self._initialized:
+            return self._available
+        with self._init_lock:
+            if self._initialized:
+                return self._available
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                conn = self._connect()
+                conn.executescript(TABLE_SCHEMA)
+                self._create_fts_table(conn)
+                conn.executescript(TRIGGER_SCHEMA)
+                self._migrate_unique(conn)
+                backfilled = conn.execute('PRAGMA user_version').fetchone()[0] >= BACKFILL_DONE_VERSION
+                conn.close()
+                self._writer = threading.Thread(target=self._run_writer, daemon=True, name='conversation_db_writer')
+                self._writer.start()
+                self._available = True
+                if self.backfill and not backfilled:
+                    # 在后台导入已有的对话记录，与实时写入重叠的消息由唯一索引去重；中断后下次启动继续
+                    threading.Thread(target=self._backfill, daemon=True, name='conversation_db_backfill').start()
+            except (OSError, sqlite3.Error) as e:
+                logger.error(f'打开对话记录数据库失败 {self.path}: {e}')
+                self._available = False
+            self._initialized = True
+        return self._available
+
+    @staticmethod
+    def _migrate_unique(conn: sqlite3.Connection):
+        """为旧数据库补齐 message_hash、删除重复的消息并创建去重索引（已有去重索引时跳过）"""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_messages_unique'").fetchone():
+            return
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(messages)')]
+        with conn:
+            if 'message_hash' not in columns:
+                conn.execute('ALTER TABLE messages ADD COLUMN message_hash INTEGER')
+            conn.create_function('message_hash', 2, message_hash, deterministic=True)
+            conn.execute('UPDATE messages SET message_hash = message_hash(sender, message) WHERE message_hash IS NULL')
+            removed = conn.execute(
+                'DELETE FROM messages WHERE instance_id IS NOT NULL AND id NOT IN '
+                '(SELECT MIN(id) FROM messages GROUP BY instance_id, timestamp, message_hash)'
+            ).rowcount
+            conn.execute(UNIQUE_SCHEMA)
+        if removed > 0:
+            logger.info(f'已删除 {removed} 条重复的对话记录')
+
+    @staticmethod
+    def _create_fts_table(conn: sqlite3.Connection):
+        """优先使用trigram分词（SQLite 3.34+），否则退回默认的unicode61分词"""
+        sql = ("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+               "message, content='messages', content_rowid='id'{})")
+        try:
+            conn.execute(sql.format(", tokenize='trigram'"))
+        except sqlite3.OperationalError:
+            conn.execute(sql.format(''))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """当前线程的只读查询连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def record(self, namespace: str, instance_id: Optional[str], sender: str, message: str,
+               timestamp: Union[str, float, datetime, None] = None, message_type: str = 'chat',
+               source: str = 'conversation'):
+        """记录一条消息（放入写队列后立即返回）"""
+        if not message or not self._ensure_initialized():
+            return
+        try:
+            epoch = to_epoch(timestamp)
+        except ValueError:
+            epoch = None
+        self._queue.put((namespace or 'default', instance_id, sender, message_type, source, message,
+                         epoch if epoch is not None else time.time(), message_hash(sender, message)))
+
+    def _run_writer(self):
+        """唯一的写线程：攒够一批或等待flush_interval后在一个事务中插入"""
+        conn = self._connect()
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(INSERT_SQL, batch)
+            except sqlite3.Error as e:
+                logger.error(f'写入对话记录数据库失败（{len(batch)} 条）: {e}')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """等待队列中的消息全部写入"""
+        if self._ensure_initialized():
+            self._queue.join()
+
+    def query(self, namespace: str = None, instance_id: str = None, sender: str = None,
+              text: str = None, since: Any = None, until: Any = None,
+              cursor: str = None, limit: int = 100) -> Dict[str, Any]:
+        """按条件查询消息（按时间倒序）
+
+        Args:
+            text: 全文搜索关键词
+            since / until: 时间范围（ISO时间字符串或秒级时间戳）
+            cursor: 上一页返回的 next_cursor
+
+        Returns:
+            {'messages': [...], 'has_more': bool, 'next_cursor': 下一页游标}
+
+        Raises:
+            ValueError: 时间或游标格式无效
+        """
+        if not self._ensure_initialized():
+            return {'messages': [], 'has_more': False, 'next_cursor': None}
+
+        conditions, params = [], []
+        if text:
+            if len(text) >= MIN_FTS_QUERY_CHARS:
+                # 用子查询先取出全部匹配的rowid；写成JOIN时查询计划可能逐行执行MATCH
+                conditions.append('m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)')
+                # 作为整体短语匹配，避免关键词中的FTS语法字符
+                params.append('"{}"'.format(text.replace('"', '""')))
+            else:
+                conditions.append("m.message LIKE ? ESCAPE '\\'")
+                escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params.append(f'%{escaped}%')
+        for column, value in (('namespace', namespace), ('instance_id', instance_id), ('sender', sender)):
+            if value:
+                conditions.append(f'm.{column} = ?')
+                params.append(value)
+        since, until = to_epoch(since), to_epoch(until)
+        if since is not None:
+            conditions.append('m.timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('m.timestamp < ?')
+            params.append(until)
+        if cursor:
+            # 游标为上一页最后一条的 "时间戳:ID"，同一时间戳的消息按ID区分
+            timestamp, message_id = cursor.rsplit(':', 1)
+            conditions.append('(m.timestamp, m.id) < (?, ?)')
+            params.extend([float(timestamp), int(message_id)])
+
+        sql = 'SELECT m.* FROM messages m'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY m.timestamp DESC, m.id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        rows = self._reader().execute(sql, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            'messages': [self._row_to_dict(row) for row in rows],
+            'has_more': has_more,
+            'next_cursor': f"{rows[-1]['timestamp']!r}:{rows[-1]['id']}" if has_more else None
+        }
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        message = dict(row)
+        message['timestamp'] = datetime.fromtimestamp(message['timestamp']).isoformat()
+        return message
+
+    def _backfill(self):
+        try:
+            self.import_conversations()
+            conn = self._connect()
+            conn.execute(f'PRAGMA user_version = {BACKFILL_DONE_VERSION}')
+            conn.close()
+        except Exception as e:
+            logger.error(f'导入已有对话记录失败: {e}')
+
+    def import_conversations(self, namespaces: List[str] = None) -> int:
+        """把对话记录存储中已有的记录导入数据库（用于首次启用时回填，已有的消息会被忽略），返回读取的条数"""
+        from app.services.conversation_store import conversation_store
+        if not self._ensure_initialized():
+            return 0
+        if namespaces is None:
+            try:
+                namespaces = os.listdir(os.path.join(conversation_store.manager.work_dir, 'namespaces'))
+            except FileNotFoundError:
+                return 0
+
+        imported = 0
+        for namespace in namespaces:
+            for instance_id in conversation_store.list_instances(namespace):
+                for message in conversation_store.iter_reverse(instance_id, namespace):
+                    self.record(namespace, instance_id, message.get('sender'), message.get('message'),
+                                message.get('timestamp'))
+                    imported += 1
+        self.flush()
+        logger.info(f'已导入 {imported} 条对话记录到数据库')
+        return imported
+
+# 全局对话记录数据库
+conversation_db = ConversationDatabase()
@@ -0,0 +1,306 @@
+"""
+实例对话记录存储
+每个实例一个目录 conversations/<instance_id>/，消息以JSON行追加到分段文件（00000001.jsonl ...）中：
+- 写入只追加一行，fsync由后台线程批量执行
+- 当前分段超过 CONVERSATION_SEGMENT_BYTES 时切换到新分段；相邻的已封存分段在后台合并为
+  不超过 CONVERSATION_COMPACT_BYTES 的大分段（凑满后才合并，每个字节只重写一次）
+- 读取时从最新分段的末尾按块反向读取，支持 limit/offset，不再限制历史条数
+旧的 <instance_id>.json 文件在首次访问时迁移
+"""
+import os
+import json
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Any
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.jsonl'
+
+class _Stream:
+    """单个实例的对话记录状态"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.active: Optional[str] = None  # 当前写入的分段
+        self.active_size = 0
+        self.compacting = False
+
+class ConversationStore:
+    """分段追加写入的对话记录存储"""
+
+    def __init__(self, manager=None, segment_bytes: int = None, fsync_interval: float = None,
+                 read_block_bytes: int = None, compact_bytes: int = None):
+        self._manager = manager
+        self.segment_bytes = segment_bytes or Config.CONVERSATION_SEGMENT_BYTES
+        self.compact_bytes = compact_bytes or Config.CONVERSATION_COMPACT_BYTES
+        self.read_block_bytes = read_block_bytes or Config.CONVERSATION_READ_BLOCK_BYTES
+        self.fsync_interval = fsync_interval or Config.CONVERSATION_FSYNC_INTERVAL
+        self._streams: Dict[str, _Stream] = {}
+        self._streams_lock = threading.Lock()
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._flush_event = threading.Event()
+        self._flusher = None
+
+    @property
+    def manager(self):
+        if self._manager is None:
+            from app.services.instance_manager import instance_manager
+            self._manager = instance_manager
+        return self._manager
+
+    def _get_stream(self, instance_id: str, namespace: str) -> _Stream:
+        directory = os.path.join(self.manager.get_namespace_conversations_dir(namespace), instance_id)
+        with self._streams_lock:
+            stream = self._streams.get(directory)
+            if stream is None:
+                stream = self._streams[directory] = _Stream(directory)
+        return stream
+
+    @staticmethod
+    def _segments(directory: str) -> List[str]:
+        """按顺序列出分段文件"""
+        try:
+            names = sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+        except FileNotFoundError:
+            return []
+        return [os.path.join(directory, name) for name in names]
+
+    def _migrate_legacy(self, instance_id: str, namespace: str, stream: _Stream):
+        """把旧的整文件JSON记录迁移为第一个分段（调用方持有stream.lock）"""
+        legacy_path = self.manager.get_instance_conversation_path(instance_id, namespace)
+        if not os.path.exists(legacy_path) or os.path.isdir(stream.directory):
+            return
+        try:
+            with open(legacy_path, 'r', encoding='utf-8') as f:
+                conversations = json.load(f).get('conversations', [])
+        except (OSError, ValueError) as e:
+            logger.warning(f'读取旧对话记录失败 {legacy_path}: {e}')
+            return
+
+        os.makedirs(stream.directory, exist_ok=True)
+        segment = os.path.join(stream.directory, f'{1:08d}{SEGMENT_SUFFIX}')
+        with open(segment, 'w', encoding='utf-8') as f:
+            for message in conversations:
+                f.write(json.dumps(message, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(legacy_path, legacy_path + '.migrated')
+        logger.info(f'已迁移旧对话记录 {legacy_path}: {len(conversations)} 条')
+
+    def append(self, instance_id: str, namespace: str, message: Dict[str, Any]):
+        """追加一条消息（O(1)，fsync由后台批量执行）"""
+        line = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+        stream = self._get_stream(instance_id, namespace)
+        rotated = False
+
+        with stream.lock:
+            if stream.active is None:
+                self._migrate_legacy(instance_id, namespace, stream)
+                os.makedirs(stream.directory, exist_ok=True)
+                segments = self._segments(stream.directory)
+                stream.active = segments[-1] if segments else os.path.join(stream.directory, f'{1:08d}{SEGMENT_SUFFIX}')
+                stream.active_size = os.path.getsize(stream.active) if os.path.exists(stream.active) else 0
+                if stream.active_size and not self._ends_with_newline(stream.active):
+                    # 上次写入中断留下的半行，先补上换行，避免与新消息粘连
+                    line = b'\n' + line
+
+            if stream.active_size >= self.segment_bytes:
+                number = int(os.path.basename(stream.active)[:-len(SEGMENT_SUFFIX)]) + 1
+                self._mark_dirty(stream.active)
+                stream.active = os.path.join(stream.directory, f'{number:08d}{SEGMENT_SUFFIX}')
+                stream.active_size = 0
+                rotated = True
+
+            fd = os.open(stream.active, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            stream.active_size += len(line)
+
+        self._mark_dirty(stream.active)
+        if rotated:
+            self._compact_in_background(stream)
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        with open(path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+
+    def _mark_dirty(self, path: str):
+        with self._dirty_lock:
+            self._dirty.add(path)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, daemon=True, name='conversation_fsync')
+                self._flusher.start()
+
+    def _run_flusher(self):
+        """定期对有新写入的分段执行fsync"""
+        while True:
+            self._flush_event.wait(self.fsync_interval)
+            self._flush_event.clear()
+            self._fsync_dirty()
+
+    def _fsync_dirty(self):
+        with self._dirty_lock:
+            paths, self._dirty = self._dirty, set()
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except FileNotFoundError:
+                # 分段已被合并，合并时已经fsync
+                continue
+            except OSError as e:
+                logger.warning(f'同步对话记录失败 {path}: {e}')
+
+    def flush(self):
+        """立即fsync所有待同步的分段"""
+        self._fsync_dirty()
+
+    def iter_reverse(self, instance_id: str, namespace: str) -> Iterator[Dict[str, Any]]:
+        """从最新到最旧依次返回消息（只读取实际用到的块，提前停止迭代时不会读取整个分段）"""
+        stream = self._get_stream(instance_id, namespace)
+        with stream.lock:
+            self._migrate_legacy(instance_id, namespace, stream)
+            # 在锁内打开所有分段，之后的合并不会影响本次读取
+            handles = []
+            for segment in self._segments(stream.directory):
+                try:
+                    handles.append(open(segment, 'rb'))
+                except FileNotFoundError:
+                    continue
+
+        try:
+            for handle in reversed(handles):
+                for line in self._reverse_lines(handle):
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # 写入中断留下的不完整行
+                        continue
+        finally:
+            for handle in handles:
+                handle.close()
+
+    def _reverse_lines(self, handle) -> Iterator[bytes]:
+        """从文件末尾按块向前读取，依次返回各行（不含换行符）"""
+        position = handle.seek(0, os.SEEK_END)
+        carry = b''
+        while position > 0:
+            size = min(self.read_block_bytes, position)
+            position -= size
+            handle.seek(position)
+            lines = (handle.read(size) + carry).split(b'\n')
+            # 块开头可能是上一块中某行的后半部分，留到读取上一块时拼接
+            carry = lines.pop(0)
+            yield from reversed(lines)
+        yield carry
+
+    def read(self, instance_id: str, namespace: str, limit: int = None, offset: int = 0) -> List[Dict[str, Any]]:
+        """读取对话记录（按时间正序）
+
+        Args:
+            limit: 返回的最大条数，为空时返回全部
+            offset: 跳过最新的offset条（从末尾向前翻页）
+        """
+        messages = []
+        for index, message in enumerate(self.iter_reverse(instance_id, namespace)):
+            if index < offset:
+                continue
+            if limit is not None and len(messages) >= limit:
+                break
+            messages.append(message)
+        messages.reverse()
+        return messages
+
+    def list_instances(self, namespace: str) -> List[str]:
+        """列出namespace下有对话记录的实例（包括尚未迁移的旧记录）"""
+        conversations_dir = self.manager.get_namespace_conversations_dir(namespace)
+        try:
+            names = os.listdir(conversations_dir)
+        except FileNotFoundError:
+            return []
+        instance_ids = set()
+        for name in names:
+            if name.endswith('.json'):
+                instance_ids.add(name[:-len('.json')])
+            elif os.path.isdir(os.path.join(conversations_dir, name)):
+                instance_ids.add(name)
+        return sorted(instance_ids)
+
+    def _compact_in_background(self, stream: _Stream):
+        with stream.lock:
+            if stream.compacting:
+                return
+            stream.compacting = True
+
+        def run():
+            try:
+                self.compact(stream)
+            except Exception as e:
+                logger.error(f'合并对话记录分段失败 {stream.directory}: {e}')
+            finally:
+                stream.compacting = False
+
+        threading.Thread(target=run, daemon=True, name='conversation_compact').start()
+
+    def compact(self, stream: _Stream):
+        """把相邻的已封存分段合并为不超过 compact_bytes 的大分段，并丢弃不完整的行
+
+        只合并已经凑满的一组分段（再加入下一个分段就会超过上限），末尾未凑满的分段留到以后合并，
+        每个字节只重写一次。已封存分段不再写入，合并在锁外进行，只有替换文件时持有stream.lock
+        """
+        with stream.lock:
+            sealed = [s for s in self._segments(stream.directory) if s != stream.active]
+
+        runs = []
+        current = []
+        current_size = 0
+        for segment in sealed:
+            size = os.path.getsize(segment)
+            if current and current_size + size > self.compact_bytes:
+                runs.append(current)
+                current, current_size = [], 0
+            if size >= self.compact_bytes:
+                # 已经是合并后的分段
+                continue
+            current.append(segment)
+            current_size += size
+
+        for run in runs:
+            if len(run) < 2:
+                continue
+            tmp_path = run[0] + '.tmp'
+            with open(tmp_path, 'wb') as out:
+                for segment in run:
+                    with open(segment, 'rb') as f:
+                        for line in f:
+                            try:
+                                json.loads(line)
+                            except ValueError:
+                                continue
+                            out.write(line if line.endswith(b'\n') else line + b'\n')
+                out.flush()
+                os.fsync(out.fileno())
+
+            # 读取者在锁内列出并打开分段，替换和删除必须一起完成
+            with stream.lock:
+                os.replace(tmp_path, run[0])
+                for segment in run[1:]:
+                    os.remove(segment)
+            logger.info(f'已合并对话记录分段 {stream.directory}: {len(run)} -> 1')
+
+# 全局对话记录存储
+conversation_store = ConversationStore()
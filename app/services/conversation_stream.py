@@ -0,0 +1,281 @@
+"""
+流式对话解析
+每个实例一个有状态的增量解析器，输入任意切分的字节块（或文本），跨调用保留未完成的行、
+当前发言者和消息内容，每个新字节只处理一次：
+- message_started：检测到新的发言者标识
+- message_delta：当前消息的继续行
+- message_completed：消息结束（遇到下一个发言者或非继续行），内容经过与 parse_conversation 相同的过滤和清理，
+  被过滤掉的消息 discarded 为 True，前端据此移除已显示的占位
+实例变为空闲或输出读取者停止时结束当前消息；日志被截断或重建时丢弃解析状态，从头解析新日志；
+解析器创建前已写入日志的输出（例如服务重启后重放的历史）只用于重建解析状态，不推送也不保存
+"""
+import os
+import uuid
+import codecs
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, Union, Any
+
+from app.services.ansi_stripper import strip_ansi
+
+logger = logging.getLogger(__name__)
+
+Event = Tuple[str, Dict[str, Any]]
+
+class ConversationParser:
+    """单个实例的增量对话解析器（有状态，非线程安全，多个线程共用时由调用方持有 lock）"""
+
+    def __init__(self, instance_id: str = None, content_filter=None):
+        self.instance_id = instance_id
+        self._content_filter = content_filter
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending: List[str] = []  # 尚未遇到换行的行片段
+        self._message: Optional[Dict[str, Any]] = None  # 当前正在接收的消息
+        self._kept = 0  # 已完成且未被过滤的消息数
+        self.position = 0  # 已解析到的日志字节位置（由调用方提供）
+        self.log_id = None  # 已解析的日志文件标识（由调用方提供）
+        self.history_end = 0  # 解析器创建时日志的大小，之前的输出是历史
+        self.historic_id = None  # 开始于历史输出中的当前消息，结束时也不推送
+        self.lock = threading.Lock()
+
+    @property
+    def content_filter(self):
+        if self._content_filter is None:
+            from app.services.content_filter import content_filter
+            self._content_filter = content_filter
+        return self._content_filter
+
+    def feed(self, data: Union[bytes, str]) -> List[Event]:
+        """输入新的字节块或文本，返回由此产生的事件列表 [(event, data), ...]"""
+        text = self._decoder.decode(data) if isinstance(data, bytes) else data
+        if not text:
+            return []
+
+        lines = text.split('\n')
+        if len(lines) == 1:
+            self._pending.append(text)
+            return []
+
+        events = []
+        lines[0] = ''.join(self._pending) + lines[0]
+        self._pending = [lines[-1]] if lines[-1] else []
+        for line in lines[:-1]:
+            self._parse_line(line, events)
+        return events
+
+    def flush(self) -> List[Event]:
+        """输入结束：解析剩余的未完成行并结束当前消息"""
+        events = []
+        tail = ''.join(self._pending) + self._decoder.decode(b'', final=True)
+        self._pending = []
+        if tail:
+            self._parse_line(tail, events)
+        self._complete(events)
+        return events
+
+    @property
+    def current_message_id(self) -> Optional[str]:
+        return self._message['message_id'] if self._message else None
+
+    def end_message(self) -> List[Event]:
+        """结束当前消息（输出暂停时调用），未完成的行保留到后续输入"""
+        events = []
+        self._complete(events)
+        return events
+
+    def _parse_line(self, line: str, events: List[Event]):
+        """处理一个完整的行"""
+        clean_line = strip_ansi(line)
+        speaker_info = self.content_filter._detect_speaker(clean_line)
+        message = self._message
+
+        if speaker_info:
+            self._complete(events)
+            self._message = {
+                'message_id': uuid.uuid4().hex,
+                'type': speaker_info['type'],
+                'parts': [speaker_info['content']],
+                'timestamp': speaker_info['timestamp'],
+                'raw_lines': [line]
+            }
+            events.append(('message_started', self._event_data(self._message, {
+                'content': speaker_info['content'],
+                'timestamp': speaker_info['timestamp']
+            })))
+        elif message and self.content_filter._is_message_continuation(clean_line):
+            message['parts'].append(clean_line)
+            message['raw_lines'].append(line)
+            events.append(('message_delta', self._event_data(message, {'delta': '\n' + clean_line})))
+        elif message:
+            self._complete(events)
+
+    def _complete(self, events: List[Event]):
+        """结束当前消息，按 parse_conversation 的规则过滤和清理"""
+        message, self._message = self._message, None
+        if message is None:
+            return
+
+        content = '\n'.join(message['parts']).strip()
+        conv = None
+        if content:
+            conv = self.content_filter._finalize_conversation({
+                'type': message['type'],
+                'content': content,
+                'timestamp': message['timestamp'],
+                'raw_content': '\n'.join(message['raw_lines'])
+            }, self._kept)
+        if conv is None:
+            events.append(('message_completed', self._event_data(message, {'discarded': True})))
+            return
+
+        self._kept += 1
+        events.append(('message_completed', self._event_data(message, {**conv, 'discarded': False})))
+
+    def _event_data(self, message: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'instance_id': self.instance_id,
+            'message_id': message['message_id'],
+            'type': message['type'],
+            **data
+        }
+
+class ConversationStreams:
+    """各实例的流式对话解析器"""
+
+    def __init__(self, content_filter=None, index=None, manager=None):
+        self._content_filter = content_filter
+        self._index = index
+        self._manager = manager
+        self._parsers: Dict[str, ConversationParser] = {}
+        self._lock = threading.Lock()
+        self._emitter: Optional[Callable[[str, Dict, str], None]] = None
+        self._started = False
+
+    @property
+    def index(self):
+        if self._index is None:
+            from app.services.status_index import status_index
+            self._index = status_index
+        return self._index
+
+    @property
+    def manager(self):
+        if self._manager is None:
+            from app.services.instance_manager import instance_manager
+            self._manager = instance_manager
+        return self._manager
+
+    def set_emitter(self, emitter: Callable[[str, Dict, str], None]):
+        """设置事件推送函数 emitter(event, data, room)"""
+        self._emitter = emitter
+
+    def start(self):
+        """监听实例状态，实例变为空闲时结束其当前消息（首次监控实例时调用）"""
+        if self._started:
+            return
+        self._started = True
+        self.index.add_listener(self._on_status_changes)
+        self.index.start()
+
+    def get_parser(self, instance_id: str) -> ConversationParser:
+        with self._lock:
+            parser = self._parsers.get(instance_id)
+            if parser is None:
+                parser = ConversationParser(instance_id, self._content_filter)
+                parser.history_end = self._log_size(instance_id)
+                self._parsers[instance_id] = parser
+            return parser
+
+    def _log_size(self, instance_id: str) -> int:
+        """实例日志当前的大小（日志不存在时为0）"""
+        try:
+            return os.path.getsize(self.manager.get_instance_log_path(instance_id))
+        except OSError:
+            return 0
+
+    def feed(self, instance_id: str, data: Union[bytes, str], end: int = None, log_id: str = None,
+             rewound: bool = False) -> List[Event]:
+        """输入实例的新输出并推送产生的事件
+
+        Args:
+            instance_id: 实例ID
+            data: 新的字节块或文本
+            end: 这段输出结束处的日志字节位置
+            log_id: 日志文件标识；与已解析的是同一文件且 end 不超过已解析位置时视为重新订阅时的重放，跳过
+            rewound: 日志被截断或重建后的第一段输出
+
+        日志文件变化、被截断（rewound）或位置回退且不能确认是同一文件的重放时，
+        先结束旧日志中的当前消息，再用新的解析器从头解析；
+        end 不超过解析器创建时的日志大小时只重建解析状态，不产生事件
+
+        Returns:
+            产生的事件列表
+        """
+        parser = self.get_parser(instance_id)
+        events = []
+        with parser.lock:
+            if end is not None:
+                same_file = log_id is not None and log_id == parser.log_id
+                replaced = parser.log_id is not None and log_id is not None and not same_file
+                if rewound or replaced or (end <= parser.position and not same_file):
+                    events = self._visible(parser, parser.flush())
+                    parser = self._replace_parser(instance_id, parser)
+                elif end <= parser.position:
+                    return []
+                parser.position = end
+                parser.log_id = log_id
+            new_events = parser.feed(data)
+            if end is not None and end <= parser.history_end:
+                # 服务启动前已写入日志的输出：不推送，也不再次保存到聊天记录
+                parser.historic_id = parser.current_message_id
+            else:
+                events += self._visible(parser, new_events)
+        self._emit(instance_id, events)
+        return events
+
+    def flush(self, instance_id: str) -> List[Event]:
+        """结束实例当前的消息并推送事件（实例变为空闲或输出读取者停止时调用）"""
+        with self._lock:
+            parser = self._parsers.get(instance_id)
+        if parser is None:
+            return []
+        with parser.lock:
+            # 等待期间解析器可能已被替换（新旧解析器共用同一把锁）
+            with self._lock:
+                parser = self._parsers[instance_id]
+            events = self._visible(parser, parser.end_message())
+        self._emit(instance_id, events)
+        return events
+
+    @staticmethod
+    def _visible(parser: ConversationParser, events: List[Event]) -> List[Event]:
+        """去掉开始于历史输出中的消息的事件"""
+        if parser.historic_id is None:
+            return events
+        return [(event, data) for event, data in events if data['message_id'] != parser.historic_id]
+
+    def _replace_parser(self, instance_id: str, old: ConversationParser) -> ConversationParser:
+        """用新的解析器替换旧的（调用方持有old.lock，新旧解析器共用同一把锁）"""
+        parser = ConversationParser(instance_id, self._content_filter)
+        parser.lock = old.lock
+        with self._lock:
+            self._parsers[instance_id] = parser
+        return parser
+
+    def _on_status_changes(self, changes):
+        """实例由忙碌变为空闲时，输出已告一段落，结束当前消息"""
+        for instance_id, (old, new) in changes.items():
+            if old is not None and old.state == '1' and (new is None or new.state != '1'):
+                self.flush(instance_id)
+
+    def _emit(self, instance_id: str, events: List[Event]):
+        if self._emitter is None:
+            return
+        for event, data in events:
+            try:
+                self._emitter(event, data, f'instance_{instance_id}')
+            except Exception as e:
+                logger.debug(f'推送对话事件失败: {e}')
+
+# 全局流式对话解析
+conversation_streams = ConversationStreams()
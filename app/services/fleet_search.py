@@ -0,0 +1,193 @@
+"""
+跨实例日志搜索
+在一个或全部namespace的所有 tmux.log 中搜索：已建立索引的日志直接用索引搜索，
+其余日志交给进程池顺序扫描；每个日志的结果排序后立即通过回调推送，
+整个搜索有全局结果上限，可随时取消
+"""
+import os
+import glob
+import time
+import uuid
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, List, Optional, Any
+
+from app.services.instance_manager import instance_manager
+from app.services.log_search import compile_query, peek_search_index, scan_log_file
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class _Search:
+    """一次跨实例搜索的状态"""
+
+    def __init__(self, search_id: str, owner: str, emit: Callable):
+        self.search_id = search_id
+        self.owner = owner
+        self.emit = emit
+        self.cancelled = threading.Event()
+        self.started_at = time.time()
+
+class FleetSearch:
+    """跨实例日志搜索"""
+
+    def __init__(self, manager=None, workers: int = None):
+        self.manager = manager or instance_manager
+        self.workers = workers or Config.FLEET_SEARCH_WORKERS
+        self._searches: Dict[str, _Search] = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        """延迟创建扫描进程池（spawn方式，避免在多线程进程中fork）"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._pool
+
+    def list_logs(self, namespace: Optional[str] = None) -> List[Dict[str, str]]:
+        """列出namespace（为空时为全部namespace）下所有实例的日志文件"""
+        pattern = os.path.join(self.manager.work_dir, 'namespaces', namespace or '*', 'instances', '*', 'tmux.log')
+        logs = []
+        for log_path in glob.glob(pattern):
+            instance_dir = os.path.dirname(log_path)
+            logs.append({
+                'instance_id': os.path.basename(instance_dir),
+                'namespace': os.path.basename(os.path.dirname(os.path.dirname(instance_dir))),
+                'log_path': log_path
+            })
+        return logs
+
+    def start(self, query: str, emit: Callable[[str, Dict], None], owner: str = None,
+              regex: bool = False, namespace: Optional[str] = None, max_results: int = None) -> str:
+        """开始搜索（立即返回，结果在后台线程中通过 emit(event, data) 推送）
+
+        Returns:
+            搜索ID，用于取消
+
+        Raises:
+            re.error: 正则表达式无效
+        """
+        compile_query(query, regex)
+        search = _Search(uuid.uuid4().hex, owner, emit)
+        with self._lock:
+            self._searches[search.search_id] = search
+
+        threading.Thread(
+            target=self._run,
+            args=(search, query, regex, namespace, max_results or Config.FLEET_SEARCH_MAX_RESULTS),
+            daemon=True,
+            name=f'fleet_search_{search.search_id[:8]}'
+        ).start()
+        return search.search_id
+
+    def cancel(self, search_id: str) -> bool:
+        """取消搜索"""
+        with self._lock:
+            search = self._searches.get(search_id)
+        if search is None:
+            return False
+        search.cancelled.set()
+        return True
+
+    def cancel_owner(self, owner: str):
+        """取消某个客户端发起的所有搜索（socket断开时调用）"""
+        with self._lock:
+            searches = [s for s in self._searches.values() if s.owner == owner]
+        for search in searches:
+            search.cancelled.set()
+
+    def _run(self, search: _Search, query: str, regex: bool, namespace: Optional[str], max_results: int):
+        """搜索协调线程"""
+        logs = self.list_logs(namespace)
+        per_log = min(max_results, Config.FLEET_SEARCH_PER_LOG_RESULTS)
+        returned = 0
+        total_matches = 0
+        searched = 0
+        failed = []
+
+        search.emit('log_search_started', {
+            'search_id': search.search_id,
+            'query': query,
+            'namespace': namespace,
+            'targets': len(logs)
+        })
+
+        def publish(target: Dict[str, str], result: Dict[str, Any]) -> bool:
+            """推送单个日志的结果，返回是否已达到全局上限"""
+            nonlocal returned, total_matches, searched
+            searched += 1
+            total_matches += result['total_matches']
+            if not result['results'] or returned >= max_results:
+                return returned >= max_results
+            # 匹配次数多的行在前，其次是较新的行
+            hits = sorted(result['results'],
+                          key=lambda r: (len(r['match_positions']), r['line_number']), reverse=True)
+            hits = hits[:max_results - returned]
+            returned += len(hits)
+            search.emit('log_search_results', {
+                'search_id': search.search_id,
+                'instance_id': target['instance_id'],
+                'namespace': target['namespace'],
+                'results': hits,
+                'total_matches': result['total_matches']
+            })
+            return returned >= max_results
+
+        futures = {}
+        try:
+            # 已有索引的日志在本线程中直接搜索，其余交给进程池
+            for target in logs:
+                if search.cancelled.is_set():
+                    break
+                index = peek_search_index(target['log_path'])
+                if index is None:
+                    future = self._get_pool().submit(scan_log_file, target['log_path'], query, regex, per_log)
+                    futures[future] = target
+                    continue
+                try:
+                    if publish(target, index.search(query, regex=regex, limit=per_log)):
+                        search.cancelled.set()
+                except Exception as e:
+                    failed.append({'instance_id': target['instance_id'], 'error': str(e)})
+
+            pending = set(futures)
+            while pending and not search.cancelled.is_set():
+                done, pending = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    target = futures[future]
+                    try:
+                        if publish(target, future.result()):
+                            search.cancelled.set()
+                    except Exception as e:
+                        failed.append({'instance_id': target['instance_id'], 'error': str(e)})
+        except Exception as e:
+            logger.error(f'跨实例搜索失败 {search.search_id}: {e}')
+            failed.append({'instance_id': None, 'error': str(e)})
+        finally:
+            # 取消尚未开始的扫描；已在运行的扫描结果会被丢弃
+            for future in futures:
+                future.cancel()
+            with self._lock:
+                self._searches.pop(search.search_id, None)
+
+        limit_reached = returned >= max_results
+        search.emit('log_search_completed', {
+            'search_id': search.search_id,
+            'total_matches': total_matches,
+            'returned': returned,
+            'searched': searched,
+            'targets': len(logs),
+            'failed': failed,
+            'limit_reached': limit_reached,
+            'cancelled': search.cancelled.is_set() and not limit_reached,
+            'elapsed': round(time.time() - search.started_at, 3)
+        })
+
+# 全局跨实例搜索
+fleet_search = FleetSearch()
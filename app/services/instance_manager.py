@@ -11,11 +11,18 @@ import os
 import re
 import json
 import platform
+import shutil
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Dict, List, Optional
-from queue import Queue, Empty
 
 from app.models.instance import QInstance
+from app.services.log_reader import LogTailReader, get_line_index, read_last_lines
+from app.services.log_search import get_search_index
+from app.services.tmux_control import tmux_query
+from app.services.tmux_snapshot import collect_session_snapshot
 from config.config import Config
 
 logger = logging.getLogger(__name__)
@@ -28,6 +35,10 @@ class InstanceManager:
         self._lock = threading.Lock()
         self._start_lock = threading.Lock()
         
+        # 实例详细信息缓存 {instance_id: (cache_key, detail, fetched_at)}
+        self._detail_cache = {}
+        self._detail_cache_lock = threading.Lock()
+        
         # 根据系统类型确定工作目录
         self.work_dir = self._get_work_directory()
         self.sessions_dir = os.path.join(os.path.dirname(__file__), 'sessions')
@@ -54,12 +65,12 @@ class InstanceManager:
     
     def _check_tmux(self):
         """检查tmux是否安装"""
-        if not subprocess.run(['which', 'tmux'], capture_output=True).returncode == 0:
+        if not shutil.which('tmux'):
             raise RuntimeError("tmux未安装")
     
     def _check_cliExtra(self):
-        """检查cliExtra命令是否可用"""
-        if not subprocess.run(['which', 'cliExtra'], capture_output=True).returncode == 0:
+        """检查cliExtra命令是否可用（PATH查找，不fork which）"""
+        if not shutil.which('cliExtra'):
             raise RuntimeError("cliExtra命令未安装")
     
     def get_namespace_instances_dir(self, namespace='default'):
@@ -79,6 +90,16 @@ class InstanceManager:
         instances_dir = self.get_namespace_instances_dir(namespace)
         return os.path.join(instances_dir, instance_id, 'tmux.log')
     
+    def get_instance_namespace(self, instance_id: str) -> str:
+        """获取实例所属namespace（未知实例返回default）"""
+        with self._lock:
+            instance = self.instances.get(instance_id)
+            return (instance.namespace or 'default') if instance else 'default'
+    
+    def get_instance_log_path(self, instance_id: str) -> str:
+        """根据实例当前namespace获取其tmux日志文件路径"""
+        return self.get_instance_tmux_log_path(instance_id, self.get_instance_namespace(instance_id))
+    
     def get_instance_conversation_path(self, instance_id, namespace='default'):
         """获取实例的对话记录文件路径"""
         conversations_dir = self.get_namespace_conversations_dir(namespace)
@@ -115,19 +136,21 @@ class InstanceManager:
             # 解析JSON输出
             try:
                 data = json.loads(result.stdout.strip())
-                instances_data = data.get('instances', [])
+                instances_data = [d for d in data.get('instances', []) if d.get('id')]
+                
+                # 在锁外批量获取详细信息（缓存 + 有界线程池），避免N+1串行fork阻塞读者
+                details = self._fetch_instance_details(instances_data)
+                # 一条 tmux list-panes -a 取得所有会话的PID、创建/活动时间和窗格大小
+                sessions = collect_session_snapshot()
                 
                 current_instances = set()
                 
-                # 处理实例数据
-                for instance_data in instances_data:
-                    instance_id = instance_data.get('id')
-                    if not instance_id:
-                        continue
+                with self._lock:
+                    # 处理实例数据
+                    for instance_data in instances_data:
+                        instance_id = instance_data['id']
+                        current_instances.add(instance_id)
                         
-                    current_instances.add(instance_id)
-                    
-                    with self._lock:
                         if instance_id not in self.instances:
                             instance = QInstance(id=instance_id)
                             self.instances[instance_id] = instance
@@ -149,51 +172,36 @@ class InstanceManager:
                             if 'tmux attach-session -t ' in attach_command:
                                 instance.screen_session = attach_command.replace('tmux attach-session -t ', '')
                         
-                        # 尝试获取详细信息（如果需要更多字段）
-                        try:
-                            detail_result = subprocess.run(
-                                ['cliExtra', 'list', instance_id, '--json'],
-                                capture_output=True, text=True, timeout=5
-                            )
-                            if detail_result.returncode == 0:
-                                detail_data = json.loads(detail_result.stdout.strip())
-                                detail_instance = detail_data.get('instance', {})
-                                
-                                # 更新详细信息
-                                instance.path = detail_instance.get('project_dir', '')
-                                instance.start_time = detail_instance.get('log_modified', '')
-                                instance.role = detail_instance.get('role', '')
-                                instance.pid = detail_instance.get('pid', '')
-                                
-                                # 如果详细信息中有namespace，优先使用
-                                if 'namespace' in detail_instance:
-                                    instance.namespace = detail_instance['namespace']
-                        except:
-                            # 如果获取详细信息失败，使用基本信息
-                            pass
+                        # 更新详细信息
+                        detail_instance = details.get(instance_id)
+                        if detail_instance:
+                            instance.path = detail_instance.get('project_dir', '')
+                            instance.start_time = detail_instance.get('log_modified', '')
+                            instance.role = detail_instance.get('role', '') or instance.role
+                            instance.pid = detail_instance.get('pid', '')
+                            
+                            # 如果详细信息中有namespace，优先使用
+                            if detail_instance.get('namespace'):
+                                instance.namespace = detail_instance['namespace']
+                        
+                        session_info = sessions.get(instance.screen_session)
+                        if session_info:
+                            instance.apply_session_info(session_info)
                         
                         # 简化详细信息显示 - 只保留基本状态
                         # 不再生成复杂的details字段，让前端决定如何显示
                         instance.details = f'{instance.status}'
-                
-                # 移除不存在的实例
-                with self._lock:
-                    to_remove = []
-                    for instance_id in self.instances:
-                        if instance_id not in current_instances:
-                            to_remove.append(instance_id)
                     
+                    # 移除不存在的实例
+                    to_remove = [instance_id for instance_id in self.instances
+                                 if instance_id not in current_instances]
                     for instance_id in to_remove:
                         del self.instances[instance_id]
                         logger.info(f"移除不存在的cliExtra实例: {instance_id}")
                 
                 # 如果没有实例，记录日志
                 if not instances_data:
-                    with self._lock:
-                        count = len(self.instances)
-                        if count > 0:
-                            self.instances.clear()
-                            logger.info(f"没有活跃的cliExtra实例，清空了 {count} 个实例")
+                    logger.info("没有活跃的cliExtra实例")
                             
             except json.JSONDecodeError as e:
                 logger.error(f"解析cliExtra list --json输出失败: {e}")
@@ -204,11 +212,102 @@ class InstanceManager:
         except Exception as e:
             logger.error(f"同步cliExtra实例失败: {e}")
     
-    def get_instances(self) -> List[Dict[str, any]]:
-        """获取所有实例信息"""
-        # 先同步一次状态
-        self.sync_screen_instances()
+    def _fetch_instance_details(self, instances_data: List[Dict]) -> Dict[str, Dict]:
+        """批量获取实例详细信息
+        
+        优先使用 list --json 输出中已有的字段；否则使用缓存的结果，缓存按 tmux会话和实例目录的修改时间
+        区分（实例重启或cliExtra更新实例文件时失效），并且最多保留 INSTANCE_DETAIL_CACHE_TTL 秒；
+        只有缓存未命中的实例才调用 cliExtra list <id> --json，并在有界线程池中并发执行。
+        调用方不得持有 self._lock。
+        """
+        details = {}
+        to_fetch = []
+        now = time.time()
+        
+        with self._detail_cache_lock:
+            for instance_data in instances_data:
+                instance_id = instance_data['id']
+                namespace = instance_data.get('namespace') or 'default'
+                cache_key = (instance_data.get('session', ''), self._get_instance_dir_mtime(instance_id, namespace))
+                
+                if 'project_dir' in instance_data:
+                    # 新版 list --json 已包含详细字段，无需额外fork
+                    details[instance_id] = {
+                        'project_dir': instance_data.get('project_dir', ''),
+                        'log_modified': instance_data.get('log_modified', ''),
+                        'role': instance_data.get('role', ''),
+                        'pid': instance_data.get('pid', ''),
+                        'namespace': instance_data.get('namespace', '')
+                    }
+                    continue
+                
+                cached = self._detail_cache.get(instance_id)
+                if cached and cached[0] == cache_key and now - cached[2] < Config.INSTANCE_DETAIL_CACHE_TTL:
+                    details[instance_id] = cached[1]
+                else:
+                    to_fetch.append((instance_id, cache_key))
+            
+            # 清理已消失实例的缓存
+            current_ids = {d['id'] for d in instances_data}
+            for instance_id in list(self._detail_cache):
+                if instance_id not in current_ids:
+                    del self._detail_cache[instance_id]
         
+        if to_fetch:
+            workers = min(Config.INSTANCE_DETAIL_WORKERS, len(to_fetch))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='instance_detail') as executor:
+                fetched = list(executor.map(lambda item: self._fetch_instance_detail(item[0]), to_fetch))
+            
+            with self._detail_cache_lock:
+                for (instance_id, cache_key), detail in zip(to_fetch, fetched):
+                    if detail is None:
+                        # 获取失败时不缓存，下一轮重试
+                        continue
+                    self._detail_cache[instance_id] = (cache_key, detail, now)
+                    details[instance_id] = detail
+        
+        # log_modified 即日志文件修改时间，每轮直接stat本地文件保持最新
+        for instance_data in instances_data:
+            instance_id = instance_data['id']
+            log_path = self.get_instance_tmux_log_path(instance_id, instance_data.get('namespace') or 'default')
+            log_modified = self._get_file_mtime(log_path)
+            if log_modified and instance_id in details:
+                details[instance_id] = {**details[instance_id], 'log_modified': log_modified}
+        
+        return details
+    
+    def _get_instance_dir_mtime(self, instance_id: str, namespace: str) -> int:
+        """实例目录的修改时间（纳秒），目录不存在时返回0"""
+        try:
+            return os.stat(os.path.join(self.get_namespace_instances_dir(namespace), instance_id)).st_mtime_ns
+        except OSError:
+            return 0
+    
+    def _fetch_instance_detail(self, instance_id: str) -> Optional[Dict]:
+        """通过 cliExtra list <id> --json 获取单个实例详细信息"""
+        try:
+            detail_result = subprocess.run(
+                ['cliExtra', 'list', instance_id, '--json'],
+                capture_output=True, text=True, timeout=5
+            )
+            if detail_result.returncode == 0:
+                detail_data = json.loads(detail_result.stdout.strip())
+                return detail_data.get('instance', {})
+        except Exception as e:
+            # 如果获取详细信息失败，使用基本信息
+            logger.debug(f"获取实例 {instance_id} 详细信息失败: {e}")
+        return None
+    
+    def _request_registry_refresh(self):
+        """通知实例注册表尽快刷新快照"""
+        try:
+            from app.services.instance_registry import instance_registry
+            instance_registry.request_refresh()
+        except Exception as e:
+            logger.debug(f"请求刷新实例注册表失败: {e}")
+    
+    def get_instances(self) -> List[Dict[str, any]]:
+        """获取所有实例信息（由实例注册表在后台同步，不在调用线程中fork）"""
         with self._lock:
             return [instance.to_dict() for instance in self.instances.values()]
     
@@ -216,27 +315,28 @@ class InstanceManager:
         """获取指定实例"""
         return self.instances.get(instance_id)
     
-    def get_instances_status(self) -> Dict[str, Dict]:
-        """获取所有实例的状态信息"""
+    def get_instances_status(self, snapshot=None) -> Dict[str, Dict]:
+        """获取所有实例的状态信息（来自状态文件索引，不读取文件）
+        
+        Args:
+            snapshot: 实例注册表快照，指定时只返回快照中的实例，与快照的 generation/as_of 对应
+        """
         try:
-            # 先同步实例状态
-            self.sync_screen_instances()
+            from app.services.status_index import status_index
+            entries = status_index.snapshot()
+            if snapshot is not None:
+                created = {instance_id: datetime.fromisoformat(inst['created_at']) if inst.get('created_at') else None
+                           for instance_id, inst in snapshot.instances.items()}
+            else:
+                with self._lock:
+                    created = {instance_id: instance.created_at for instance_id, instance in self.instances.items()}
             
             status_info = {}
-            with self._lock:
-                for instance_id, instance in self.instances.items():
-                    try:
-                        status_info[instance_id] = self._get_instance_status(instance)
-                    except Exception as e:
-                        logger.error(f"获取实例 {instance_id} 状态失败: {e}")
-                        status_info[instance_id] = {
-                            'status': 'error',
-                            'color': 'red',
-                            'description': f'状态检查失败: {str(e)}',
-                            'last_activity': instance.created_at if hasattr(instance, 'created_at') else ''
-                        }
+            for instance_id, created_at in created.items():
+                entry = entries.get(instance_id)
+                status_info[instance_id] = self._format_status_entry(entry) if entry else self._default_status(created_at)
             
-            logger.info(f"获取到 {len(status_info)} 个实例状态")
+            logger.debug(f"获取到 {len(status_info)} 个实例状态")
             return status_info
         except Exception as e:
             logger.error(f"获取实例状态失败: {e}")
@@ -245,9 +345,6 @@ class InstanceManager:
     def get_instance_detailed_status(self, instance_name: str) -> Dict:
         """获取单个实例的详细状态信息"""
         try:
-            # 先同步实例状态
-            self.sync_screen_instances()
-            
             instance = self.instances.get(instance_name)
             if not instance:
                 return {'error': f'实例 {instance_name} 不存在'}
@@ -259,89 +356,51 @@ class InstanceManager:
     
     def _get_instance_status(self, instance: QInstance) -> Dict:
         """获取实例基本状态信息 - 简化版，只关注状态文件"""
-        try:
-            # 只读取状态文件，不检查tmux会话
-            status_from_file = self._read_status_file(instance.name)
-            if status_from_file:
-                return status_from_file
-            
-            # 如果没有状态文件，默认为idle
-            return {
-                'status': 'idle',
-                'color': 'green',
-                'description': '空闲中',
-                'last_activity': instance.created_at if hasattr(instance, 'created_at') else ''
-            }
-        except Exception as e:
-            logger.error(f"获取实例 {instance.name} 状态失败: {e}")
-            return {
-                'status': 'idle',
-                'color': 'green', 
-                'description': '空闲中',
-                'last_activity': instance.created_at if hasattr(instance, 'created_at') else ''
-            }
+        status_from_file = self._read_status_file(instance.id)
+        # 如果没有状态文件，默认为idle
+        return status_from_file or self._default_status(instance.created_at)
+    
+    def _default_status(self, created_at: Optional[datetime]) -> Dict:
+        """没有状态文件时的默认状态"""
+        return {
+            'status': 'idle',
+            'color': 'green',
+            'description': '空闲中',
+            'last_activity': created_at.strftime('%Y-%m-%d %H:%M:%S') if created_at else ''
+        }
     
     def _read_status_file(self, instance_name: str) -> Optional[Dict]:
-        """读取实例状态文件 - 简化版，只读取0/1数字"""
-        try:
-            # 尝试从不同namespace查找状态文件
-            possible_paths = [
-                os.path.join(self.work_dir, "namespaces", "q_cli", "status", f"{instance_name}.status"),
-                os.path.join(self.work_dir, "namespaces", "default", "status", f"{instance_name}.status"),
-                os.path.join(self.work_dir, "namespaces", "frontend", "status", f"{instance_name}.status"),
-                os.path.join(self.work_dir, "namespaces", "backend", "status", f"{instance_name}.status"),
-                os.path.join(self.work_dir, "namespaces", "box", "status", f"{instance_name}.status"),
-            ]
-            
-            for status_file_path in possible_paths:
-                if os.path.exists(status_file_path):
-                    try:
-                        with open(status_file_path, 'r', encoding='utf-8') as f:
-                            content = f.read().strip()
-                        
-                        # 解析简化的状态格式：0=idle, 1=busy
-                        if content == '0':
-                            status = 'idle'
-                            color = 'green'
-                            description = '空闲中'
-                        elif content == '1':
-                            status = 'busy'
-                            color = 'orange'
-                            description = '忙碌中'
-                        else:
-                            # 如果不是0或1，默认为idle
-                            logger.warning(f"状态文件 {status_file_path} 内容异常: '{content}', 默认为idle")
-                            status = 'idle'
-                            color = 'green'
-                            description = '空闲中'
-                        
-                        logger.debug(f"读取状态文件 {status_file_path}: {content} -> {status}")
-                        
-                        return {
-                            'status': status,
-                            'color': color,
-                            'description': description,
-                            'last_activity': self._get_file_mtime(status_file_path),
-                            'from_file': True,
-                            'file_path': status_file_path,
-                            'raw_content': content
-                        }
-                        
-                    except Exception as e:
-                        logger.error(f"读取状态文件 {status_file_path} 失败: {e}")
-                        continue
-            
-            return None
-        except Exception as e:
-            logger.debug(f"查找实例 {instance_name} 状态文件失败: {e}")
-            return None
+        """读取实例状态（从状态文件索引中查找，支持任意namespace）"""
+        from app.services.status_index import status_index
+        entry = status_index.get(instance_name)
+        return self._format_status_entry(entry) if entry else None
+    
+    def _format_status_entry(self, entry) -> Dict:
+        """把状态文件内容转换为显示用的状态信息 - 简化格式：0=idle, 1=busy"""
+        if entry.state == '1':
+            status, color, description = 'busy', 'orange', '忙碌中'
+        else:
+            if entry.state != '0':
+                # 如果不是0或1，默认为idle
+                logger.debug(f"状态文件 {entry.path} 内容异常: '{entry.state}', 默认为idle")
+            status, color, description = 'idle', 'green', '空闲中'
+        
+        return {
+            'status': status,
+            'color': color,
+            'description': description,
+            'last_activity': datetime.fromtimestamp(entry.mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            'from_file': True,
+            'file_path': entry.path,
+            'namespace': entry.namespace,
+            'raw_content': entry.state
+        }
     
     def _get_file_mtime(self, file_path: str) -> str:
         """获取文件修改时间"""
         try:
-            import datetime
             mtime = os.path.getmtime(file_path)
-            return datetime.datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+            return datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
         except Exception:
             return ''
     
@@ -351,22 +410,22 @@ class InstanceManager:
         
         try:
             # 获取更多详细信息
-            session_info = self._get_session_info(instance.session_name)
-            recent_output = self._get_recent_session_output(instance.session_name, lines=20)
+            session_info = self._get_session_info(instance.screen_session)
+            recent_output = self._get_recent_session_output(instance.screen_session, lines=20)
             
             return {
                 **basic_status,
-                'instance_name': instance.name,
-                'session_name': instance.session_name,
+                'instance_name': instance.id,
+                'session_name': instance.screen_session,
                 'namespace': instance.namespace,
                 'role': instance.role,
-                'created_at': instance.created_at,
+                'created_at': instance.created_at.isoformat() if instance.created_at else None,
                 'session_info': session_info,
                 'recent_output': recent_output,
                 'uptime': self._calculate_uptime(instance.created_at)
             }
         except Exception as e:
-            logger.error(f"获取实例 {instance.name} 详细状态失败: {e}")
+            logger.error(f"获取实例 {instance.id} 详细状态失败: {e}")
             return {
                 **basic_status,
                 'error': str(e)
@@ -421,62 +480,46 @@ class InstanceManager:
         }
     
     def _get_recent_session_output(self, session_name: str, lines: int = 5) -> str:
-        """获取会话最近的输出"""
-        try:
-            cmd = f"tmux capture-pane -t {session_name} -p -S -{lines}"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-            return result.stdout.strip() if result.returncode == 0 else ""
-        except Exception as e:
-            logger.debug(f"获取会话 {session_name} 输出失败: {e}")
-            return ""
+        """获取会话最近的输出（通过tmux控制连接，不fork进程）"""
+        output = tmux_query('capture-pane', '-t', f'={session_name}:', '-p', '-S', f'-{lines}')
+        return '\n'.join(output).strip() if output else ""
     
     def _get_session_pid(self, session_name: str) -> Optional[int]:
-        """获取tmux会话的PID"""
+        """获取tmux会话中第一个窗格的进程PID"""
+        output = tmux_query('list-panes', '-t', f'={session_name}:', '-F', '#{pane_pid}')
         try:
-            cmd = f"tmux list-sessions -F '#{session_name}:#{session_id}' | grep '^{session_name}:' | cut -d: -f2"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0 and result.stdout.strip():
-                session_id = result.stdout.strip()
-                # 获取会话中的进程PID
-                cmd = f"tmux list-panes -t {session_name} -F '#{pane_pid}'"
-                result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-                if result.returncode == 0 and result.stdout.strip():
-                    return int(result.stdout.strip().split('\n')[0])
-        except Exception as e:
-            logger.debug(f"获取会话 {session_name} PID失败: {e}")
-        return None
+            return int(output[0]) if output else None
+        except ValueError:
+            return None
     
     def _get_session_info(self, session_name: str) -> Dict:
         """获取tmux会话信息"""
-        try:
-            cmd = f"tmux display-message -t {session_name} -p '#{session_name}|#{session_created}|#{session_activity}'"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                parts = result.stdout.strip().split('|')
-                return {
-                    'session_name': parts[0] if len(parts) > 0 else session_name,
-                    'created': parts[1] if len(parts) > 1 else '',
-                    'last_activity': parts[2] if len(parts) > 2 else ''
-                }
-        except Exception as e:
-            logger.debug(f"获取会话 {session_name} 信息失败: {e}")
-        return {}
+        output = tmux_query('display-message', '-t', f'={session_name}:', '-p',
+                            '#{session_name}|#{session_created}|#{session_activity}')
+        parts = output[0].split('|') if output else []
+        if not parts or not parts[0]:
+            # 会话不存在时 display-message 输出空行
+            return {}
+        return {
+            'session_name': parts[0] if len(parts) > 0 else session_name,
+            'created': parts[1] if len(parts) > 1 else '',
+            'last_activity': parts[2] if len(parts) > 2 else ''
+        }
     
     def _get_last_activity_time(self, session_name: str) -> str:
         """获取会话最后活动时间"""
-        try:
-            cmd = f"tmux display-message -t {session_name} -p '#{session_activity}'"
-            result = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=5)
-            if result.returncode == 0:
-                return result.stdout.strip()
-        except Exception as e:
-            logger.debug(f"获取会话 {session_name} 活动时间失败: {e}")
+        output = tmux_query('display-message', '-t', f'={session_name}:', '-p', '#{session_activity}')
+        if output and output[0]:
+            return output[0]
         return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
-    def _calculate_uptime(self, created_at: str) -> str:
+    def _calculate_uptime(self, created_at) -> str:
         """计算运行时间"""
         try:
-            created_time = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+            if isinstance(created_at, datetime):
+                created_time = created_at
+            else:
+                created_time = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
             uptime = datetime.now() - created_time.replace(tzinfo=None)
             
             days = uptime.days
@@ -578,7 +621,15 @@ class InstanceManager:
             #         'status_info': status_check.get('status_info', {})
             #     }
             
-            # 2. 构建发送命令
+            # 2. 能找到实例tmux会话时直接写入，不再fork qq send
+            if Config.TMUX_DIRECT_SEND:
+                from app.services.tmux_sender import tmux_sender
+                direct_result = tmux_sender.send(instance_id_safe, message_safe)
+                if direct_result is not None:
+                    return direct_result
+                logger.info(f'实例 {instance_id_safe} 无法直接通过tmux发送，使用 qq send')
+            
+            # 3. 构建发送命令
             cmd = ['qq', 'send', '--force', instance_id_safe, message_safe]
             cmd_str = ' '.join([f'"{arg}"' if ' ' in arg else arg for arg in cmd])
             
@@ -588,7 +639,7 @@ class InstanceManager:
             logger.info(f'🔧 执行命令: {cmd_str}')
             logger.info(f'📋 命令数组: {cmd}')
             
-            # 3. 执行发送命令
+            # 4. 执行发送命令
             result = subprocess.run(
                 cmd,
                 capture_output=True, 
@@ -598,7 +649,7 @@ class InstanceManager:
                 errors='replace'
             )
             
-            # 4. 处理命令输出
+            # 5. 处理命令输出
             try:
                 stdout_safe = result.stdout.encode('utf-8', errors='replace').decode('utf-8') if result.stdout else ''
                 stderr_safe = result.stderr.encode('utf-8', errors='replace').decode('utf-8') if result.stderr else ''
@@ -613,7 +664,7 @@ class InstanceManager:
             if stderr_safe:
                 logger.info(f'📤 错误输出: {stderr_safe}')
             
-            # 5. 分析结果并返回
+            # 6. 分析结果并返回
             if result.returncode == 0:
                 logger.info(f'✅ 消息发送成功到实例 {instance_id_safe}')
                 return {
@@ -639,7 +690,7 @@ class InstanceManager:
             error_msg = f'发送消息超时（15秒），实例 {instance_id} 可能无响应'
             logger.error(f'⏰ 向cliExtra实例 {instance_id} 发送消息超时')
             logger.error(f'🔧 超时命令: qq send {instance_id} "{message[:50]}..."')
-            return {'success': False, 'error': error_msg}
+            return {'success': False, 'error': error_msg, 'timeout': True}
         except UnicodeDecodeError as e:
             error_msg = f'消息包含不支持的字符编码'
             logger.error(f'🔤 向cliExtra实例 {instance_id} 发送消息编码错误: {e}')
@@ -849,6 +900,7 @@ class InstanceManager:
             with self._lock:
                 if instance_id in self.instances:
                     del self.instances[instance_id]
+            self._request_registry_refresh()
             
             if result.returncode == 0:
                 logger.info(f'cliExtra实例 {instance_id} 已停止')
@@ -880,6 +932,7 @@ class InstanceManager:
             with self._lock:
                 if instance_id in self.instances:
                     del self.instances[instance_id]
+            self._request_registry_refresh()
             
             if result.returncode == 0:
                 logger.info(f'cliExtra实例 {instance_id} 数据已清理')
@@ -910,8 +963,8 @@ class InstanceManager:
             
             if result.returncode == 0:
                 logger.info(f'cliExtra实例 {instance_id} 已重新启动')
-                # 重新同步实例状态
-                self.sync_screen_instances()
+                # 通知注册表重新同步实例状态
+                self._request_registry_refresh()
                 return {'success': True}
             else:
                 error_msg = result.stderr or result.stdout
@@ -926,17 +979,17 @@ class InstanceManager:
             logger.error(f'重启cliExtra实例 {instance_id} 失败: {str(e)}')
             return {'success': False, 'error': str(e)}
     
-    def broadcast_message(self, message: str, namespace: str = None, broadcast_all: bool = True) -> Dict[str, any]:
-        """广播消息到指定namespace的所有运行中的实例
+    def broadcast_message(self, message: str, namespace: str = None, broadcast_all: bool = True,
+                          role: str = None) -> Dict[str, any]:
+        """广播消息到指定namespace的所有运行中的实例（并行发送，等待全部完成）
         
         Args:
             message: 要广播的消息
             namespace: 指定namespace（如果提供，则只广播给该namespace）
             broadcast_all: 是否广播给所有namespace（默认True保持兼容性）
+            role: 只广播给指定角色的实例
         """
         try:
-            self._check_cliExtra()
-            
             # 安全处理输入参数，确保UTF-8编码
             try:
                 message_safe = message.encode('utf-8', errors='replace').decode('utf-8')
@@ -945,80 +998,16 @@ class InstanceManager:
                 logger.error(f"广播参数编码处理失败: {e}")
                 return {'success': False, 'error': '参数包含无效字符'}
             
-            # 构建qq broadcast命令（使用qq别名）
-            cmd = ['qq', 'broadcast', message_safe]
-            
-            if namespace_safe:
-                # 如果指定了namespace，使用--namespace参数
-                cmd.extend(['--namespace', namespace_safe])
-            elif broadcast_all:
-                # 如果要广播给所有namespace，添加--all参数（适配新默认行为）
-                cmd.append('--all')
-            # 如果broadcast_all=False且没有namespace，则使用默认行为（只广播给default）
-            
-            logger.info(f"🔍 执行广播命令: {' '.join(cmd)}")
-            
-            # 使用显式编码设置运行subprocess
-            result = subprocess.run(
-                cmd,
-                capture_output=True, 
-                text=True, 
-                timeout=30,
-                encoding='utf-8',
-                errors='replace'  # 处理编码错误
-            )
+            from app.services.broadcast_engine import broadcast_engine
+            summary = broadcast_engine.broadcast(message_safe, namespace_safe, role, broadcast_all)
             
-            # 安全处理输出
-            try:
-                stdout_safe = result.stdout.encode('utf-8', errors='replace').decode('utf-8') if result.stdout else ''
-                stderr_safe = result.stderr.encode('utf-8', errors='replace').decode('utf-8') if result.stderr else ''
-            except Exception as e:
-                logger.error(f"广播输出编码处理失败: {e}")
-                stdout_safe = str(result.stdout) if result.stdout else ''
-                stderr_safe = str(result.stderr) if result.stderr else ''
+            if summary['total'] and not summary['sent_count'] and summary['finished']:
+                errors = {item['error'] for item in summary['failed'] if item['error']}
+                return {**summary, 'success': False, 'error': '; '.join(errors) or '广播失败'}
             
-            if result.returncode == 0:
-                # 解析输出获取发送数量
-                output = stdout_safe.strip()
-                sent_count = 0
-                
-                # 尝试从输出中提取发送数量，寻找"发送给 X 个实例"或"广播给 X 个实例"的模式
-                import re
-                count_patterns = [
-                    r'发送给\s*(\d+)\s*个实例',
-                    r'广播给\s*(\d+)\s*个实例',
-                    r'已发送给\s*(\d+)\s*个实例',
-                    r'成功发送给\s*(\d+)\s*个实例'
-                ]
-                
-                for pattern in count_patterns:
-                    count_match = re.search(pattern, output)
-                    if count_match:
-                        sent_count = int(count_match.group(1))
-                        break
-                
-                if sent_count == 0:
-                    # 如果无法解析，获取指定namespace的运行实例数量作为估计
-                    with self._lock:
-                        if namespace_safe:
-                            sent_count = len([inst for inst in self.instances.values() 
-                                            if inst.status not in ['Not Running', 'Stopped', 'Terminated']
-                                            and getattr(inst, 'namespace', 'default') == namespace_safe])
-                        else:
-                            sent_count = len([inst for inst in self.instances.values() 
-                                            if inst.status not in ['Not Running', 'Stopped', 'Terminated']])
+            logger.info(f'广播消息完成，发送给 {summary["sent_count"]}/{summary["total"]} 个实例')
+            return {**summary, 'success': True}
                 
-                logger.info(f'广播消息成功，发送给 {sent_count} 个实例')
-                return {'success': True, 'sent_count': sent_count}
-            else:
-                error_msg = result.stderr or result.stdout
-                logger.error(f'广播消息失败: {error_msg}')
-                return {'success': False, 'error': error_msg}
-                
-        except subprocess.TimeoutExpired:
-            error_msg = '广播消息超时'
-            logger.error('广播消息超时')
-            return {'success': False, 'error': error_msg}
         except Exception as e:
             logger.error(f'广播消息失败: {str(e)}')
             return {'success': False, 'error': str(e)}
@@ -1026,14 +1015,8 @@ class InstanceManager:
     def get_instance_output(self, instance_id: str, last_position: int = 0) -> List[Dict[str, any]]:
         """获取cliExtra实例输出 - 支持新的基于namespace的目录结构"""
         try:
-            # 首先尝试获取实例的namespace信息
-            instance_namespace = 'default'
-            with self._lock:
-                if instance_id in self.instances:
-                    instance_namespace = self.instances[instance_id].namespace or 'default'
-            
             # 尝试从tmux日志文件读取（新的目录结构）
-            tmux_log_path = self.get_instance_tmux_log_path(instance_id, instance_namespace)
+            tmux_log_path = self.get_instance_log_path(instance_id)
             
             if os.path.exists(tmux_log_path):
                 return self._read_tmux_log_file(tmux_log_path, last_position)
@@ -1067,37 +1050,16 @@ class InstanceManager:
             return []
     
     def _read_tmux_log_file(self, log_path: str, last_position: int = 0) -> List[Dict[str, any]]:
-        """从tmux日志文件读取输出"""
+        """从tmux日志文件读取输出
+
+        last_position 为字节偏移（应为上次返回的 new_position），只返回完整的行，
+        末尾未完成的行不计入 new_position，下次读取时会完整返回
+        """
         try:
             if not os.path.exists(log_path):
                 return []
             
-            with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                # 跳到指定位置
-                if last_position > 0:
-                    f.seek(last_position)
-                
-                content = f.read()
-                current_position = f.tell()
-                
-                if not content:
-                    return []
-                
-                # 按行分割并处理
-                lines = content.split('\n')
-                output = []
-                
-                for line in lines:
-                    if line.strip():  # 忽略空行
-                        output.append({
-                            'type': 'output',
-                            'content': line,
-                            'timestamp': time.time(),
-                            'new_position': current_position,
-                            'is_streaming': True
-                        })
-                
-                return output
+            return LogTailReader(log_path, offset=last_position).read()
                 
         except Exception as e:
             logger.error(f'读取tmux日志文件失败 {log_path}: {str(e)}')
@@ -1108,14 +1070,8 @@ class InstanceManager:
                                            from_line: int = 0) -> Dict[str, any]:
         """获取终端输出，支持分页和滚动加载"""
         try:
-            # 获取实例的namespace信息
-            instance_namespace = 'default'
-            with self._lock:
-                if instance_id in self.instances:
-                    instance_namespace = self.instances[instance_id].namespace or 'default'
-            
-            # 获取tmux日志文件路径
-            tmux_log_path = self.get_instance_tmux_log_path(instance_id, instance_namespace)
+            # 按实例当前namespace获取tmux日志文件路径
+            tmux_log_path = self.get_instance_log_path(instance_id)
             
             if not os.path.exists(tmux_log_path):
                 return {
@@ -1143,60 +1099,74 @@ class InstanceManager:
     
     def _read_file_with_pagination(self, file_path: str, page: int, page_size: int, 
                                  direction: str, from_line: int) -> Dict[str, any]:
-        """从文件读取内容并分页"""
+        """从文件读取内容并分页（通过稀疏行索引直接定位到目标行）"""
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                # 读取所有行
-                all_lines = f.readlines()
-                total_lines = len(all_lines)
-                
-                if total_lines == 0:
-                    return {
-                        'success': True,
-                        'lines': [],
-                        'total_lines': 0,
-                        'current_page': page,
-                        'page_size': page_size,
-                        'has_more': False,
-                        'has_previous': False
-                    }
-                
-                # 计算分页范围
-                if direction == 'backward':
-                    # 向上滚动，从指定行向前获取
-                    end_line = from_line if from_line > 0 else total_lines
-                    start_line = max(0, end_line - page_size)
-                else:
-                    # 向下滚动，从指定行向后获取
-                    start_line = from_line
-                    end_line = min(total_lines, start_line + page_size)
-                
-                # 提取指定范围的行
-                selected_lines = all_lines[start_line:end_line]
-                
-                # 处理行内容
-                lines = []
-                for i, line in enumerate(selected_lines):
-                    lines.append({
-                        'line_number': start_line + i + 1,
-                        'content': line.rstrip('\n\r'),
-                        'timestamp': time.time(),
-                        'type': 'output'
-                    })
-                
+            if direction == 'backward' and from_line == 0:
+                # 最新一页直接从文件末尾反向读取
+                return self._read_file_tail(file_path, page, page_size)
+            
+            line_index = get_line_index(file_path)
+            indexed = line_index.try_update()
+            if indexed is None:
+                # 大文件正在后台建立行索引，不在请求线程中扫描整个文件
                 return {
                     'success': True,
-                    'lines': lines,
-                    'total_lines': total_lines,
+                    'indexing': True,
+                    'lines': [],
+                    'total_lines': None,
                     'current_page': page,
                     'page_size': page_size,
-                    'start_line': start_line + 1,
-                    'end_line': end_line,
-                    'has_more': end_line < total_lines,
-                    'has_previous': start_line > 0,
-                    'direction': direction
+                    'has_more': False,
+                    'has_previous': True
                 }
-                
+            total_lines, _ = indexed
+            if total_lines == 0:
+                return {
+                    'success': True,
+                    'lines': [],
+                    'total_lines': 0,
+                    'current_page': page,
+                    'page_size': page_size,
+                    'has_more': False,
+                    'has_previous': False
+                }
+            
+            # 计算分页范围
+            if direction == 'backward':
+                # 向上滚动，从指定行向前获取
+                end_line = from_line if from_line > 0 else total_lines
+                start_line = max(0, end_line - page_size)
+            else:
+                # 向下滚动，从指定行向后获取
+                start_line = from_line
+                end_line = min(total_lines, start_line + page_size)
+            
+            # 提取指定范围的行
+            selected_lines = line_index.read_lines(start_line, end_line)
+            
+            # 处理行内容
+            lines = []
+            for i, line in enumerate(selected_lines):
+                lines.append({
+                    'line_number': start_line + i + 1,
+                    'content': line,
+                    'timestamp': time.time(),
+                    'type': 'output'
+                })
+            
+            return {
+                'success': True,
+                'lines': lines,
+                'total_lines': total_lines,
+                'current_page': page,
+                'page_size': page_size,
+                'start_line': start_line + 1,
+                'end_line': end_line,
+                'has_more': end_line < total_lines,
+                'has_previous': start_line > 0,
+                'direction': direction
+            }
+            
         except Exception as e:
             logger.error(f'读取文件分页失败 {file_path}: {str(e)}')
             return {
@@ -1207,17 +1177,40 @@ class InstanceManager:
                 'has_more': False
             }
     
+    def _read_file_tail(self, file_path: str, page: int, page_size: int) -> Dict[str, any]:
+        """读取文件最后 page_size 行（大文件首次打开、尚未建立行索引时行号为None）"""
+        selected_lines, start_offset, _ = read_last_lines(file_path, page_size)
+        start_line = get_line_index(file_path).line_number_at(start_offset) if selected_lines else 0
+        total_lines = start_line + len(selected_lines) if start_line is not None else None
+        
+        lines = []
+        for i, line in enumerate(selected_lines):
+            lines.append({
+                'line_number': start_line + i + 1 if start_line is not None else None,
+                'content': line,
+                'timestamp': time.time(),
+                'type': 'output'
+            })
+        
+        return {
+            'success': True,
+            'lines': lines,
+            'total_lines': total_lines,
+            'current_page': page,
+            'page_size': page_size,
+            'start_line': start_line + 1 if start_line is not None else None,
+            'end_line': total_lines,
+            'start_offset': start_offset,
+            'has_more': False,
+            'has_previous': start_offset > 0,
+            'direction': 'backward'
+        }
+    
     def get_terminal_history_info(self, instance_id: str) -> Dict[str, any]:
         """获取终端历史记录统计信息"""
         try:
-            # 获取实例的namespace信息
-            instance_namespace = 'default'
-            with self._lock:
-                if instance_id in self.instances:
-                    instance_namespace = self.instances[instance_id].namespace or 'default'
-            
-            # 获取tmux日志文件路径
-            tmux_log_path = self.get_instance_tmux_log_path(instance_id, instance_namespace)
+            # 按实例当前namespace获取tmux日志文件路径
+            tmux_log_path = self.get_instance_log_path(instance_id)
             
             if not os.path.exists(tmux_log_path):
                 return {
@@ -1227,17 +1220,26 @@ class InstanceManager:
                     'file_size': 0
                 }
             
-            # 获取文件统计信息
+            # 总行数来自增量维护的行索引，无需重新扫描整个文件
             stat = os.stat(tmux_log_path)
-            
-            # 计算总行数
-            with open(tmux_log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                total_lines = sum(1 for _ in f)
+            indexed = get_line_index(tmux_log_path).try_update()
+            if indexed is None:
+                # 行索引正在后台建立，总行数暂时未知
+                return {
+                    'success': True,
+                    'indexing': True,
+                    'total_lines': None,
+                    'file_size': stat.st_size,
+                    'last_modified': stat.st_mtime,
+                    'file_path': tmux_log_path,
+                    'recommended_page_size': 100
+                }
+            total_lines, file_size = indexed
             
             return {
                 'success': True,
                 'total_lines': total_lines,
-                'file_size': stat.st_size,
+                'file_size': file_size,
                 'last_modified': stat.st_mtime,
                 'file_path': tmux_log_path,
                 'recommended_page_size': min(100, max(50, total_lines // 20))
@@ -1252,17 +1254,20 @@ class InstanceManager:
                 'file_size': 0
             }
     
-    def search_terminal_output(self, instance_id: str, query: str, max_results: int = 50) -> Dict[str, any]:
-        """搜索终端输出内容"""
+    def search_terminal_output(self, instance_id: str, query: str, max_results: int = 50,
+                               regex: bool = False, cursor: int = 0) -> Dict[str, any]:
+        """搜索终端输出内容（基于日志的三元组索引，匹配去除ANSI序列后的内容）
+        
+        Args:
+            instance_id: 实例ID
+            query: 查询内容，不区分大小写
+            max_results: 本页最多返回的结果数
+            regex: 是否按正则表达式匹配
+            cursor: 只返回行号大于cursor的结果（上一页返回的 next_cursor）
+        """
         try:
-            # 获取实例的namespace信息
-            instance_namespace = 'default'
-            with self._lock:
-                if instance_id in self.instances:
-                    instance_namespace = self.instances[instance_id].namespace or 'default'
-            
-            # 获取tmux日志文件路径
-            tmux_log_path = self.get_instance_tmux_log_path(instance_id, instance_namespace)
+            # 按实例当前namespace获取tmux日志文件路径
+            tmux_log_path = self.get_instance_log_path(instance_id)
             
             if not os.path.exists(tmux_log_path):
                 return {
@@ -1271,29 +1276,21 @@ class InstanceManager:
                     'results': []
                 }
             
-            # 搜索文件内容
-            results = []
-            with open(tmux_log_path, 'r', encoding='utf-8', errors='ignore') as f:
-                for line_num, line in enumerate(f, 1):
-                    if query.lower() in line.lower():
-                        results.append({
-                            'line_number': line_num,
-                            'content': line.rstrip('\n\r'),
-                            'match_positions': self._find_match_positions(line, query)
-                        })
-                        
-                        if len(results) >= max_results:
-                            break
-            
+            result = get_search_index(tmux_log_path).search(query, regex=regex, limit=max_results, cursor=cursor)
             return {
                 'success': True,
                 'query': query,
-                'results': results,
-                'total_matches': len(results),
+                'regex': regex,
                 'max_results': max_results,
-                'has_more': len(results) >= max_results
+                **result
             }
             
+        except re.error as e:
+            return {
+                'success': False,
+                'error': f'正则表达式无效: {str(e)}',
+                'results': []
+            }
         except Exception as e:
             logger.error(f'搜索终端输出失败 {instance_id}: {str(e)}')
             return {
@@ -1302,126 +1299,80 @@ class InstanceManager:
                 'results': []
             }
     
-    def _find_match_positions(self, text: str, query: str) -> List[Dict[str, int]]:
-        """查找匹配位置"""
-        positions = []
-        text_lower = text.lower()
-        query_lower = query.lower()
-        start = 0
+    def get_conversation_history(self, instance_id: str, namespace: str = None,
+                                 limit: int = None, offset: int = 0) -> List[Dict[str, any]]:
+        """获取实例的对话历史记录
         
-        while True:
-            pos = text_lower.find(query_lower, start)
-            if pos == -1:
-                break
-            positions.append({
-                'start': pos,
-                'end': pos + len(query)
-            })
-            start = pos + 1
-        
-        return positions
-    
-    def get_conversation_history(self, instance_id: str, namespace: str = None) -> List[Dict[str, any]]:
-        """获取实例的对话历史记录"""
+        Args:
+            limit: 返回最近的多少条（为空时返回全部）
+            offset: 跳过最新的offset条，用于向前翻页
+        """
         try:
             if namespace is None:
-                # 尝试从实例信息获取namespace
-                with self._lock:
-                    if instance_id in self.instances:
-                        namespace = self.instances[instance_id].namespace or 'default'
-                    else:
-                        namespace = 'default'
-            
-            conversation_path = self.get_instance_conversation_path(instance_id, namespace)
+                namespace = self.get_instance_namespace(instance_id)
             
-            if not os.path.exists(conversation_path):
-                return []
-            
-            with open(conversation_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('conversations', [])
+            from app.services.conversation_store import conversation_store
+            return conversation_store.read(instance_id, namespace, limit=limit, offset=offset)
                 
         except Exception as e:
             logger.error(f'获取实例 {instance_id} 对话历史失败: {str(e)}')
             return []
     
-    def save_conversation_message(self, instance_id: str, sender: str, message: str, namespace: str = None):
-        """保存对话消息到历史记录"""
+    def save_conversation_message(self, instance_id: str, sender: str, message: str, namespace: str = None,
+                                  message_type: str = 'chat'):
+        """保存对话消息到历史记录（追加写入，不再重写整个文件），同时写入对话记录数据库供查询"""
         try:
             if namespace is None:
-                # 尝试从实例信息获取namespace
-                with self._lock:
-                    if instance_id in self.instances:
-                        namespace = self.instances[instance_id].namespace or 'default'
-                    else:
-                        namespace = 'default'
-            
-            conversation_path = self.get_instance_conversation_path(instance_id, namespace)
-            conversations_dir = os.path.dirname(conversation_path)
-            
-            # 确保目录存在
-            os.makedirs(conversations_dir, exist_ok=True)
-            
-            # 读取现有记录
-            conversations = []
-            if os.path.exists(conversation_path):
-                with open(conversation_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    conversations = data.get('conversations', [])
+                namespace = self.get_instance_namespace(instance_id)
             
-            # 添加新消息
-            new_message = {
-                'timestamp': datetime.now().isoformat(),
+            from app.services.conversation_store import conversation_store
+            from app.services.conversation_db import conversation_db
+            timestamp = datetime.now().isoformat()
+            conversation_store.append(instance_id, namespace, {
+                'timestamp': timestamp,
                 'sender': sender,
                 'message': message,
                 'instance_id': instance_id,
                 'namespace': namespace
-            }
-            conversations.append(new_message)
-            
-            # 保持最近1000条记录
-            if len(conversations) > 1000:
-                conversations = conversations[-1000:]
-            
-            # 保存到文件
-            data = {
-                'instance_id': instance_id,
-                'namespace': namespace,
-                'last_updated': datetime.now().isoformat(),
-                'conversations': conversations
-            }
-            
-            with open(conversation_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            })
+            conversation_db.record(namespace, instance_id, sender, message, timestamp, message_type=message_type)
                 
         except Exception as e:
             logger.error(f'保存对话消息失败 {instance_id}: {str(e)}')
     
-    def get_namespace_conversation_history(self, namespace: str, limit: int = 100) -> List[Dict[str, any]]:
-        """获取指定namespace的所有对话历史"""
+    def get_namespace_conversation_history(self, namespace: str, limit: int = 100, before: str = None) -> List[Dict[str, any]]:
+        """获取指定namespace的对话历史（按时间倒序）
+
+        各实例的记录本身按时间顺序追加，从末尾反向读取后用堆做k路归并，
+        取够limit条即停止，内存占用与limit和实例数相关，与namespace的总记录数无关
+
+        Args:
+            before: 只返回时间戳早于before的记录（向前翻页的游标）
+        """
         try:
             conversations_dir = self.get_namespace_conversations_dir(namespace)
             
             if not os.path.exists(conversations_dir):
                 return []
             
-            all_conversations = []
+            from app.services.conversation_store import conversation_store
             
-            # 遍历namespace下的所有对话文件
-            for filename in os.listdir(conversations_dir):
-                if filename.endswith('.json'):
-                    file_path = os.path.join(conversations_dir, filename)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                            conversations = data.get('conversations', [])
-                            all_conversations.extend(conversations)
-                    except Exception as e:
-                        logger.warning(f'读取对话文件失败 {file_path}: {str(e)}')
+            def read_instance(instance_id):
+                try:
+                    for message in conversation_store.iter_reverse(instance_id, namespace):
+                        if before is None or message.get('timestamp', '') < before:
+                            yield message
+                except Exception as e:
+                    logger.warning(f'读取实例 {instance_id} 对话记录失败: {str(e)}')
             
-            # 按时间排序并限制数量
-            all_conversations.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-            return all_conversations[:limit]
+            streams = [read_instance(instance_id) for instance_id in conversation_store.list_instances(namespace)]
+            try:
+                merged = heapq.merge(*streams, key=lambda x: x.get('timestamp', ''), reverse=True)
+                return list(itertools.islice(merged, limit))
+            finally:
+                # 关闭未读完的记录流，释放打开的分段文件
+                for stream in streams:
+                    stream.close()
             
         except Exception as e:
             logger.error(f'获取namespace {namespace} 对话历史失败: {str(e)}')
@@ -1626,8 +1577,8 @@ class InstanceManager:
                 # 等待实例完全启动
                 time.sleep(3)
                 
-                # 同步实例状态
-                self.sync_screen_instances()
+                # 通知注册表同步实例状态
+                self._request_registry_refresh()
                 
                 # 构建返回消息
                 instance_desc = []
@@ -1835,8 +1786,8 @@ class InstanceManager:
                             # 等待一下让实例完全启动
                             time.sleep(2)
                             
-                            # 同步实例状态
-                            self.sync_screen_instances()
+                            # 通知注册表同步实例状态
+                            self._request_registry_refresh()
                             
                     except subprocess.TimeoutExpired:
                         logger.error(f'启动cliExtra实例 {instance_id} 超时（30秒）')
@@ -1868,6 +1819,7 @@ class InstanceManager:
             with self._lock:
                 count = len(self.instances)
                 self.instances.clear()
+            self._request_registry_refresh()
             
             if result.returncode == 0:
                 logger.info(f'清理了 {count} 个cliExtra实例')
@@ -0,0 +1,171 @@
+"""
+实例注册表服务
+后台维护一份权威的实例快照，所有读接口直接读取快照，不在请求线程中fork qq/cliExtra
+"""
+import os
+import time
+import threading
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any
+
+from app.services.instance_manager import instance_manager
+from app.services.tmux_control import tmux_control
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class InstanceSnapshot:
+    """实例快照（不可变，整体替换）"""
+    generation: int = 0
+    as_of: float = 0.0
+    instances: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典格式"""
+        return {
+            'generation': self.generation,
+            'as_of': self.as_of,
+            'instances': list(self.instances.values())
+        }
+
+    def get_instances(self, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取快照中的实例列表，可按namespace过滤"""
+        instances = self.instances.values()
+        if namespace:
+            return [inst for inst in instances if (inst.get('namespace') or 'default') == namespace]
+        return list(instances)
+
+class InstanceRegistry:
+    """实例注册表 - 单线程刷新，多线程O(1)读取"""
+
+    def __init__(self, manager=None, refresh_interval: float = None, watch_interval: float = None):
+        self.manager = manager or instance_manager
+        self.refresh_interval = refresh_interval or Config.INSTANCE_REGISTRY_INTERVAL
+        self.watch_interval = watch_interval or Config.INSTANCE_REGISTRY_WATCH_INTERVAL
+
+        self._snapshot = InstanceSnapshot()
+        self._refresh_event = threading.Event()
+        self._ready_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._fingerprint = None
+        self._listeners = []
+
+    def start(self):
+        """启动后台刷新线程（幂等）"""
+        with self._start_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='instance_registry')
+            self._thread.start()
+            # tmux会话创建或退出时立即刷新，不必等到下一次定时同步
+            tmux_control.add_listener(self._on_tmux_event)
+            logger.info(f'实例注册表已启动，刷新间隔 {self.refresh_interval}s')
+
+    def stop(self):
+        """停止后台刷新线程"""
+        self._stop_event.set()
+        self._refresh_event.set()
+        tmux_control.remove_listener(self._on_tmux_event)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def request_refresh(self):
+        """请求尽快刷新（实例创建/停止/清理后调用）"""
+        self._refresh_event.set()
+
+    def _on_tmux_event(self, event: str, data: str):
+        if event == 'sessions-changed':
+            self.request_refresh()
+
+    def add_listener(self, callback):
+        """注册快照更新回调 callback(old_snapshot, new_snapshot)"""
+        self._listeners.append(callback)
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        """等待首次同步完成"""
+        return self._ready_event.wait(timeout)
+
+    def get_snapshot(self) -> InstanceSnapshot:
+        """获取当前快照"""
+        if not self._thread:
+            self.start()
+        return self._snapshot
+
+    def get_instances(self, namespace: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取当前快照中的实例列表，可按namespace过滤"""
+        return self.get_snapshot().get_instances(namespace)
+
+    def get_instance(self, instance_id: str) -> Optional[Dict[str, Any]]:
+        """获取快照中的单个实例"""
+        return self.get_snapshot().instances.get(instance_id)
+
+    def refresh_now(self) -> InstanceSnapshot:
+        """立即同步一次并发布新快照（仅在后台线程或启动时调用）"""
+        self.manager.sync_screen_instances()
+
+        with self.manager._lock:
+            instances = {instance_id: instance.to_dict()
+                         for instance_id, instance in self.manager.instances.items()}
+
+        old_snapshot = self._snapshot
+        new_snapshot = InstanceSnapshot(
+            generation=old_snapshot.generation + 1,
+            as_of=time.time(),
+            instances=instances
+        )
+        self._snapshot = new_snapshot
+        self._ready_event.set()
+
+        for callback in list(self._listeners):
+            try:
+                callback(old_snapshot, new_snapshot)
+            except Exception as e:
+                logger.error(f'实例快照回调失败: {e}')
+
+        return new_snapshot
+
+    def _compute_fingerprint(self):
+        """计算实例目录指纹（namespace/instances目录的mtime），用于发现变化"""
+        namespaces_dir = os.path.join(self.manager.work_dir, 'namespaces')
+        try:
+            entries = []
+            for ns_name in sorted(os.listdir(namespaces_dir)):
+                instances_dir = os.path.join(namespaces_dir, ns_name, 'instances')
+                try:
+                    entries.append((ns_name, os.stat(instances_dir).st_mtime_ns))
+                except OSError:
+                    continue
+            return tuple(entries)
+        except OSError:
+            return None
+
+    def _run(self):
+        """后台刷新循环"""
+        last_refresh = 0.0
+        while not self._stop_event.is_set():
+            try:
+                fingerprint = self._compute_fingerprint()
+                changed = fingerprint != self._fingerprint
+                due = time.time() - last_refresh >= self.refresh_interval
+
+                if changed or due or self._refresh_event.is_set():
+                    self._refresh_event.clear()
+                    self._fingerprint = fingerprint
+                    snapshot = self.refresh_now()
+                    last_refresh = time.time()
+                    logger.debug(f'实例快照已刷新: generation={snapshot.generation}, '
+                                 f'instances={len(snapshot.instances)}')
+            except Exception as e:
+                logger.error(f'刷新实例注册表失败: {e}')
+                # 失败时也推迟下一次定时刷新，避免连续fork
+                last_refresh = time.time()
+
+            self._refresh_event.wait(self.watch_interval)
+
+# 全局实例注册表
+instance_registry = InstanceRegistry()
@@ -0,0 +1,417 @@
+"""
+tmux日志读取工具
+- LogTailReader: 按字节偏移增量读取日志，每次读取有上限，不完整的行保留到下次读取，
+  每个输出片段都带有精确的字节偏移，消费者不会重复读取或丢失字节；
+  文件被截断或重建时从头读取，并在之后的第一个片段上标记 rewound；
+  片段带有日志文件标识 log_id（设备号、inode和首行校验和），消费者据此区分重新读取同一文件和新文件
+- LogLineIndex: 稀疏行偏移索引（每N行记录一个字节偏移），持久化为日志旁的 .idx 文件，
+  分页读取时直接定位到目标行，内存占用与日志大小无关
+- read_last_lines: 基于mmap从文件末尾反向查找最近N行，开销与文件大小无关
+"""
+import os
+import re
+import mmap
+import zlib
+import time
+import codecs
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import islice
+from typing import Dict, List, Any, Optional, Tuple
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class LogTailReader:
+    """增量日志读取器（有状态，每个消费者一个）"""
+
+    def __init__(self, path: str, offset: int = 0, max_read_bytes: int = None, max_line_bytes: int = None):
+        self.path = path
+        self.max_read_bytes = max_read_bytes or Config.LOG_READ_MAX_BYTES
+        self.max_line_bytes = max_line_bytes or Config.LOG_MAX_LINE_BYTES
+        self.has_more = False
+        self._reset(offset)
+
+    def _reset(self, offset: int):
+        self._log_id = None  # 日志文件标识（设备号:inode:首行校验和），文件被重建时变化
+        self._rewound = False  # 文件被截断或重建后尚未输出片段
+        self._offset = offset  # 已从文件读入的字节位置
+        self._carry = b''  # 尚未遇到换行的行尾字节
+        self._carry_offset = offset  # carry第一个字节（或解码器中待定字节）在文件中的位置
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    @property
+    def position(self) -> int:
+        """可安全恢复读取的字节位置（未完成行的起始位置）"""
+        return self._carry_offset - len(self._decoder.getstate()[0])
+
+    def read(self) -> List[Dict[str, Any]]:
+        """读取自上次以来新增的完整行（单次最多读取 max_read_bytes 字节）
+
+        Returns:
+            输出片段列表，每个片段包含 content、offset（行起始字节）、new_position（行结束字节）
+            和 log_id（文件标识）
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.has_more = False
+            return []
+        size = stat.st_size
+        if size == self._offset and self._log_id and self._log_id.startswith(f'{stat.st_dev}:{stat.st_ino}:'):
+            self.has_more = False
+            return []
+
+        try:
+            with open(self.path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                size = stat.st_size
+                log_id = self._identify(f, stat)
+                if size < self._offset or (log_id and self._log_id and log_id != self._log_id):
+                    # 文件被截断或重建，从头开始读取
+                    logger.info(f'日志文件被截断或重建，重新读取: {self.path}')
+                    self._reset(0)
+                    self._rewound = True
+                self._log_id = log_id or self._log_id
+
+                f.seek(self._offset)
+                data = f.read(self.max_read_bytes)
+        except OSError:
+            self.has_more = False
+            return []
+        self._offset += len(data)
+        self.has_more = self._offset < size
+
+        return self._consume(data)
+
+    @staticmethod
+    def _identify(f, stat) -> Optional[str]:
+        """日志文件标识：设备号:inode:首行校验和（inode可能被重建的文件复用，日志只追加，首行不会改变）
+
+        首行尚未写完时返回None
+        """
+        head_crc = first_line_crc(f)
+        if head_crc is None:
+            return None
+        return f'{stat.st_dev}:{stat.st_ino}:{head_crc:08x}'
+
+    def _consume(self, data: bytes) -> List[Dict[str, Any]]:
+        """把新读取的字节拆分为完整行，剩余部分保留在carry中"""
+        buffer = self._carry + data
+        line_start = self.position
+        pos = self._carry_offset
+        timestamp = time.time()
+        output = []
+
+        start = 0
+        while True:
+            newline = buffer.find(b'\n', start)
+            if newline < 0:
+                break
+            text = self._decoder.decode(buffer[start:newline + 1])[:-1]
+            pos += newline + 1 - start
+            output.append(self._make_chunk(text, line_start, pos, timestamp))
+            line_start = pos
+            start = newline + 1
+
+        self._carry = buffer[start:]
+        self._carry_offset = pos
+
+        if len(self._carry) >= self.max_line_bytes:
+            # 超长的未完成行：按字符边界输出已解码部分，被截断的多字节字符留在解码器中
+            text = self._decoder.decode(self._carry)
+            self._carry_offset += len(self._carry)
+            self._carry = b''
+            output.append(self._make_chunk(text, line_start, self.position, timestamp, is_partial=True))
+
+        for chunk in output:
+            chunk['log_id'] = self._log_id
+        if output and self._rewound:
+            output[0]['rewound'] = True
+            self._rewound = False
+        return output
+
+    @staticmethod
+    def _make_chunk(text: str, offset: int, end: int, timestamp: float, is_partial: bool = False) -> Dict[str, Any]:
+        return {
+            'type': 'output',
+            'content': text,
+            'timestamp': timestamp,
+            'offset': offset,
+            'new_position': end,
+            'is_partial': is_partial,
+            # 空行只推进位置，不作为流式输出推送
+            'is_streaming': bool(text.strip())
+        }
+
+def first_line_crc(f) -> Optional[int]:
+    """日志首行的校验和（首行尚未写完时返回None）"""
+    head = os.pread(f.fileno(), Config.LOG_IDENTITY_BYTES, 0)
+    newline = head.find(b'\n')
+    if newline < 0:
+        return None
+    return zlib.crc32(head[:newline])
+
+class LogLineIndex:
+    """tmux日志稀疏行偏移索引
+
+    offsets[i] 为第 i*stride 行（从0开始）的起始字节偏移；
+    只索引以换行结尾的完整行，末尾未完成的行在查询时单独计入
+    """
+
+    MAGIC = b'TLI2'
+    HEADER = struct.Struct('<4sIQqQQ')  # magic, stride, inode, head_crc(-1表示未知), indexed_bytes, line_count
+    SCAN_CHUNK = 1024 * 1024
+
+    def __init__(self, log_path: str, stride: int = None, persist: bool = True):
+        self.log_path = log_path
+        self.index_path = log_path + '.idx'
+        self.stride = stride or Config.LOG_INDEX_STRIDE
+        self.persist = persist
+        self._lock = threading.Lock()
+        self._inode = 0
+        self._head_crc = None  # 建立索引时的首行校验和，用于识别原地清空后重新写入的日志
+        self._indexed_bytes = 0  # 已索引到的位置（最后一个换行之后）
+        self._line_count = 0  # 已索引的完整行数
+        self._offsets = array('Q', [0])
+        self._saved_count = 0  # 已写入 .idx 的偏移个数，-1 表示需要整体重写
+        self._dirty = False
+        self._loaded = False
+        self._building = False
+
+    def _load(self):
+        """从 .idx 文件加载索引（文件无效时忽略）"""
+        self._loaded = True
+        if not self.persist:
+            return
+        try:
+            with open(self.index_path, 'rb') as f:
+                header = f.read(self.HEADER.size)
+                magic, stride, inode, head_crc, indexed_bytes, line_count = self.HEADER.unpack(header)
+                if magic != self.MAGIC or stride != self.stride:
+                    return
+                # 只信任header中记录的数量，多出的偏移可能是写入中断留下的
+                count = line_count // stride + 1
+                offsets = array('Q')
+                offsets.frombytes(f.read(count * offsets.itemsize))
+                if len(offsets) != count:
+                    return
+        except (OSError, struct.error):
+            return
+
+        self._inode = inode
+        self._head_crc = head_crc if head_crc >= 0 else None
+        self._indexed_bytes = indexed_bytes
+        self._line_count = line_count
+        self._offsets = offsets
+        self._saved_count = count
+
+    def _reset(self, inode: int):
+        self._inode = inode
+        self._head_crc = None
+        self._indexed_bytes = 0
+        self._line_count = 0
+        self._offsets = array('Q', [0])
+        self._saved_count = -1
+        self._dirty = True
+
+    def _save(self):
+        """把新增的偏移追加到 .idx 文件并更新header"""
+        if not self.persist or not self._dirty:
+            return
+        head_crc = self._head_crc if self._head_crc is not None else -1
+        header = self.HEADER.pack(self.MAGIC, self.stride, self._inode, head_crc, self._indexed_bytes, self._line_count)
+        try:
+            if self._saved_count < 0 or not os.path.exists(self.index_path):
+                tmp_path = self.index_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(header)
+                    self._offsets.tofile(f)
+                os.replace(tmp_path, self.index_path)
+            else:
+                with open(self.index_path, 'r+b') as f:
+                    f.seek(self.HEADER.size + self._saved_count * self._offsets.itemsize)
+                    self._offsets[self._saved_count:].tofile(f)
+                    f.seek(0)
+                    f.write(header)
+            self._saved_count = len(self._offsets)
+            self._dirty = False
+        except OSError as e:
+            # 日志目录不可写时只在内存中维护索引
+            logger.debug(f'保存日志行索引失败 {self.index_path}: {e}')
+            self.persist = False
+
+    def update(self) -> Tuple[int, int]:
+        """扫描新增内容更新索引
+
+        Returns:
+            (总行数, 文件大小)，总行数包含末尾未完成的行
+        """
+        with self._lock:
+            size = self._check()
+            if size > self._indexed_bytes and self._scan(size):
+                self._dirty = True
+            self._save()
+
+            total_lines = self._line_count + (1 if size > self._indexed_bytes else 0)
+            return total_lines, size
+
+    def try_update(self) -> Optional[Tuple[int, int]]:
+        """不阻塞调用方的 update：未索引的内容超过 LOG_INDEX_SYNC_BYTES 时在后台建立索引并返回None"""
+        with self._lock:
+            backlog = self._check() - self._indexed_bytes
+        if self._building or backlog > Config.LOG_INDEX_SYNC_BYTES:
+            self._build_in_background()
+            return None
+        return self.update()
+
+    def _check(self) -> int:
+        """确认索引仍对应当前文件（文件被重建、截断或原地清空后重新写入时重置），返回文件大小"""
+        if not self._loaded:
+            self._load()
+
+        with open(self.log_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            head_crc = first_line_crc(f)
+        replaced = head_crc is not None and self._head_crc is not None and head_crc != self._head_crc
+        if stat.st_ino != self._inode or stat.st_size < self._indexed_bytes or replaced:
+            # 文件被重建或截断，重新建立索引
+            self._reset(stat.st_ino)
+        if self._head_crc is None and head_crc is not None:
+            self._head_crc = head_crc
+            self._dirty = True
+        return stat.st_size
+
+    def _scan(self, size: int) -> bool:
+        """从已索引位置扫描到文件末尾，返回是否有新的完整行"""
+        stride = self.stride
+        line_count = self._line_count
+        position = self._indexed_bytes
+
+        with open(self.log_path, 'rb') as f:
+            f.seek(position)
+            while position < size:
+                chunk = f.read(min(self.SCAN_CHUNK, size - position))
+                if not chunk:
+                    break
+                newlines = chunk.count(b'\n')
+                if newlines:
+                    # 只在跨过stride边界的换行处记录偏移（迭代在C中完成）
+                    matches = re.finditer(b'\n', chunk)
+                    skip = stride - line_count % stride - 1
+                    remaining = newlines
+                    while remaining > skip:
+                        match = next(islice(matches, skip, None))
+                        self._offsets.append(position + match.end())
+                        remaining -= skip + 1
+                        skip = stride - 1
+                    line_count += newlines
+                    self._indexed_bytes = position + chunk.rfind(b'\n') + 1
+                position += len(chunk)
+
+        changed = line_count != self._line_count
+        self._line_count = line_count
+        return changed
+
+    def line_number_at(self, offset: int) -> Optional[int]:
+        """返回从 offset 开始的行的行号（从0开始，offset 须为行首）
+
+        大文件尚未建立索引时不阻塞调用方，而是在后台建立索引并返回None
+        """
+        if self.try_update() is None:
+            return None
+        with self._lock:
+            block = bisect_right(self._offsets, offset) - 1
+            block_offset = self._offsets[block]
+        with open(self.log_path, 'rb') as f:
+            f.seek(block_offset)
+            skipped = f.read(offset - block_offset).count(b'\n')
+        return block * self.stride + skipped
+
+    def _build_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def build():
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f'建立日志行索引失败 {self.log_path}: {e}')
+            finally:
+                self._building = False
+
+        threading.Thread(target=build, daemon=True, name='log_index').start()
+
+    def read_lines(self, start_line: int, end_line: int) -> List[str]:
+        """读取 [start_line, end_line) 范围内的行（从0开始，需先调用 update）"""
+        if end_line <= start_line:
+            return []
+        with self._lock:
+            block = min(start_line // self.stride, len(self._offsets) - 1)
+            offset = self._offsets[block]
+            skip = start_line - block * self.stride
+
+        lines = []
+        with open(self.log_path, 'rb') as f:
+            f.seek(offset)
+            for _ in range(skip):
+                if not f.readline():
+                    return []
+            for _ in range(end_line - start_line):
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line.decode('utf-8', errors='ignore').rstrip('\n\r'))
+        return lines
+
+_line_indexes: Dict[str, LogLineIndex] = {}
+_line_indexes_lock = threading.Lock()
+
+def get_line_index(log_path: str) -> LogLineIndex:
+    """获取日志文件的行索引（每个文件共享一个索引对象）"""
+    with _line_indexes_lock:
+        index = _line_indexes.get(log_path)
+        if index is None:
+            index = LogLineIndex(log_path)
+            _line_indexes[log_path] = index
+        return index
+
+def read_last_lines(path: str, count: int, end_offset: int = None) -> Tuple[List[str], int, int]:
+    """基于mmap从 end_offset（默认文件末尾）反向查找最近的 count 行
+
+    只在映射区域内查找换行符，不解码之前的内容；映射长度在打开时确定，
+    文件仍在追加也不影响本次读取
+
+    Returns:
+        (行列表, 第一行的起始字节偏移, 结束字节偏移)
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end_offset is None else min(end_offset, size)
+        if end == 0 or count <= 0:
+            return [], end, end
+
+        with mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ) as mm:
+            # 结尾的换行属于最后一行
+            cursor = end - 1 if mm[end - 1] == 0x0A else end
+            line_start = 0
+            for _ in range(count):
+                newline = mm.rfind(b'\n', 0, cursor)
+                if newline < 0:
+                    line_start = 0
+                    break
+                line_start = newline + 1
+                cursor = newline
+            data = mm[line_start:end]
+
+    text = data.decode('utf-8', errors='ignore')
+    if text.endswith('\n'):
+        text = text[:-1]
+    lines = [line.rstrip('\r') for line in text.split('\n')]
+    return lines, line_start, end
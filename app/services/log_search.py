@@ -0,0 +1,353 @@
+"""
+tmux日志全文搜索
+按块（约 LOG_SEARCH_BLOCK_BYTES 字节，按行对齐）建立三元组倒排索引：
+三元组 -> 包含它的块编号列表。索引基于去除ANSI序列并转为小写的文本，在后台增量建立；
+查询时先用三元组筛选候选块，只扫描候选块和尚未索引的文件尾部；
+所有索引的总内存超过 LOG_SEARCH_MAX_INDEX_BYTES 时淘汰最久未使用的索引
+"""
+import os
+import re
+import logging
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Any, Tuple
+
+from app.services.ansi_stripper import strip_ansi_bytes
+from config.config import Config
+
+try:
+    from re import _parser as sre_parse  # Python 3.11+
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+def _trigrams(text: str) -> set:
+    """文本中的所有三元组（zip在C中迭代，避免逐字符的Python循环）"""
+    return set(zip(text, text[1:], text[2:]))
+
+def _required_literals(pattern: str) -> List[str]:
+    """提取正则中必须出现的字面量片段（只分析顶层的连续字面量）"""
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return []
+
+    literals = []
+    current = []
+    for op, value in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(chr(value))
+            continue
+        if current:
+            literals.append(''.join(current))
+            current = []
+    if current:
+        literals.append(''.join(current))
+    return [literal.lower() for literal in literals if len(literal) >= 3]
+
+class _Block:
+    """已索引的块"""
+    __slots__ = ('start', 'end', 'first_line', 'last_line')
+
+    def __init__(self, start: int, end: int, first_line: int, last_line: int):
+        self.start = start
+        self.end = end
+        self.first_line = first_line  # 块中第一行的行号（从1开始）
+        self.last_line = last_line
+
+class LogSearchIndex:
+    """单个日志文件的三元组块索引"""
+
+    KEY_BYTES = 300  # 每个三元组键的估计内存开销（字典项、元组和数组对象）
+
+    def __init__(self, log_path: str, block_bytes: int = None):
+        self.log_path = log_path
+        self.block_bytes = block_bytes or Config.LOG_SEARCH_BLOCK_BYTES
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._building = False
+        self._reset(0)
+
+    def _reset(self, inode: int):
+        self._inode = inode
+        self._blocks: List[_Block] = []
+        self._postings: Dict[tuple, array] = {}
+        self._indexed_bytes = 0
+        self._line_count = 0
+        self._memory_bytes = 0  # 倒排表的估计内存占用
+        # (query, regex) -> {块编号: 匹配行数}，块建立后内容不变，计数可以复用
+        self._count_cache: OrderedDict = OrderedDict()
+
+    @property
+    def indexed_bytes(self) -> int:
+        return self._indexed_bytes
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def update(self):
+        """把新增的完整块加入索引（同一时刻只有一个线程在建立索引）"""
+        with self._build_lock:
+            stat = os.stat(self.log_path)
+            with self._lock:
+                if stat.st_ino != self._inode or stat.st_size < self._indexed_bytes:
+                    self._reset(stat.st_ino)
+                position = self._indexed_bytes
+                line_count = self._line_count
+
+            with open(self.log_path, 'rb') as f:
+                f.seek(position)
+                while stat.st_size - position >= self.block_bytes:
+                    data = f.read(self.block_bytes)
+                    cut = data.rfind(b'\n') + 1
+                    if cut == 0:
+                        # 超长的行：读到该行结束为止
+                        data += f.readline()
+                        if not data.endswith(b'\n'):
+                            break
+                        cut = len(data)
+                    data = data[:cut]
+                    f.seek(position + cut)
+
+                    text = strip_ansi_bytes(data).decode('utf-8', errors='ignore').lower()
+                    grams = _trigrams(text)
+                    newlines = data.count(b'\n')
+                    with self._lock:
+                        block_id = len(self._blocks)
+                        new_keys = 0
+                        for gram in grams:
+                            postings = self._postings.get(gram)
+                            if postings is None:
+                                postings = self._postings[gram] = array('I')
+                                new_keys += 1
+                            postings.append(block_id)
+                        self._memory_bytes += len(grams) * 4 + new_keys * self.KEY_BYTES
+                        self._blocks.append(_Block(position, position + cut, line_count + 1, line_count + newlines))
+                        position += cut
+                        line_count += newlines
+                        self._indexed_bytes = position
+                        self._line_count = line_count
+
+        _evict_search_indexes(keep=self)
+
+    def update_in_background(self):
+        """在后台线程中更新索引"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+
+        def build():
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f'建立日志搜索索引失败 {self.log_path}: {e}')
+            finally:
+                self._building = False
+
+        threading.Thread(target=build, daemon=True, name='log_search_index').start()
+
+    def _candidate_blocks(self, literals: List[str], block_count: int) -> List[int]:
+        """根据必须出现的字面量筛选候选块"""
+        if not literals:
+            return list(range(block_count))
+
+        candidates = None
+        with self._lock:
+            for literal in literals:
+                for gram in _trigrams(literal):
+                    postings = self._postings.get(gram)
+                    if postings is None:
+                        return []
+                    blocks = set(postings)
+                    candidates = blocks if candidates is None else candidates & blocks
+                    if not candidates:
+                        return []
+        return sorted(block_id for block_id in candidates if block_id < block_count)
+
+    def search(self, query: str, regex: bool = False, limit: int = 50, cursor: int = 0) -> Dict[str, Any]:
+        """搜索日志（不区分大小写，匹配去除ANSI序列后的内容）
+
+        Args:
+            query: 查询内容
+            regex: 是否按正则表达式匹配
+            limit: 本页最多返回的结果数
+            cursor: 只返回行号大于cursor的结果（上一页返回的 next_cursor）
+
+        Returns:
+            包含 results、total_matches（匹配的总行数）、next_cursor 的字典
+        """
+        matcher = compile_query(query, regex)
+        if regex:
+            literals = _required_literals(query)
+        else:
+            literals = [query.lower()] if len(query) >= 3 else []
+
+        with self._lock:
+            blocks = list(self._blocks)
+            indexed_bytes = self._indexed_bytes
+            next_line = self._line_count + 1
+            counts = self._count_cache.pop((query, regex), {})
+            self._count_cache[(query, regex)] = counts
+            while len(self._count_cache) > Config.LOG_SEARCH_CACHED_QUERIES:
+                self._count_cache.popitem(last=False)
+        candidates = self._candidate_blocks(literals, len(blocks))
+
+        # 未索引的尾部超过一个块时在后台补建索引，本次直接扫描尾部
+        size = os.path.getsize(self.log_path)
+        if size - indexed_bytes >= self.block_bytes:
+            self.update_in_background()
+
+        results = []
+        total = 0
+        before_cursor = 0
+        with open(self.log_path, 'rb') as f:
+            for block_id in candidates:
+                block = blocks[block_id]
+                if block_id in counts and (block.last_line <= cursor or len(results) >= limit):
+                    # 本页不需要该块的结果，使用缓存的计数
+                    total += counts[block_id]
+                    if block.last_line <= cursor:
+                        before_cursor += counts[block_id]
+                    continue
+                matched, before = self._scan(f, block.start, block.end, block.first_line,
+                                             matcher, results, limit, cursor)
+                counts[block_id] = matched
+                total += matched
+                before_cursor += before
+
+            matched, before = self._scan(f, indexed_bytes, size, next_line, matcher, results, limit, cursor)
+            total += matched
+            before_cursor += before
+
+        return {
+            'results': results,
+            'total_matches': total,
+            'next_cursor': results[-1]['line_number'] if results else cursor,
+            'has_more': total - before_cursor > len(results),
+            'indexed_bytes': indexed_bytes,
+            'file_size': size,
+            'candidate_blocks': len(candidates),
+            'total_blocks': len(blocks)
+        }
+
+    @staticmethod
+    def _scan(f, start: int, end: int, first_line: int, matcher, results: List[Dict],
+              limit: int, cursor: int) -> Tuple[int, int]:
+        """扫描 [start, end) 字节范围，收集行号大于cursor的结果
+
+        Returns:
+            (匹配行数, 其中行号不大于cursor的行数)
+        """
+        if end <= start:
+            return 0, 0
+        f.seek(start)
+        text = strip_ansi_bytes(f.read(end - start)).decode('utf-8', errors='ignore')
+
+        matched = 0
+        before = 0
+        line_number = first_line
+        counted_to = 0
+        last_line = None
+        current = None
+        line_start = line_end = 0
+        for match in matcher.finditer(text):
+            position = match.start()
+            line_number += text.count('\n', counted_to, position)
+            counted_to = position
+
+            if line_number != last_line:
+                last_line = line_number
+                line_start = text.rfind('\n', 0, position) + 1
+                line_end = text.find('\n', position)
+                if line_end < 0:
+                    line_end = len(text)
+                matched += 1
+                current = None
+                if line_number <= cursor:
+                    before += 1
+                elif len(results) < limit:
+                    current = {
+                        'line_number': line_number,
+                        'content': text[line_start:line_end],
+                        'match_positions': []
+                    }
+                    results.append(current)
+
+            if current is not None:
+                current['match_positions'].append({
+                    'start': position - line_start,
+                    'end': min(match.end(), line_end) - line_start
+                })
+
+        return matched, before
+
+_search_indexes: OrderedDict = OrderedDict()  # 按最近使用排序
+_search_indexes_lock = threading.Lock()
+
+def get_search_index(log_path: str) -> LogSearchIndex:
+    """获取日志文件的搜索索引（首次使用时在后台建立）"""
+    with _search_indexes_lock:
+        index = _search_indexes.get(log_path)
+        if index is None:
+            index = LogSearchIndex(log_path)
+            _search_indexes[log_path] = index
+            index.update_in_background()
+        else:
+            _search_indexes.move_to_end(log_path)
+        return index
+
+def peek_search_index(log_path: str):
+    """返回已建立的搜索索引（没有时返回None，不会触发建立）"""
+    with _search_indexes_lock:
+        index = _search_indexes.get(log_path)
+        if index is not None:
+            _search_indexes.move_to_end(log_path)
+    return index if index is not None and index.indexed_bytes > 0 else None
+
+def _evict_search_indexes(keep: LogSearchIndex = None):
+    """总内存超过 LOG_SEARCH_MAX_INDEX_BYTES 时淘汰最久未使用的索引（keep 为正在使用的索引，不淘汰）"""
+    with _search_indexes_lock:
+        total = sum(index.memory_bytes for index in _search_indexes.values())
+        for log_path in list(_search_indexes):
+            if total <= Config.LOG_SEARCH_MAX_INDEX_BYTES:
+                break
+            index = _search_indexes[log_path]
+            if index is keep:
+                continue
+            del _search_indexes[log_path]
+            total -= index.memory_bytes
+            logger.info(f'日志搜索索引占用内存超过上限，淘汰: {log_path}')
+
+def compile_query(query: str, regex: bool = False):
+    """编译查询（与索引搜索的匹配规则一致）"""
+    if regex:
+        return re.compile(query, re.IGNORECASE | re.MULTILINE)
+    return re.compile(re.escape(query), re.IGNORECASE)
+
+def scan_log_file(log_path: str, query: str, regex: bool = False, limit: int = 50) -> Dict[str, Any]:
+    """不使用索引顺序扫描整个日志（可在子进程中执行）
+
+    Returns:
+        包含 results 和 total_matches 的字典
+    """
+    matcher = compile_query(query, regex)
+    results = []
+    total = 0
+    line_number = 1
+    position = 0
+    with open(log_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        while position < size:
+            # 按行对齐的大块扫描
+            f.seek(position)
+            data = f.read(Config.LOG_SEARCH_SCAN_BYTES)
+            cut = data.rfind(b'\n') + 1
+            end = position + (cut or len(data))
+            total += LogSearchIndex._scan(f, position, end, line_number, matcher, results, limit, 0)[0]
+            line_number += data[:end - position].count(b'\n')
+            position = end
+    return {'results': results, 'total_matches': total}
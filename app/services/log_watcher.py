@@ -0,0 +1,316 @@
+"""
+日志文件监听服务
+单线程复用监听所有被监控的 tmux.log，Linux 下使用 inotify，其它平台回退为 stat 轮询，
+只在文件真正发生变化（追加/截断/重建）时唤醒订阅者
+"""
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import itertools
+import logging
+from typing import Callable, Dict, Optional
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+# inotify 事件掩码
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+class _Inotify:
+    """inotify 的 ctypes 封装"""
+
+    def __init__(self, libc, fd):
+        self._libc = libc
+        self.fd = fd
+
+    @classmethod
+    def create(cls) -> Optional['_Inotify']:
+        """创建inotify实例，不支持时返回None"""
+        try:
+            libc_name = ctypes.util.find_library('c')
+            if not libc_name:
+                return None
+            libc = ctypes.CDLL(libc_name, use_errno=True)
+            if not hasattr(libc, 'inotify_init1'):
+                return None
+            libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return None
+            return cls(libc, fd)
+        except Exception as e:
+            logger.debug(f'inotify不可用: {e}')
+            return None
+
+    def add_watch(self, path: str) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """读取事件，返回 [(wd, mask, name)]"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class _WatchedFile:
+    """被监听文件的状态"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.callbacks: Dict[int, Callable[[str], None]] = {}
+        self.size = -1
+        self.inode = None
+
+class LogWatcher:
+    """日志文件监听器"""
+
+    def __init__(self, poll_interval: float = None, use_inotify: bool = True):
+        self.poll_interval = poll_interval or Config.LOG_WATCH_POLL_INTERVAL
+        self._files: Dict[str, _WatchedFile] = {}
+        self._tokens: Dict[int, str] = {}
+        self._token_counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+        self._inotify = _Inotify.create() if use_inotify else None
+        self._dir_wds: Dict[str, int] = {}
+        self._wd_dirs: Dict[int, str] = {}
+
+        self._wake_r, self._wake_w = os.pipe()
+        # 两端都不阻塞：管道写满时丢弃唤醒（监听线程已有待处理的唤醒），不会阻塞调用方
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify else 'poll'
+
+    def watch(self, path: str, callback: Callable[[str], None]) -> int:
+        """监听文件变化，返回用于取消监听的token
+
+        注册后会立即触发一次回调，便于订阅者读取已有内容。
+        """
+        path = os.path.abspath(path)
+        token = next(self._token_counter)
+        with self._lock:
+            watched = self._files.get(path)
+            if watched is None:
+                watched = _WatchedFile(path)
+                try:
+                    st = os.stat(path)
+                    watched.size, watched.inode = st.st_size, st.st_ino
+                except OSError:
+                    pass
+                self._files[path] = watched
+            watched.callbacks[token] = callback
+            self._tokens[token] = path
+        self._ensure_started()
+        self._wake()
+        self._invoke(callback, path)
+        return token
+
+    def unwatch(self, token: int):
+        """取消监听"""
+        with self._lock:
+            path = self._tokens.pop(token, None)
+            if path is None:
+                return
+            watched = self._files.get(path)
+            if watched:
+                watched.callbacks.pop(token, None)
+                if not watched.callbacks:
+                    del self._files[path]
+        self._wake()
+
+    def watched_paths(self):
+        with self._lock:
+            return list(self._files)
+
+    def stop(self):
+        """停止监听线程"""
+        self._stop_event.set()
+        self._wake()
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='log_watcher')
+            self._thread.start()
+            logger.info(f'日志监听线程已启动，模式: {self.mode}')
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except OSError:
+            pass
+
+    def _drain_wake(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except OSError:
+            # 已读空（EAGAIN）
+            pass
+
+    def _invoke(self, callback, path):
+        try:
+            callback(path)
+        except Exception as e:
+            logger.error(f'日志变化回调失败 {path}: {e}')
+
+    def _check(self, path: str):
+        """检查文件是否变化，变化则通知订阅者"""
+        with self._lock:
+            watched = self._files.get(path)
+            if watched is None:
+                return
+            try:
+                st = os.stat(path)
+                size, inode = st.st_size, st.st_ino
+            except OSError:
+                size, inode = -1, None
+            if size == watched.size and inode == watched.inode:
+                return
+            watched.size, watched.inode = size, inode
+            callbacks = list(watched.callbacks.values())
+
+        if size < 0:
+            return
+        for callback in callbacks:
+            self._invoke(callback, path)
+
+    def _sync_dir_watches(self):
+        """让inotify目录监听与当前文件集合保持一致"""
+        with self._lock:
+            wanted = {os.path.dirname(path) for path in self._files}
+
+        for directory in list(self._dir_wds):
+            if directory not in wanted:
+                wd = self._dir_wds.pop(directory)
+                self._wd_dirs.pop(wd, None)
+                try:
+                    self._inotify.rm_watch(wd)
+                except Exception:
+                    pass
+
+        for directory in wanted:
+            if directory in self._dir_wds:
+                continue
+            try:
+                wd = self._inotify.add_watch(directory)
+            except OSError:
+                # 目录尚未创建，下一轮重试
+                continue
+            self._dir_wds[directory] = wd
+            self._wd_dirs[wd] = directory
+            # 目录刚开始被监听，补一次检查避免漏掉期间的写入
+            for path in self._paths_in(directory):
+                self._check(path)
+
+    def _paths_in(self, directory: str):
+        with self._lock:
+            return [path for path in self._files if os.path.dirname(path) == directory]
+
+    def _run(self):
+        if self._inotify:
+            self._run_inotify()
+        else:
+            self._run_poll()
+
+    def _run_inotify(self):
+        """inotify模式：阻塞在select上，只有真实事件才唤醒"""
+        while not self._stop_event.is_set():
+            try:
+                self._sync_dir_watches()
+                # 仍有未能监听的目录时周期性重试，否则长时间阻塞
+                pending = any(os.path.dirname(p) not in self._dir_wds for p in self.watched_paths())
+                timeout = Config.LOG_WATCH_RETRY_INTERVAL if pending else None
+                readable, _, _ = select.select([self._inotify.fd, self._wake_r], [], [], timeout)
+
+                if self._wake_r in readable:
+                    self._drain_wake()
+
+                if self._inotify.fd in readable:
+                    changed = set()
+                    overflow = False
+                    for wd, mask, name in self._inotify.read_events():
+                        if mask & IN_Q_OVERFLOW:
+                            overflow = True
+                            continue
+                        directory = self._wd_dirs.get(wd)
+                        if directory is None:
+                            continue
+                        if mask & (IN_IGNORED | IN_DELETE_SELF):
+                            self._dir_wds.pop(directory, None)
+                            self._wd_dirs.pop(wd, None)
+                            continue
+                        if name:
+                            changed.add(os.path.join(directory, name))
+
+                    paths = self.watched_paths() if overflow else [p for p in changed if p in self._files]
+                    for path in paths:
+                        self._check(path)
+            except Exception as e:
+                logger.error(f'inotify监听出错，切换为轮询模式: {e}')
+                self._inotify = None
+                self._run_poll()
+                return
+
+    def _run_poll(self):
+        """轮询模式：每隔 poll_interval 秒stat所有被监听文件，监听变化和停止时提前唤醒"""
+        while not self._stop_event.is_set():
+            for path in self.watched_paths():
+                self._check(path)
+            readable, _, _ = select.select([self._wake_r], [], [], self.poll_interval)
+            if readable:
+                self._drain_wake()
+
+# 全局日志监听器
+log_watcher = LogWatcher()
@@ -0,0 +1,268 @@
+"""
+实例输出分发中心
+每个实例只有一个日志读取者，输出按订阅者（socket sid）分发；
+订阅者各自维护游标和有界队列，慢客户端的积压会被合并或丢弃，不影响其它订阅者
+"""
+import os
+import threading
+import itertools
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Any
+
+from app.services.instance_manager import instance_manager
+from app.services.log_watcher import log_watcher
+from app.services.log_reader import LogTailReader
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class _Subscriber:
+    """单个订阅者：独立游标 + 有界待发送队列"""
+
+    def __init__(self, subscriber_id: str, deliver: Callable):
+        self.subscriber_id = subscriber_id
+        self.deliver = deliver
+        self.queue = deque()
+        self.cursor = 0  # 已投递的最大seq
+        self.dropped = 0  # 因积压被丢弃的条目数
+        self.coalesced = 0  # 因积压被合并的条目数
+        self.scheduled = False
+
+class _InstanceChannel:
+    """单个实例的输出通道"""
+
+    def __init__(self, instance_id: str, backlog_size: int):
+        self.instance_id = instance_id
+        self.subscribers: Dict[str, _Subscriber] = {}
+        self.backlog = deque(maxlen=backlog_size)
+        self.position = 0
+        self.reader: Optional[LogTailReader] = None
+        self.watch_token = None
+        self.read_lock = threading.Lock()
+
+class OutputHub:
+    """实例输出分发中心"""
+
+    def __init__(self, manager=None, watcher=None, queue_size: int = None,
+                 backlog_size: int = None, max_coalesce_chars: int = None, sender_workers: int = None,
+                 reader_factory: Callable = None):
+        self.manager = manager or instance_manager
+        self.watcher = watcher or log_watcher
+        self.reader_factory = reader_factory or LogTailReader
+        self.queue_size = queue_size or Config.OUTPUT_HUB_QUEUE_SIZE
+        self.backlog_size = backlog_size or Config.OUTPUT_HUB_BACKLOG
+        self.max_coalesce_chars = max_coalesce_chars or Config.OUTPUT_HUB_MAX_COALESCE_CHARS
+
+        self._channels: Dict[str, _InstanceChannel] = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self._processor = None
+        self._stop_handler = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=sender_workers or Config.OUTPUT_HUB_SENDERS,
+            thread_name_prefix='output_hub'
+        )
+
+    def set_processor(self, processor: Callable[[str, List[Dict]], List[Dict]]):
+        """设置输出处理函数 processor(instance_id, outputs) -> 需要分发的条目列表"""
+        self._processor = processor
+
+    def set_stop_handler(self, handler: Callable[[str], None]):
+        """设置读取者停止时的回调 handler(instance_id)（最后一个订阅者离开时调用）"""
+        self._stop_handler = handler
+
+    def subscribe(self, instance_id: str, subscriber_id: str, deliver: Callable) -> bool:
+        """订阅实例输出
+
+        Args:
+            instance_id: 实例ID
+            subscriber_id: 订阅者ID（socket sid）
+            deliver: 投递函数 deliver(subscriber_id, items, dropped)
+
+        Returns:
+            是否为该实例创建了新的读取者
+        """
+        with self._lock:
+            channel = self._channels.get(instance_id)
+            created = channel is None
+            if created:
+                channel = _InstanceChannel(instance_id, self.backlog_size)
+                self._channels[instance_id] = channel
+
+            subscriber = channel.subscribers.get(subscriber_id)
+            if subscriber is None:
+                subscriber = _Subscriber(subscriber_id, deliver)
+                channel.subscribers[subscriber_id] = subscriber
+                # 新订阅者先补发最近的输出
+                for item in channel.backlog:
+                    self._enqueue(subscriber, item)
+                self._schedule(subscriber)
+            else:
+                subscriber.deliver = deliver
+
+        if created:
+            log_path = self.manager.get_instance_log_path(instance_id)
+            token = self.watcher.watch(log_path, lambda _path: self._read_channel(instance_id))
+            with self._lock:
+                if self._channels.get(instance_id) is channel:
+                    channel.watch_token = token
+                    token = None
+            if token is not None:
+                # 注册期间所有订阅者已离开
+                self.watcher.unwatch(token)
+            logger.info(f'实例 {instance_id} 输出读取者已创建: {log_path}')
+
+        return created
+
+    def unsubscribe(self, instance_id: str, subscriber_id: str):
+        """取消订阅，最后一个订阅者离开时停止读取"""
+        token = None
+        with self._lock:
+            channel = self._channels.get(instance_id)
+            if channel is None:
+                return
+            channel.subscribers.pop(subscriber_id, None)
+            stopped = not channel.subscribers
+            if stopped:
+                del self._channels[instance_id]
+                token = channel.watch_token
+                channel.watch_token = None
+
+        if token is not None:
+            self.watcher.unwatch(token)
+        if stopped:
+            logger.info(f'实例 {instance_id} 已无订阅者，输出读取者已停止')
+            if self._stop_handler:
+                try:
+                    self._stop_handler(instance_id)
+                except Exception as e:
+                    logger.error(f'实例 {instance_id} 读取者停止回调失败: {e}')
+
+    def unsubscribe_all(self, subscriber_id: str):
+        """取消某个订阅者的所有订阅（socket断开时调用）"""
+        with self._lock:
+            instance_ids = [instance_id for instance_id, channel in self._channels.items()
+                            if subscriber_id in channel.subscribers]
+        for instance_id in instance_ids:
+            self.unsubscribe(instance_id, subscriber_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取分发状态统计"""
+        with self._lock:
+            return {
+                instance_id: {
+                    'position': channel.position,
+                    'subscribers': {
+                        sub.subscriber_id: {
+                            'cursor': sub.cursor,
+                            'pending': len(sub.queue),
+                            'dropped': sub.dropped,
+                            'coalesced': sub.coalesced
+                        } for sub in channel.subscribers.values()
+                    }
+                } for instance_id, channel in self._channels.items()
+            }
+
+    def _read_channel(self, instance_id: str):
+        """读取实例新输出（每个实例同一时刻只有一个读取者）"""
+        with self._lock:
+            channel = self._channels.get(instance_id)
+        if channel is None:
+            return
+
+        with channel.read_lock:
+            while True:
+                try:
+                    outputs = self._read_outputs(channel)
+                    for output in outputs:
+                        if 'new_position' in output:
+                            channel.position = output['new_position']
+                    items = self._processor(instance_id, outputs) if outputs and self._processor else outputs
+                except Exception as e:
+                    logger.error(f'读取实例 {instance_id} 输出失败: {e}')
+                    return
+
+                self.publish(instance_id, items)
+
+                # 单次读取有上限，文件中还有剩余内容时继续读取
+                if channel.reader is None or not channel.reader.has_more:
+                    return
+
+    def _read_outputs(self, channel: _InstanceChannel) -> List[Dict]:
+        """从通道的增量读取器读取新输出，日志文件不存在时回退到实例管理器"""
+        if channel.reader is None:
+            log_path = self.manager.get_instance_log_path(channel.instance_id)
+            if not os.path.exists(log_path):
+                return self.manager.get_instance_output(channel.instance_id, channel.position)
+            channel.reader = self.reader_factory(log_path)
+        return channel.reader.read()
+
+    def publish(self, instance_id: str, items: List[Dict]):
+        """向实例的所有订阅者发布条目"""
+        if not items:
+            return
+        with self._lock:
+            channel = self._channels.get(instance_id)
+            if channel is None:
+                return
+            for item in items:
+                item = {**item, 'seq': next(self._seq)}
+                channel.backlog.append(item)
+                for subscriber in channel.subscribers.values():
+                    self._enqueue(subscriber, item)
+            for subscriber in channel.subscribers.values():
+                self._schedule(subscriber)
+
+    def _enqueue(self, subscriber: _Subscriber, item: Dict):
+        """放入订阅者队列，队列满时合并或丢弃（调用方持有self._lock）"""
+        queue = subscriber.queue
+        if len(queue) < self.queue_size:
+            queue.append(item)
+            return
+
+        tail = queue[-1]
+        if (tail.get('is_streaming') and item.get('is_streaming')
+                and len(tail.get('content', '')) + len(item.get('content', '')) <= self.max_coalesce_chars):
+            # 合并到队尾条目，保持条目数不变
+            queue[-1] = {
+                **item,
+                'content': tail.get('content', '') + '\n' + item.get('content', ''),
+                'raw_content': tail.get('raw_content', '') + '\n' + item.get('raw_content', ''),
+                'coalesced': tail.get('coalesced', 1) + 1
+            }
+            subscriber.coalesced += 1
+        else:
+            # 无法合并时丢弃最旧的条目
+            queue.popleft()
+            queue.append(item)
+            subscriber.dropped += 1
+
+    def _schedule(self, subscriber: _Subscriber):
+        """安排发送任务（调用方持有self._lock）"""
+        if subscriber.queue and not subscriber.scheduled:
+            subscriber.scheduled = True
+            self._executor.submit(self._drain, subscriber)
+
+    def _drain(self, subscriber: _Subscriber):
+        """把订阅者队列中的条目投递出去"""
+        while True:
+            with self._lock:
+                if not subscriber.queue:
+                    subscriber.scheduled = False
+                    return
+                items = list(subscriber.queue)
+                subscriber.queue.clear()
+                dropped = subscriber.dropped
+
+            try:
+                subscriber.deliver(subscriber.subscriber_id, items, dropped)
+            except Exception as e:
+                logger.error(f'向订阅者 {subscriber.subscriber_id} 投递输出失败: {e}')
+
+            with self._lock:
+                subscriber.cursor = max(subscriber.cursor, items[-1]['seq'])
+
+# 全局输出分发中心
+output_hub = OutputHub()
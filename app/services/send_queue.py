@@ -0,0 +1,225 @@
+"""
+消息发送队列
+发送接口只把消息放入队列并立即返回消息ID，由固定数量的工作线程投递：
+- 同一实例的消息严格按提交顺序投递（同一时刻每个实例最多一个线程在投递）
+- 不同实例之间并发投递，并发数受 SEND_QUEUE_WORKERS 限制
+- 失败的投递按递增的间隔延迟重试，重试期间该实例后续的消息继续等待，保证顺序；
+  用尽重试次数后放入死信列表，可以手动重新投递
+- 超时或消息可能已经写入实例（uncertain）的投递不自动重试（重试会重复投递），直接放入死信列表，
+  确认实例没有收到后再手动重新投递
+投递状态通过 message_delivery 事件推送给提交方，提交方未知时推送到实例房间
+（queued / sending / retrying / delivered / dead_letter）
+"""
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import deque, OrderedDict
+from typing import Callable, Dict, List, Optional, Any
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class _Job:
+    """一条待投递的消息"""
+
+    def __init__(self, instance_id: str, message: str, owner: Optional[str], on_delivered: Optional[Callable],
+                 on_finished: Optional[Callable] = None, notify: bool = True):
+        self.message_id = uuid.uuid4().hex
+        self.instance_id = instance_id
+        self.message = message
+        self.owner = owner
+        self.on_delivered = on_delivered
+        self.on_finished = on_finished
+        self.notify = notify
+        self.status = 'queued'
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'message_id': self.message_id,
+            'instance_id': self.instance_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'elapsed': round((self.finished_at or time.time()) - self.created_at, 3)
+        }
+
+class SendQueue:
+    """按实例保序、跨实例并发的消息发送队列"""
+
+    def __init__(self, manager=None, workers: int = None, max_attempts: int = None, retry_delay: float = None):
+        self._manager = manager
+        self.workers = workers or Config.SEND_QUEUE_WORKERS
+        self.max_attempts = max_attempts or Config.SEND_MAX_ATTEMPTS
+        self.retry_delay = retry_delay if retry_delay is not None else Config.SEND_RETRY_DELAY
+        self._lanes: Dict[str, deque] = {}  # instance_id -> 等待投递的消息
+        self._busy = set()  # 正在投递或等待重试的实例
+        self._ready = queue.Queue()  # 有消息可以投递的实例
+        self._jobs: OrderedDict = OrderedDict()  # message_id -> _Job（最近的消息，用于查询状态）
+        self._dead_letters: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._emitter: Optional[Callable[[str, Dict, Optional[str]], None]] = None
+
+    @property
+    def manager(self):
+        if self._manager is None:
+            from app.services.instance_manager import instance_manager
+            self._manager = instance_manager
+        return self._manager
+
+    def set_emitter(self, emitter: Callable[[str, Dict, Optional[str]], None]):
+        """设置事件推送函数 emitter(event, data, room)，room为提交方socket，提交方未知时为实例房间"""
+        self._emitter = emitter
+
+    def _start_workers(self):
+        """首次提交时启动工作线程（调用方持有self._lock）"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run_worker, daemon=True, name=f'send_queue_{i}')
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, instance_id: str, message: str, owner: str = None,
+               on_delivered: Callable[[str, str], None] = None,
+               on_finished: Callable[[Dict[str, Any]], None] = None, notify: bool = True) -> str:
+        """提交消息，立即返回消息ID
+
+        Args:
+            owner: 发起方（socket sid），投递状态只推送给它；为空时推送到实例房间
+            on_delivered: 投递成功后的回调 on_delivered(instance_id, message)
+            on_finished: 投递结束（成功、失败或进入死信）后的回调 on_finished(状态字典)
+            notify: 是否推送 message_delivery 事件（广播等自行汇总结果的调用方可关闭）
+        """
+        job = _Job(instance_id, message, owner, on_delivered, on_finished, notify)
+        with self._lock:
+            self._start_workers()
+            self._jobs[job.message_id] = job
+            while len(self._jobs) > Config.SEND_HISTORY_SIZE:
+                self._jobs.popitem(last=False)
+            self._lanes.setdefault(instance_id, deque()).append(job)
+            if instance_id not in self._busy:
+                self._busy.add(instance_id)
+                self._ready.put(instance_id)
+        self._emit(job)
+        return job.message_id
+
+    def get(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """查询消息投递状态"""
+        with self._lock:
+            job = self._jobs.get(message_id) or self._dead_letters.get(message_id)
+            return job.to_dict() if job else None
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        """用尽重试次数的消息"""
+        with self._lock:
+            return [{**job.to_dict(), 'message': job.message} for job in self._dead_letters.values()]
+
+    def retry_dead_letter(self, message_id: str) -> Optional[str]:
+        """重新投递死信消息，返回新的消息ID"""
+        with self._lock:
+            job = self._dead_letters.pop(message_id, None)
+        if job is None:
+            return None
+        return self.submit(job.instance_id, job.message, job.owner, job.on_delivered, job.on_finished,
+                           notify=job.notify)
+
+    def _run_worker(self):
+        while True:
+            instance_id = self._ready.get()
+            with self._lock:
+                lane = self._lanes.get(instance_id)
+                job = lane[0] if lane else None
+            if job is None:
+                with self._lock:
+                    self._busy.discard(instance_id)
+                continue
+            try:
+                self._deliver(job)
+            except Exception as e:
+                logger.error(f'投递消息 {job.message_id} 时出错: {e}')
+
+    def _deliver(self, job: _Job):
+        """投递队首消息；完成后处理该实例的下一条，需要重试时延迟后再放回就绪队列"""
+        job.status = 'sending'
+        job.attempts += 1
+        self._emit(job)
+
+        try:
+            result = self.manager.send_message(job.instance_id, job.message)
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        if result.get('success'):
+            job.status, job.error = 'delivered', None
+        else:
+            job.error = result.get('error', '发送失败')
+            # 超时时消息可能已经送达，不自动重试，由用户确认后从死信列表重新投递
+            uncertain = result.get('timeout') or result.get('uncertain')
+            if not uncertain and job.attempts < self.max_attempts:
+                job.status = 'retrying'
+                self._emit(job)
+                # 不占用工作线程等待，延迟后该实例重新进入就绪队列，队首仍是这条消息
+                timer = threading.Timer(self.retry_delay * job.attempts, self._ready.put, args=(job.instance_id,))
+                timer.daemon = True
+                timer.start()
+                return
+            job.status = 'dead_letter'
+
+        job.finished_at = time.time()
+        with self._lock:
+            lane = self._lanes[job.instance_id]
+            lane.popleft()
+            if job.status == 'dead_letter':
+                self._dead_letters[job.message_id] = job
+                while len(self._dead_letters) > Config.SEND_DEAD_LETTER_SIZE:
+                    self._dead_letters.popitem(last=False)
+            if lane:
+                self._ready.put(job.instance_id)
+            else:
+                del self._lanes[job.instance_id]
+                self._busy.discard(job.instance_id)
+
+        if job.status == 'delivered' and job.on_delivered:
+            try:
+                job.on_delivered(job.instance_id, job.message)
+            except Exception as e:
+                logger.error(f'消息 {job.message_id} 投递成功回调出错: {e}')
+        elif job.status != 'delivered':
+            logger.warning(f'消息 {job.message_id} 发送到实例 {job.instance_id} 失败（{job.status}）: {job.error}')
+        if job.on_finished:
+            try:
+                job.on_finished(job.to_dict())
+            except Exception as e:
+                logger.error(f'消息 {job.message_id} 投递结束回调出错: {e}')
+        self._emit(job)
+
+    def _emit(self, job: _Job):
+        if self._emitter is None or not job.notify:
+            return
+        try:
+            self._emitter('message_delivery', job.to_dict(), job.owner or f'instance_{job.instance_id}')
+        except Exception as e:
+            logger.debug(f'推送投递状态失败: {e}')
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """等待所有消息处理完成（用于测试和关闭前）"""
+        deadline = time.time() + (timeout or 30)
+        while time.time() < deadline:
+            with self._lock:
+                if not self._busy:
+                    return True
+            time.sleep(0.01)
+        return False
+
+# 全局消息发送队列
+send_queue = SendQueue()
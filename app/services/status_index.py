@@ -0,0 +1,302 @@
+"""
+实例状态文件索引
+监听所有 namespaces/*/status/ 目录，在内存中维护 实例 -> (状态, 修改时间)，
+查询整个集群的状态只需复制一次字典，不再为每个实例逐个探测、打开状态文件：
+- Linux 下使用 inotify（同时监听 namespaces 目录和各 namespace 目录，新建的 namespace 也会被发现）
+- 其它平台回退为定期扫描，只重新读取 mtime 或大小变化的文件
+状态内容变化时通知监听者（同一批文件事件合并为一次通知）
+"""
+import os
+import select
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+from app.services.log_watcher import _Inotify, IN_Q_OVERFLOW, IN_IGNORED, IN_DELETE_SELF
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+STATUS_SUFFIX = '.status'
+
+@dataclass(frozen=True)
+class StatusEntry:
+    """单个实例的状态文件内容"""
+    instance_id: str
+    namespace: str
+    state: str  # 文件内容：0=idle, 1=busy
+    mtime: float
+    path: str
+
+class StatusIndex:
+    """状态文件索引"""
+
+    def __init__(self, work_dir: str = None, poll_interval: float = None, use_inotify: bool = True):
+        self._work_dir = work_dir
+        self.poll_interval = poll_interval or Config.STATUS_WATCH_POLL_INTERVAL
+        self._use_inotify = use_inotify
+        self._index: Dict[str, StatusEntry] = {}
+        self._entries: Dict[str, Dict[str, StatusEntry]] = {}  # instance_id -> {namespace: StatusEntry}
+        self._stats: Dict[str, Tuple[int, int]] = {}  # 文件路径 -> (mtime_ns, size)
+        self._changes: Dict[str, Tuple[Optional[StatusEntry], Optional[StatusEntry]]] = {}  # 尚未通知的变化
+        self._listeners = []
+        self._lock = threading.Lock()
+
+        self._inotify = None
+        self._wds: Dict[int, Tuple[str, Optional[str]]] = {}  # wd -> (目录, 状态目录所属namespace)
+        self._dir_wds: Dict[str, int] = {}
+        self._wake_r, self._wake_w = os.pipe()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def work_dir(self) -> str:
+        if self._work_dir is None:
+            from app.services.instance_manager import instance_manager
+            self._work_dir = instance_manager.work_dir
+        return self._work_dir
+
+    @property
+    def namespaces_dir(self) -> str:
+        return os.path.join(self.work_dir, 'namespaces')
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify else 'poll'
+
+    def start(self):
+        """建立索引并启动监听线程"""
+        with self._lock:
+            if self._thread is not None and not self._stop_event.is_set():
+                return
+            self._stop_event.clear()
+            if self._use_inotify and self._inotify is None:
+                self._inotify = _Inotify.create()
+            self._thread = threading.Thread(target=self._run, daemon=True, name='status_index')
+        # 首次扫描建立基线，不作为变化通知
+        self._rescan(notify=False)
+        self._thread.start()
+        logger.info(f'状态文件索引已启动，模式: {self.mode}，{len(self._index)} 个实例')
+
+    def stop(self):
+        """停止监听线程"""
+        self._stop_event.set()
+        try:
+            os.write(self._wake_w, b'\0')
+        except OSError:
+            pass
+        if self._thread:
+            self._thread.join(timeout=2)
+
+    def add_listener(self, callback: Callable[[Dict[str, Tuple[Optional[StatusEntry], Optional[StatusEntry]]]], None]):
+        """注册变化回调 callback(changes)，changes为 实例ID -> (旧StatusEntry, 新StatusEntry)，
+        只包含状态内容发生变化的实例（仅修改时间变化不通知），新增或删除时对应一侧为None
+        """
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def get(self, instance_id: str) -> Optional[StatusEntry]:
+        """获取实例的状态"""
+        if not self._thread:
+            self.start()
+        return self._index.get(instance_id)
+
+    def snapshot(self) -> Dict[str, StatusEntry]:
+        """获取所有实例的状态（字典副本）"""
+        if not self._thread:
+            self.start()
+        with self._lock:
+            return dict(self._index)
+
+    def _read(self, namespace: str, path: str) -> Optional[StatusEntry]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read().strip()
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        instance_id = os.path.basename(path)[:-len(STATUS_SUFFIX)]
+        return StatusEntry(instance_id, namespace, content, mtime, path)
+
+    def _update(self, path: str, namespace: str, entry: Optional[StatusEntry]):
+        """更新单个状态文件（entry为None表示文件已删除），重新计算该实例的索引项"""
+        instance_id = os.path.basename(path)[:-len(STATUS_SUFFIX)]
+        with self._lock:
+            old = self._index.get(instance_id)
+            by_namespace = self._entries.setdefault(instance_id, {})
+            if entry is None:
+                by_namespace.pop(namespace, None)
+                self._stats.pop(path, None)
+            else:
+                by_namespace[namespace] = entry
+            if by_namespace:
+                # 同名实例出现在多个namespace时取最近更新的
+                self._index[instance_id] = max(by_namespace.values(), key=lambda e: e.mtime)
+            else:
+                del self._entries[instance_id]
+                self._index.pop(instance_id, None)
+            new = self._index.get(instance_id)
+
+            # 合并同一批中的多次变化，最终状态与通知前相同时不再通知
+            first = self._changes.pop(instance_id, (old,))[0]
+            if (first and first.state) != (new and new.state):
+                self._changes[instance_id] = (first, new)
+
+    def _notify(self):
+        """把累积的变化通知给监听者"""
+        with self._lock:
+            changes, self._changes = self._changes, {}
+        if not changes:
+            return
+        for callback in list(self._listeners):
+            try:
+                callback(changes)
+            except Exception as e:
+                logger.error(f'状态变化回调失败: {e}')
+
+    def _refresh_file(self, namespace: str, path: str):
+        """文件变化时重新读取"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._update(path, namespace, None)
+            return
+        entry = self._read(namespace, path)
+        if entry is not None and not entry.state and path in self._stats:
+            # 写入方先截断再写入，读到空内容时保留上一次的状态，等待后续的写入事件
+            return
+        if entry is not None:
+            with self._lock:
+                self._stats[path] = (st.st_mtime_ns, st.st_size)
+        self._update(path, namespace, entry)
+
+    def _rescan(self, notify: bool = True):
+        """扫描所有namespace的状态目录，只重新读取有变化的文件；inotify模式下同步目录监听"""
+        try:
+            namespaces = [entry.name for entry in os.scandir(self.namespaces_dir) if entry.is_dir()]
+        except OSError:
+            namespaces = []
+        status_dirs = {namespace: os.path.join(self.namespaces_dir, namespace, 'status') for namespace in namespaces}
+        if self._inotify:
+            # 先监听再扫描，扫描期间的写入不会遗漏
+            self._sync_watches(namespaces, status_dirs)
+
+        seen = set()
+        for namespace, status_dir in status_dirs.items():
+            try:
+                files = [entry for entry in os.scandir(status_dir)
+                         if entry.name.endswith(STATUS_SUFFIX) and entry.is_file()]
+            except OSError:
+                continue
+            for entry in files:
+                seen.add(entry.path)
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if self._stats.get(entry.path) != (st.st_mtime_ns, st.st_size):
+                    self._refresh_file(namespace, entry.path)
+
+        # 已删除的文件
+        for path in [p for p in self._stats if p not in seen]:
+            namespace = os.path.basename(os.path.dirname(os.path.dirname(path)))
+            self._update(path, namespace, None)
+        if notify:
+            self._notify()
+        else:
+            with self._lock:
+                self._changes.clear()
+
+    def _sync_watches(self, namespaces, status_dirs):
+        """监听 namespaces 目录、各namespace目录（发现新建的status目录）和各status目录"""
+        wanted = {self.namespaces_dir: None}
+        for namespace in namespaces:
+            wanted[os.path.join(self.namespaces_dir, namespace)] = None
+            wanted[status_dirs[namespace]] = namespace
+
+        for directory in [d for d in self._dir_wds if d not in wanted]:
+            wd = self._dir_wds.pop(directory)
+            self._wds.pop(wd, None)
+            try:
+                self._inotify.rm_watch(wd)
+            except Exception:
+                pass
+
+        for directory, namespace in wanted.items():
+            if directory in self._dir_wds:
+                continue
+            try:
+                wd = self._inotify.add_watch(directory)
+            except OSError:
+                # 目录尚未创建，父目录的事件或下一轮重试时再监听
+                continue
+            self._dir_wds[directory] = wd
+            self._wds[wd] = (directory, namespace)
+
+    def _run(self):
+        if self._inotify:
+            self._run_inotify()
+        else:
+            self._run_poll()
+
+    def _run_inotify(self):
+        """inotify模式：状态文件变化只重新读取该文件，目录结构变化时重新扫描"""
+        while not self._stop_event.is_set():
+            try:
+                pending = self.namespaces_dir not in self._dir_wds
+                timeout = Config.LOG_WATCH_RETRY_INTERVAL if pending else None
+                readable, _, _ = select.select([self._inotify.fd, self._wake_r], [], [], timeout)
+                if self._stop_event.is_set():
+                    break
+                if self._inotify.fd not in readable:
+                    if pending:
+                        self._rescan()
+                    continue
+
+                rescan = False
+                changed = {}
+                for wd, mask, name in self._inotify.read_events():
+                    if mask & IN_Q_OVERFLOW:
+                        rescan = True
+                        continue
+                    watched = self._wds.get(wd)
+                    if watched is None:
+                        continue
+                    directory, namespace = watched
+                    if mask & (IN_IGNORED | IN_DELETE_SELF):
+                        self._dir_wds.pop(directory, None)
+                        self._wds.pop(wd, None)
+                        rescan = True
+                    elif namespace is None:
+                        # namespace或status目录的创建/删除
+                        rescan = rescan or directory == self.namespaces_dir or name == 'status'
+                    elif name.endswith(STATUS_SUFFIX):
+                        changed[os.path.join(directory, name)] = namespace
+
+                if rescan:
+                    self._rescan()
+                else:
+                    for path, namespace in changed.items():
+                        self._refresh_file(namespace, path)
+                    self._notify()
+            except Exception as e:
+                logger.error(f'状态目录inotify监听出错，切换为轮询模式: {e}')
+                self._inotify = None
+                self._run_poll()
+                return
+
+    def _run_poll(self):
+        """轮询模式：定期扫描状态目录"""
+        while not self._stop_event.is_set():
+            self._stop_event.wait(self.poll_interval)
+            try:
+                self._rescan()
+            except Exception as e:
+                logger.error(f'扫描状态目录失败: {e}')
+
+# 全局状态文件索引
+status_index = StatusIndex()
@@ -0,0 +1,85 @@
+"""
+实例忙碌/空闲状态推送
+监听状态文件索引，只把 busy/idle 发生翻转的实例按namespace推送给订阅者：
+- 订阅时先发送该namespace的精简全量快照（instance_status_snapshot）
+- 之后只发送变化（instance_status_changed），前端不再轮询 /api/instances/status
+"""
+import logging
+from datetime import datetime
+from typing import Callable, Dict, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+def compact_status(entry) -> Dict[str, Any]:
+    """精简状态：busy/idle 和最后活动时间；没有状态文件时为idle"""
+    if entry is None:
+        return {'status': 'idle', 'last_activity': ''}
+    return {
+        'status': 'busy' if entry.state == '1' else 'idle',
+        'last_activity': datetime.fromtimestamp(entry.mtime).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+def status_room(namespace: Optional[str]) -> str:
+    """namespace订阅对应的Socket.IO房间（namespace为空表示全部）"""
+    return f'instance_status_{namespace or "*"}'
+
+class StatusStream:
+    """状态变化检测与推送"""
+
+    def __init__(self, index=None):
+        self._index = index
+        self._emitter: Optional[Callable[[str, Dict, str], None]] = None
+        self._started = False
+
+    @property
+    def index(self):
+        if self._index is None:
+            from app.services.status_index import status_index
+            self._index = status_index
+        return self._index
+
+    def set_emitter(self, emitter: Callable[[str, Dict, str], None]):
+        """设置事件推送函数 emitter(event, data, room)"""
+        self._emitter = emitter
+
+    def start(self):
+        """开始监听状态文件索引（首次订阅时调用）"""
+        if self._started:
+            return
+        self._started = True
+        self.index.add_listener(self._on_changes)
+        self.index.start()
+
+    def snapshot(self, namespace: str = None) -> Dict[str, Any]:
+        """某个namespace（为空时全部）的精简全量快照"""
+        self.start()
+        return {
+            'namespace': namespace or None,
+            'instances': {instance_id: compact_status(entry)
+                          for instance_id, entry in self.index.snapshot().items()
+                          if not namespace or entry.namespace == namespace}
+        }
+
+    def _on_changes(self, changes):
+        """只推送 busy/idle 翻转的实例，按namespace分组"""
+        by_namespace: Dict[str, Dict[str, Any]] = {}
+        for instance_id, (old, new) in changes.items():
+            old_status, new_status = compact_status(old), compact_status(new)
+            if old_status['status'] == new_status['status']:
+                continue
+            namespace = (new or old).namespace
+            by_namespace.setdefault(namespace, {})[instance_id] = new_status
+
+        if not by_namespace or self._emitter is None:
+            return
+        for namespace, instances in by_namespace.items():
+            data = {'namespace': namespace, 'instances': instances}
+            try:
+                self._emitter('instance_status_changed', data, status_room(namespace))
+                self._emitter('instance_status_changed', data, status_room(None))
+            except Exception as e:
+                logger.debug(f'推送实例状态变化失败: {e}')
+        logger.debug(f'推送实例状态变化: {sum(len(i) for i in by_namespace.values())} 个实例')
+
+# 全局实例状态推送
+status_stream = StatusStream()
@@ -0,0 +1,249 @@
+"""
+tmux控制模式客户端池
+应用持有少量常驻的 `tmux -C` 连接，状态查询等tmux命令通过这些连接发送，不再每次fork进程：
+- 命令按发送顺序对应 %begin/%end（或 %error）响应块，支持多线程并发调用
+- 响应块以外的通知（%output、%session-changed、%sessions-changed 等）分发给监听者
+- 连接断开时在下一次调用时自动重连；无法建立连接或写入命令失败时退回到直接执行 tmux 命令，
+  命令已发出但没有收到响应（超时或连接断开）时不退回，避免非幂等命令（send-keys、paste-buffer）重复执行
+控制连接附加在一个专用的隐藏会话上，不影响实例会话的窗口大小
+"""
+import re
+import logging
+import itertools
+import threading
+import subprocess
+from collections import deque
+from typing import Callable, List, Optional
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 不需要加引号的参数；tmux命令解析器会展开 $变量 和 ~，并把行首的 % 当作指令，这些字符都必须加引号
+_SAFE_ARG = re.compile(r'[\w@:./,=+-]+')
+_OCTAL_ESCAPE = re.compile(r'\\([0-7]{3})')
+
+class TmuxControlError(Exception):
+    """控制连接不可用"""
+
+class TmuxCommandError(Exception):
+    """tmux命令执行失败（响应为 %error）"""
+
+class TmuxCommandTimeout(Exception):
+    """命令已发出但没有收到响应（超时或连接在响应前断开），命令可能已经执行"""
+
+def format_command(args) -> str:
+    """把参数列表拼接成一行tmux命令，必要时加单引号（单引号内的内容不做任何展开）"""
+    parts = []
+    for arg in args:
+        arg = str(arg)
+        if '\n' in arg or '\r' in arg:
+            raise ValueError('tmux控制模式命令参数不能包含换行')
+        if _SAFE_ARG.fullmatch(arg):
+            parts.append(arg)
+        else:
+            parts.append("'" + arg.replace("'", "'\\''") + "'")
+    return ' '.join(parts)
+
+def unescape_output(data: str) -> str:
+    """还原 %output 通知中的八进制转义"""
+    return _OCTAL_ESCAPE.sub(lambda m: chr(int(m.group(1), 8)), data)
+
+class _Pending:
+    """一个等待响应的命令"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lines: List[str] = []
+        self.error: Optional[str] = None
+        self.lost = False  # 连接在响应前断开
+
+class TmuxControlClient:
+    """单个 tmux -C 控制连接"""
+
+    def __init__(self, session_name: str, on_notification: Optional[Callable[[str, str], None]] = None,
+                 socket_name: str = None):
+        self.session_name = session_name
+        self.socket_name = socket_name
+        self._on_notification = on_notification
+        self._process: Optional[subprocess.Popen] = None
+        self._pending = deque()  # 当前进程的待响应命令，每次重连换成新的队列
+        self._write_lock = threading.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        """启动控制连接（调用方持有self._write_lock）"""
+        try:
+            process = subprocess.Popen(
+                [*tmux_base_command(self.socket_name), '-C', 'new-session', '-A', '-s', self.session_name, '-x', '80', '-y', '24'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError as e:
+            raise TmuxControlError(f'启动tmux控制连接失败: {e}')
+        self._process = process
+        # 每个进程有自己的待响应队列，旧进程的读取线程退出时只会结束它自己的命令
+        self._pending = deque()
+        threading.Thread(target=self._read_loop, args=(process, self._pending), daemon=True,
+                         name=f'tmux_control_{process.pid}').start()
+        logger.info(f'已建立tmux控制连接 pid={process.pid}')
+
+    def command(self, args, timeout: float = None) -> List[str]:
+        """发送命令并等待响应
+
+        Raises:
+            TmuxCommandError: 命令执行失败
+            TmuxControlError: 无法建立控制连接或写入命令（命令没有发出）
+            TmuxCommandTimeout: 命令已发出但没有收到响应
+        """
+        line = (format_command(args) + '\n').encode('utf-8')
+        pending = _Pending()
+        with self._write_lock:
+            if not self.alive:
+                self._start()
+            self._pending.append(pending)
+            try:
+                self._process.stdin.write(line)
+                self._process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self._pending.remove(pending)
+                raise TmuxControlError(f'写入tmux控制连接失败: {e}')
+
+        # 超时的命令仍留在队列中，响应到达时按顺序丢弃，不会错配给后续命令
+        if not pending.event.wait(timeout or Config.TMUX_COMMAND_TIMEOUT):
+            raise TmuxCommandTimeout(f'tmux命令超时: {args[0]}')
+        if pending.lost:
+            raise TmuxCommandTimeout(f'tmux控制连接在响应前断开: {args[0]}')
+        if pending.error is not None:
+            raise TmuxCommandError(pending.error)
+        return pending.lines
+
+    def _read_loop(self, process: subprocess.Popen, pending_queue: deque):
+        """读取控制连接输出：响应块交给等待的命令，其余行作为通知分发"""
+        block = None  # (命令编号, 对应的_Pending或None, 已读取的行)
+        for raw in process.stdout:
+            line = raw.decode('utf-8', errors='replace').rstrip('\n')
+            if block is not None:
+                number, pending, lines = block
+                if line.startswith(('%end ', '%error ')) and line.split(' ')[2:3] == [number]:
+                    if pending is not None:
+                        pending.lines = lines
+                        if line.startswith('%error'):
+                            pending.error = '\n'.join(lines) or 'tmux命令执行失败'
+                        pending.event.set()
+                    block = None
+                else:
+                    lines.append(line)
+                continue
+
+            if line.startswith('%begin '):
+                parts = line.split(' ')
+                # flags为1表示本连接发送的命令；连接建立时的初始命令块不对应任何请求
+                pending = pending_queue.popleft() if parts[3:4] == ['1'] and pending_queue else None
+                block = (parts[2], pending, [])
+            elif line.startswith('%') and self._on_notification is not None:
+                event, _, data = line[1:].partition(' ')
+                try:
+                    self._on_notification(event, data)
+                except Exception as e:
+                    logger.error(f'处理tmux通知 {event} 失败: {e}')
+
+        process.wait()
+        logger.info(f'tmux控制连接已断开 pid={process.pid}')
+        while pending_queue:
+            pending = pending_queue.popleft()
+            pending.lost = True
+            pending.event.set()
+
+    def close(self):
+        with self._write_lock:
+            if self.alive:
+                self._process.stdin.close()
+                self._process.terminate()
+
+class TmuxControlPool:
+    """tmux控制连接池，命令轮流分配到各个连接"""
+
+    def __init__(self, size: int = None, session_name: str = None, socket_name: str = None):
+        session_name = session_name or Config.TMUX_CONTROL_SESSION
+        size = size or Config.TMUX_CONTROL_CLIENTS
+        self.socket_name = socket_name  # tmux -L 套接字名，为空时使用默认服务器
+        # 所有连接附加在同一会话上，通知只从第一个连接分发，避免重复
+        self._clients = [TmuxControlClient(session_name, self._dispatch if i == 0 else None, socket_name)
+                         for i in range(size)]
+        self._counter = itertools.count()
+        self._listeners: List[Callable[[str, str], None]] = []
+
+    def command(self, *args, timeout: float = None) -> List[str]:
+        """执行tmux命令，返回输出行"""
+        client = self._clients[next(self._counter) % len(self._clients)]
+        return client.command(args, timeout)
+
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """注册通知监听者 callback(event, data)，如 ('sessions-changed', '')、('output', '%1 ...')
+
+        第一个监听者注册时即建立通知连接
+        """
+        self._listeners.append(callback)
+        if not self._clients[0].alive:
+            try:
+                self._clients[0].command(['display-message', '-p', ''])
+            except (TmuxControlError, TmuxCommandError, TmuxCommandTimeout) as e:
+                logger.warning(f'建立tmux通知连接失败: {e}')
+
+    def remove_listener(self, callback: Callable[[str, str], None]):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _dispatch(self, event: str, data: str):
+        if event == 'output':
+            pane, _, output = data.partition(' ')
+            data = f'{pane} {unescape_output(output)}'
+        for callback in list(self._listeners):
+            callback(event, data)
+
+    def close(self):
+        for client in self._clients:
+            client.close()
+
+def tmux_base_command(socket_name: str = None) -> List[str]:
+    """tmux可执行文件及服务器选择参数"""
+    return ['tmux', '-L', socket_name] if socket_name else ['tmux']
+
+def tmux_query(*args, timeout: float = None, pool: TmuxControlPool = None,
+               raise_timeout: bool = False) -> Optional[List[str]]:
+    """执行tmux命令并返回输出行，命令失败时返回None
+
+    优先通过控制连接执行（pool为空时使用全局连接池）；控制连接不可用（命令没有发出）时退回到直接执行 tmux。
+    命令已发出但没有收到响应时不退回（命令可能已经执行），返回None；
+    raise_timeout 为True时抛出 TmuxCommandTimeout，供非幂等命令的调用方把结果视为不确定
+    """
+    pool = pool or tmux_control
+    try:
+        return pool.command(*args, timeout=timeout)
+    except TmuxCommandError:
+        return None
+    except TmuxCommandTimeout as e:
+        logger.warning(f'{e}')
+        if raise_timeout:
+            raise
+        return None
+    except TmuxControlError as e:
+        logger.debug(f'tmux控制连接不可用，直接执行命令: {e}')
+
+    try:
+        result = subprocess.run([*tmux_base_command(pool.socket_name), *map(str, args)], capture_output=True, text=True,
+                                timeout=timeout or Config.TMUX_COMMAND_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.debug(f'执行tmux命令失败 {args[0]}: {e}')
+        return None
+    return result.stdout.splitlines() if result.returncode == 0 else None
+
+def tmux_session_exists(session_name: str) -> bool:
+    """会话是否存在（按名称精确匹配）"""
+    return bool(session_name) and tmux_query('has-session', '-t', f'={session_name}') is not None
+
+# 全局tmux控制连接池
+tmux_control = TmuxControlPool()
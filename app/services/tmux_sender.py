@@ -0,0 +1,116 @@
+"""
+直接通过tmux向实例发送消息
+从实例注册表找到实例的tmux会话，通过tmux控制连接把文本写入当前窗格，不再为每条消息fork `qq send`：
+- 单行短消息使用 `send-keys -l`（按字面发送，不解释按键名）
+- 多行或较长的消息写入临时文件，`load-buffer` 后以 `paste-buffer -p` 粘贴（应用支持时使用括号粘贴，换行不会被当作回车）
+最后发送一次 Enter 提交；无法解析会话或文本没有写入时返回None，由调用方退回到 `qq send`；
+tmux命令已发出但没有收到响应时消息可能已经送达，返回 timeout 失败结果，不退回也不应重试
+"""
+import os
+import time
+import uuid
+import logging
+import tempfile
+from typing import Dict, Optional
+
+from app.services.tmux_control import TmuxCommandTimeout, tmux_query
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+class TmuxSender:
+    """tmux消息发送器"""
+
+    def __init__(self, manager=None, pool=None, registry=None):
+        self._manager = manager
+        self._pool = pool  # tmux控制连接池，为空时使用全局连接池
+        self._registry = registry
+
+    @property
+    def manager(self):
+        if self._manager is None:
+            from app.services.instance_manager import instance_manager
+            self._manager = instance_manager
+        return self._manager
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            from app.services.instance_registry import instance_registry
+            self._registry = instance_registry
+        return self._registry
+
+    def resolve_session(self, instance_id: str) -> Optional[str]:
+        """查找实例的tmux会话名（优先使用注册表快照）"""
+        instance = self.registry.get_instance(instance_id)
+        session_name = instance.get('screen_session') if instance else None
+        if not session_name:
+            q_instance = self.manager.get_instance(instance_id)
+            session_name = q_instance.screen_session if q_instance else None
+        return session_name or None
+
+    def send(self, instance_id: str, message: str) -> Optional[Dict[str, any]]:
+        """发送消息并回车提交
+
+        Returns:
+            发送结果；会话无法解析或文本未能投递时返回None（尚未向实例写入任何内容，可安全退回）；
+            tmux命令响应超时时返回 timeout 为True的失败结果（消息可能已经送达）
+        """
+        session_name = self.resolve_session(instance_id)
+        if not session_name:
+            return None
+
+        target = f'={session_name}:'
+        started = time.time()
+        try:
+            if not self._deliver(target, message):
+                return None
+            submitted = self._query('send-keys', '-t', target, 'Enter') is not None
+        except TmuxCommandTimeout as e:
+            logger.error(f'向实例 {instance_id} 发送消息超时，消息可能已经送达: {e}')
+            return {'success': False, 'error': f'向实例 {instance_id} 发送消息超时，消息可能已经送达',
+                    'timeout': True}
+
+        if not submitted:
+            # 文本已写入，不能再退回或重试
+            logger.error(f'向实例 {instance_id} 发送回车失败')
+            return {'success': False, 'error': f'消息已写入实例 {instance_id}，但提交失败', 'uncertain': True}
+
+        elapsed = time.time() - started
+        logger.info(f'✅ 已通过tmux直接发送消息到实例 {instance_id}（{len(message)} 字符，{elapsed * 1000:.1f}ms）')
+        return {
+            'success': True,
+            'message': f'消息已成功发送给 {instance_id}',
+            'method': 'tmux'
+        }
+
+    def _query(self, *args):
+        # 发送的命令不是幂等的，超时时抛出 TmuxCommandTimeout，不能退回重复执行
+        return tmux_query(*args, pool=self._pool, raise_timeout=True)
+
+    def _deliver(self, target: str, message: str) -> bool:
+        """把文本写入目标窗格（不提交）"""
+        if '\n' not in message and '\r' not in message and len(message) <= Config.TMUX_SEND_KEYS_MAX_CHARS:
+            # "--" 之后的参数不会被当作选项，消息可以以 "-" 开头；$ ~ 等字符由 format_command 加引号，不会被tmux展开
+            return self._query('send-keys', '-t', target, '-l', '--', message) is not None
+
+        buffer_name = f'cliextra_{uuid.uuid4().hex}'
+        fd, path = tempfile.mkstemp(prefix='cliextra_send_', suffix='.txt')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(message)
+            if self._query('load-buffer', '-b', buffer_name, path) is None:
+                return False
+            # -d 粘贴后删除缓冲区，-p 使用括号粘贴
+            if self._query('paste-buffer', '-d', '-p', '-b', buffer_name, '-t', target) is None:
+                self._query('delete-buffer', '-b', buffer_name)
+                return False
+            return True
+        finally:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# 全局tmux消息发送器
+tmux_sender = TmuxSender()
@@ -0,0 +1,56 @@
+"""
+tmux会话快照
+一次 `tmux list-panes -a -F ...` 取得所有会话的窗格PID、创建时间、最后活动时间和窗格大小，
+按会话名建立索引，供实例同步时一次性合并，不再按会话逐个查询
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.services.tmux_control import tmux_query
+
+logger = logging.getLogger(__name__)
+
+PANE_FORMAT = '#{session_name}|#{pane_pid}|#{session_created}|#{session_activity}|#{pane_width}x#{pane_height}'
+
+@dataclass(frozen=True)
+class SessionInfo:
+    """单个tmux会话的信息（取会话中的第一个窗格）"""
+    session_name: str
+    pane_pid: Optional[int]
+    created: Optional[datetime]
+    activity: Optional[datetime]
+    pane_size: str
+
+def _parse_time(value: str) -> Optional[datetime]:
+    try:
+        return datetime.fromtimestamp(int(value))
+    except (TypeError, ValueError):
+        return None
+
+def parse_pane_lines(lines) -> Dict[str, SessionInfo]:
+    """解析 list-panes 输出，返回 会话名 -> SessionInfo"""
+    sessions = {}
+    for line in lines:
+        # 会话名中可能含有分隔符，从右侧拆分
+        parts = line.rsplit('|', 4)
+        if len(parts) != 5 or parts[0] in sessions:
+            continue
+        session_name, pane_pid, created, activity, pane_size = parts
+        sessions[session_name] = SessionInfo(
+            session_name=session_name,
+            pane_pid=int(pane_pid) if pane_pid.isdigit() else None,
+            created=_parse_time(created),
+            activity=_parse_time(activity),
+            pane_size=pane_size
+        )
+    return sessions
+
+def collect_session_snapshot() -> Dict[str, SessionInfo]:
+    """获取所有tmux会话的快照（一条tmux命令，通过控制连接执行）"""
+    lines = tmux_query('list-panes', '-a', '-F', PANE_FORMAT)
+    if lines is None:
+        # 没有tmux服务器时命令失败，视为没有会话
+        return {}
+    return parse_pane_lines(lines)
@@ -0,0 +1,349 @@
+"""
+实例利用率时间序列
+由状态文件索引的 busy/idle 翻转驱动，在内存中按 1分钟 / 1小时 / 1天 三种粒度累计：
+- 每个实例：忙碌秒数、完成次数（busy -> idle 的次数）、最长连续忙碌时间
+- 每个namespace：同时忙碌的实例数峰值（忙碌秒数、完成次数由实例汇总）
+每种粒度是固定大小的环形数组（array），超出保留期的桶被覆盖；定期把数组写入本地文件，重启后恢复
+"""
+import os
+import json
+import math
+import time
+import zlib
+import base64
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional, Any
+
+from config.config import Config
+
+logger = logging.getLogger(__name__)
+
+# 粒度 -> (桶宽度秒数, 保留的桶数)
+RESOLUTIONS = {
+    '1m': (60, 24 * 60),
+    '1h': (3600, 30 * 24),
+    '1d': (86400, 365)
+}
+
+# 未指定时间范围时各粒度默认返回的桶数
+DEFAULT_POINTS = {'1m': 60, '1h': 24, '1d': 30}
+
+class _Series:
+    """单一粒度的环形数组：桶编号、忙碌秒数、完成次数、最长连续忙碌秒数、忙碌实例数峰值"""
+
+    FIELDS = (('keys', 'l', -1), ('busy', 'f', 0), ('completed', 'I', 0), ('longest', 'f', 0), ('peak', 'H', 0))
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.size = size
+        for name, typecode, initial in self.FIELDS:
+            setattr(self, name, array(typecode, [initial]) * size)
+
+    def _slot(self, bucket: int) -> int:
+        """桶编号对应的数组下标，槽位中是更早的桶时先清零"""
+        i = bucket % self.size
+        if self.keys[i] != bucket:
+            self.keys[i] = bucket
+            self.busy[i] = self.completed[i] = self.longest[i] = self.peak[i] = 0
+        return i
+
+    def add_busy(self, start: float, end: float):
+        """把忙碌区间按桶切分累计"""
+        bucket = int(start // self.width)
+        while start < end:
+            bucket_end = (bucket + 1) * self.width
+            i = self._slot(bucket)
+            self.busy[i] += min(end, bucket_end) - start
+            start = bucket_end
+            bucket += 1
+
+    def add_completion(self, t: float, streak: float):
+        i = self._slot(int(t // self.width))
+        self.completed[i] += 1
+        self.longest[i] = max(self.longest[i], streak)
+
+    def set_peak(self, t: float, busy_count: int):
+        i = self._slot(int(t // self.width))
+        self.peak[i] = max(self.peak[i], min(busy_count, 0xFFFF))
+
+    def get(self, bucket: int, field: str):
+        """读取桶中的值，桶已被覆盖或尚无数据时为0"""
+        i = bucket % self.size
+        return getattr(self, field)[i] if self.keys[i] == bucket else 0
+
+    def to_state(self) -> Dict[str, str]:
+        # 数组大多为0，压缩后保存
+        return {name: base64.b64encode(zlib.compress(getattr(self, name).tobytes())).decode('ascii')
+                for name, _, _ in self.FIELDS}
+
+    def load_state(self, state: Dict[str, str]):
+        for name, typecode, _ in self.FIELDS:
+            values = array(typecode)
+            values.frombytes(zlib.decompress(base64.b64decode(state[name])))
+            if len(values) == self.size:
+                setattr(self, name, values)
+
+def _new_series() -> Dict[str, _Series]:
+    return {resolution: _Series(width, size) for resolution, (width, size) in RESOLUTIONS.items()}
+
+class _InstanceTrack:
+    """单个实例的当前状态和时间序列"""
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self.busy_since: Optional[float] = None
+        self.series = _new_series()
+
+class UtilizationRecorder:
+    """实例利用率记录器"""
+
+    def __init__(self, path: str = None, index=None, save_interval: float = None):
+        self._path = path or Config.UTILIZATION_PATH
+        self._index = index
+        self.save_interval = save_interval or Config.UTILIZATION_SAVE_INTERVAL
+        self._instances: Dict[str, _InstanceTrack] = {}
+        self._namespaces: Dict[str, Dict[str, _Series]] = {}  # namespace -> 忙碌实例数峰值序列
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            from app.services.instance_manager import instance_manager
+            self._path = os.path.join(instance_manager.work_dir, 'utilization.json')
+        return self._path
+
+    @property
+    def index(self):
+        if self._index is None:
+            from app.services.status_index import status_index
+            self._index = status_index
+        return self._index
+
+    def start(self):
+        """加载已保存的数据，订阅状态变化并启动定期保存线程"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run_saver, daemon=True, name='utilization_saver')
+        self.load()
+        self.index.add_listener(self._on_changes)
+        # 以当前状态为起点，忙碌中的实例从状态文件的修改时间开始计时
+        for instance_id, entry in self.index.snapshot().items():
+            self.record(instance_id, entry.namespace, entry.state == '1', entry.mtime)
+        self._thread.start()
+        logger.info(f'实例利用率记录已启动，{len(self._instances)} 个实例')
+
+    def stop(self):
+        """停止定期保存并立即保存一次"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.save()
+
+    def _on_changes(self, changes):
+        now = time.time()
+        for instance_id, (old, new) in changes.items():
+            entry = new or old
+            busy = new is not None and new.state == '1'
+            self.record(instance_id, entry.namespace, busy, new.mtime if new else now)
+
+    def record(self, instance_id: str, namespace: str, busy: bool, timestamp: float = None):
+        """记录实例的忙碌/空闲状态，状态未变化时忽略"""
+        timestamp = timestamp or time.time()
+        with self._lock:
+            track = self._instances.get(instance_id)
+            if track is None:
+                track = self._instances[instance_id] = _InstanceTrack(namespace)
+            track.namespace = namespace
+            if busy == (track.busy_since is not None):
+                return
+
+            if busy:
+                track.busy_since = timestamp
+            else:
+                start = min(track.busy_since, timestamp)
+                for series in track.series.values():
+                    series.add_busy(start, timestamp)
+                    series.add_completion(timestamp, timestamp - start)
+                track.busy_since = None
+
+            busy_count = sum(1 for t in self._instances.values()
+                             if t.namespace == namespace and t.busy_since is not None)
+            ns_series = self._namespaces.setdefault(namespace, _new_series())
+            for series in ns_series.values():
+                series.set_peak(timestamp, busy_count)
+            self._dirty = True
+
+    def _buckets(self, resolution: str, since: float = None, until: float = None) -> List[int]:
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f'不支持的粒度 {resolution}，可选: {", ".join(RESOLUTIONS)}')
+        width, size = RESOLUTIONS[resolution]
+        until = until or time.time()
+        last = int(until // width)
+        first = int(since // width) if since else last - DEFAULT_POINTS[resolution] + 1
+        first = max(first, last - size + 1)
+        return list(range(first, last + 1))
+
+    @staticmethod
+    def _ongoing(track: _InstanceTrack, bucket: int, width: int, now: float) -> float:
+        """当前仍在忙碌的区间落在桶内的秒数"""
+        if track.busy_since is None:
+            return 0
+        start, end = bucket * width, (bucket + 1) * width
+        return max(0.0, min(end, now) - max(start, track.busy_since))
+
+    def instance_series(self, instance_id: str, resolution: str = '1m',
+                        since: float = None, until: float = None) -> Optional[Dict[str, Any]]:
+        """单个实例的利用率、完成次数和连续忙碌时间"""
+        now = time.time()
+        buckets = self._buckets(resolution, since, until)
+        width = RESOLUTIONS[resolution][0]
+        with self._lock:
+            track = self._instances.get(instance_id)
+            if track is None:
+                return None
+            series = track.series[resolution]
+            points = []
+            for bucket in buckets:
+                busy = series.get(bucket, 'busy') + self._ongoing(track, bucket, width, now)
+                points.append({
+                    'timestamp': bucket * width,
+                    'busy_seconds': round(busy, 1),
+                    'utilization': round(min(busy / width, 1.0), 4),
+                    'completed': series.get(bucket, 'completed'),
+                    'longest_streak': round(series.get(bucket, 'longest'), 1)
+                })
+            is_busy = track.busy_since is not None
+            current_streak = now - track.busy_since if is_busy else 0
+            namespace = track.namespace
+
+        return {
+            'instance_id': instance_id,
+            'namespace': namespace,
+            'resolution': resolution,
+            'points': points,
+            'summary': self._summarize(points, width, 1, {
+                'state': 'busy' if is_busy else 'idle',
+                'current_streak': round(current_streak, 1)
+            })
+        }
+
+    def namespace_series(self, namespace: str, resolution: str = '1m',
+                         since: float = None, until: float = None) -> Dict[str, Any]:
+        """namespace的平均/峰值忙碌实例数、利用率和吞吐量"""
+        now = time.time()
+        buckets = self._buckets(resolution, since, until)
+        width = RESOLUTIONS[resolution][0]
+        with self._lock:
+            tracks = {instance_id: track for instance_id, track in self._instances.items()
+                      if track.namespace == namespace}
+            ns_series = self._namespaces.get(namespace)
+            points = []
+            for bucket in buckets:
+                busy = completed = longest = 0
+                for track in tracks.values():
+                    series = track.series[resolution]
+                    busy += series.get(bucket, 'busy') + self._ongoing(track, bucket, width, now)
+                    completed += series.get(bucket, 'completed')
+                    longest = max(longest, series.get(bucket, 'longest'))
+                avg_busy = busy / width
+                # 桶内没有状态翻转时峰值至少是平均忙碌实例数
+                peak = max(ns_series[resolution].get(bucket, 'peak') if ns_series else 0,
+                           math.ceil(avg_busy - 1e-6))
+                points.append({
+                    'timestamp': bucket * width,
+                    'busy_seconds': round(busy, 1),
+                    'avg_busy': round(avg_busy, 3),
+                    'peak_busy': peak,
+                    'utilization': round(avg_busy / len(tracks), 4) if tracks else 0,
+                    'completed': completed,
+                    'longest_streak': round(longest, 1)
+                })
+            busy_now = sum(1 for track in tracks.values() if track.busy_since is not None)
+
+        summary = self._summarize(points, width, len(tracks) or 1, {
+            'instances': len(tracks),
+            'busy_now': busy_now,
+            'peak_busy': max((p['peak_busy'] for p in points), default=0),
+            'avg_busy': round(sum(p['avg_busy'] for p in points) / len(points), 3) if points else 0
+        })
+        return {'namespace': namespace, 'resolution': resolution, 'points': points, 'summary': summary}
+
+    @staticmethod
+    def _summarize(points, width: int, capacity: int, extra: Dict[str, Any]) -> Dict[str, Any]:
+        busy = sum(p['busy_seconds'] for p in points)
+        span = len(points) * width
+        completed = sum(p['completed'] for p in points)
+        return {
+            'busy_seconds': round(busy, 1),
+            'utilization': round(busy / (span * capacity), 4) if span else 0,
+            'completed': completed,
+            'throughput_per_hour': round(completed * 3600 / span, 2) if span else 0,
+            'longest_streak': max((p['longest_streak'] for p in points), default=0),
+            **extra
+        }
+
+    def save(self):
+        """把时间序列写入本地文件（先写临时文件再替换）"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'version': 1,
+                'saved_at': time.time(),
+                'instances': {instance_id: {
+                    'namespace': track.namespace,
+                    'series': {r: s.to_state() for r, s in track.series.items()}
+                } for instance_id, track in self._instances.items()},
+                'namespaces': {namespace: {r: s.to_state() for r, s in series.items()}
+                               for namespace, series in self._namespaces.items()}
+            }
+            self._dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f'保存实例利用率数据失败 {self.path}: {e}')
+
+    def load(self):
+        """从本地文件恢复时间序列（当前忙碌状态由状态文件重新确定）"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f'读取实例利用率数据失败 {self.path}: {e}')
+            return
+
+        try:
+            with self._lock:
+                for instance_id, item in data.get('instances', {}).items():
+                    track = self._instances.setdefault(instance_id, _InstanceTrack(item.get('namespace', 'default')))
+                    for resolution, state in item.get('series', {}).items():
+                        if resolution in track.series:
+                            track.series[resolution].load_state(state)
+                for namespace, states in data.get('namespaces', {}).items():
+                    ns_series = self._namespaces.setdefault(namespace, _new_series())
+                    for resolution, state in states.items():
+                        if resolution in ns_series:
+                            ns_series[resolution].load_state(state)
+        except (KeyError, ValueError, AttributeError, zlib.error) as e:
+            logger.warning(f'实例利用率数据格式错误 {self.path}: {e}')
+            return
+        logger.info(f'已恢复 {len(data.get("instances", {}))} 个实例的利用率数据')
+
+    def _run_saver(self):
+        while not self._stop_event.wait(self.save_interval):
+            self.save()
+
+# 全局实例利用率记录器
+utilization_recorder = UtilizationRecorder()
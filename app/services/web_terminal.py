@@ -192,11 +192,8 @@ class WebTerminalManager:
     
     def _check_tmux_session(self, session_name: str) -> bool:
         """检查tmux会话是否存在"""
-        try:
-            result = subprocess.run(['tmux', 'list-sessions'], capture_output=True, text=True)
-            return session_name in result.stdout
-        except Exception:
-            return False
+        from app.services.tmux_control import tmux_session_exists
+        return tmux_session_exists(session_name)
     
     def send_input(self, instance_id: str, data: str) -> bool:
         """发送输入到指定终端"""
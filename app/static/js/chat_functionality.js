@@ -108,15 +108,16 @@ async function broadcastToCurrentNamespace(message) {
             },
             body: JSON.stringify({
                 message: safeMessage,
-                namespace: currentNamespace
+                namespace: currentNamespace,
+                client_sid: (typeof socket !== 'undefined' && socket) ? socket.id : undefined
             })
         });
         
         const result = await response.json();
         
         if (result.success) {
-            console.log('广播消息成功:', result);
-            showNotification(`消息已广播到 ${currentNamespace} namespace`, 'success');
+            console.log('广播消息已开始:', result);
+            showNotification(`正在广播到 ${currentNamespace} namespace 的 ${result.total} 个实例`, 'info', 2000);
         } else {
             console.error('广播消息失败:', result.error);
             showNotification(`广播失败: ${result.error}`, 'error');
@@ -145,7 +146,9 @@ async function sendToSpecificInstance(instanceId, message) {
             },
             body: JSON.stringify({
                 target_instance: safeInstanceId,
-                message: safeMessage
+                message: safeMessage,
+                // 投递结果通过 message_delivery 事件只推送给当前连接
+                client_sid: (typeof socket !== 'undefined' && socket) ? socket.id : undefined
             })
         });
         
@@ -208,7 +211,9 @@ async function sendToSystemInstance(systemTarget, message) {
             },
             body: JSON.stringify({
                 target_instance: safeTarget,
-                message: safeMessage
+                message: safeMessage,
+                // 投递结果通过 message_delivery 事件只推送给当前连接
+                client_sid: (typeof socket !== 'undefined' && socket) ? socket.id : undefined
             })
         });
         
@@ -266,15 +271,16 @@ async function broadcastToAllInstances(message) {
             },
             body: JSON.stringify({
                 message: message,
-                namespace: getCurrentNamespace() || 'default'
+                namespace: getCurrentNamespace() || 'default',
+                client_sid: (typeof socket !== 'undefined' && socket) ? socket.id : undefined
             })
         });
         
         const result = await response.json();
         
         if (result.success) {
-            console.log('✅ 广播消息发送成功');
-            addSystemMessage(`消息已广播给 ${result.sent_count} 个实例`);
+            console.log('✅ 广播消息已开始:', result.broadcast_id);
+            addSystemMessage(`正在广播给 ${result.total} 个实例`);
         } else {
             console.error('❌ 广播发送失败:', result.error);
             addSystemMessage(`广播发送失败: ${result.error}`);
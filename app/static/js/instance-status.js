@@ -1,12 +1,15 @@
 /**
  * 实例状态管理 JavaScript 模块 - 简化版
  * 只显示 idle/busy 状态，无筛选功能
+ * 有WebSocket连接时订阅当前namespace的状态推送，否则退回定时轮询
  */
 
 class InstanceStatusManager {
     constructor() {
         this.statusUpdateInterval = null;
         this.statusCache = {};
+        this.socketBound = null;
+        this.subscribedNamespace = undefined;
         this.init();
     }
 
@@ -32,9 +35,11 @@ class InstanceStatusManager {
         // 立即更新一次
         this.updateAllInstancesStatus();
         
-        // 每30秒更新一次状态
+        // 每30秒检查一次：已订阅推送时不再请求，WebSocket不可用时轮询
         this.statusUpdateInterval = setInterval(() => {
-            this.updateAllInstancesStatus();
+            if (!this.isSubscribed()) {
+                this.updateAllInstancesStatus();
+            }
         }, 30000);
     }
 
@@ -48,10 +53,56 @@ class InstanceStatusManager {
         }
     }
 
+    /**
+     * 获取可用的WebSocket连接
+     */
+    getSocket() {
+        return (typeof socket !== 'undefined' && socket && socket.connected) ? socket : null;
+    }
+
+    isSubscribed() {
+        return this.getSocket() !== null && this.subscribedNamespace !== undefined;
+    }
+
+    /**
+     * 订阅当前namespace的状态推送：订阅后服务端先发送快照，之后只推送忙碌/空闲发生变化的实例
+     */
+    subscribeStatus(ws) {
+        if (this.socketBound !== ws) {
+            this.socketBound = ws;
+            ws.on('instance_status_snapshot', (data) => {
+                this.statusCache = data.instances || {};
+                this.updateStatusDisplay();
+            });
+            ws.on('instance_status_changed', (data) => {
+                Object.assign(this.statusCache, data.instances || {});
+                this.updateStatusDisplay();
+            });
+            // 重新连接后服务端的订阅已丢失，需要重新订阅
+            ws.on('connect', () => {
+                this.subscribedNamespace = undefined;
+                this.updateAllInstancesStatus();
+            });
+        }
+
+        const namespace = (typeof getCurrentNamespace === 'function' ? getCurrentNamespace() : null) || '';
+        if (this.subscribedNamespace !== undefined && this.subscribedNamespace !== namespace) {
+            ws.emit('unsubscribe_instance_status', { namespace: this.subscribedNamespace });
+        }
+        this.subscribedNamespace = namespace;
+        ws.emit('subscribe_instance_status', { namespace: namespace });
+    }
+
     /**
      * 更新所有实例状态
      */
     async updateAllInstancesStatus() {
+        const ws = this.getSocket();
+        if (ws) {
+            this.subscribeStatus(ws);
+            return;
+        }
+        
         try {
             const response = await fetch('/api/instances/status');
             const data = await response.json();
@@ -24,7 +24,8 @@ class TerminalScrollLoader {
             // 获取历史记录信息
             const historyInfo = await this.getHistoryInfo();
             if (historyInfo.success) {
-                this.totalLines = historyInfo.total_lines;
+                // 大日志正在后台建立行索引时总行数未知，先从文件末尾加载
+                this.totalLines = historyInfo.total_lines || 0;
                 this.pageSize = historyInfo.recommended_page_size || 100;
                 console.log(`📊 终端历史记录: ${this.totalLines} 行, 推荐页大小: ${this.pageSize}`);
             }
@@ -89,7 +90,12 @@ class TerminalScrollLoader {
             this.isLoading = true;
             this.showLoadingIndicator('正在加载历史记录...');
             
-            // 获取当前最早的行号
+            // 获取当前最早的行号（行索引建立完成前没有行号，重新加载最新内容以获得行号）
+            if (this.allLines.length > 0 && this.allLines[0].line_number == null) {
+                this.isLoading = false;
+                await this.loadLatestContent();
+                return;
+            }
             const earliestLine = this.allLines.length > 0 ? this.allLines[0].line_number - 1 : this.totalLines;
             
             const response = await fetch(
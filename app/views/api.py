@@ -11,8 +11,15 @@ import platform
 import datetime
 
 from app.services.instance_manager import instance_manager
+from app.services.instance_registry import instance_registry
 from app.services.chat_manager import chat_manager
+from app.services.conversation_db import conversation_db, to_epoch
+from app.services.tmux_control import tmux_session_exists
+from app.services.send_queue import send_queue
+from app.services.broadcast_engine import broadcast_engine
+from app.services.utilization import utilization_recorder
 from app.services.role_manager import role_manager
+from config.config import Config
 
 bp = Blueprint('api', __name__)
 logger = logging.getLogger(__name__)
@@ -27,13 +34,16 @@ def get_instances():
         
         logger.info(f"📋 获取实例列表 - namespace: {namespace or 'None'}, show_all: {show_all}")
         
+        # 从实例注册表快照读取，不在请求线程中fork qq；实例和 generation/as_of 取自同一快照
+        snapshot = instance_registry.get_snapshot()
         if namespace:
             # 获取指定namespace的实例
-            instances = instance_manager.get_instances_by_namespace(namespace)
+            instances = snapshot.get_instances(namespace)
+        elif show_all:
+            instances = snapshot.get_instances()
         else:
-            # 根据show_all参数决定是否显示所有namespace
-            instance_manager.sync_screen_instances(show_all_namespaces=show_all)
-            instances = instance_manager.get_instances()
+            # 只显示default namespace
+            instances = snapshot.get_instances('default')
         
         # 获取聊天历史
         from app.services.chat_manager import chat_manager
@@ -44,7 +54,9 @@ def get_instances():
             'instances': instances,
             'chat_history': chat_history,
             'show_all_namespaces': show_all,  # 返回当前设置
-            'namespace_filter': namespace or None
+            'namespace_filter': namespace or None,
+            'generation': snapshot.generation,
+            'as_of': snapshot.as_of
         })
     except Exception as e:
         logger.error("获取实例列表失败: {}".format(str(e)))
@@ -54,10 +66,14 @@ def get_instances():
 def get_instances_status():
     """获取所有实例状态信息"""
     try:
-        instances_status = instance_manager.get_instances_status()
+        # 实例列表和 generation/as_of 取自同一快照
+        snapshot = instance_registry.get_snapshot()
+        instances_status = instance_manager.get_instances_status(snapshot)
         return jsonify({
             'success': True,
-            'instances_status': instances_status
+            'instances_status': instances_status,
+            'generation': snapshot.generation,
+            'as_of': snapshot.as_of
         })
     except Exception as e:
         logger.error("获取实例状态失败: {}".format(str(e)))
@@ -299,9 +315,18 @@ def restart_instance(instance_id):
 
 
 
+def _record_sent_message(instance_id, message):
+    """消息投递成功后记录到聊天历史"""
+    chat_manager.add_chat_message('user', message, instance_id)
+
+def _log_send_failure(result):
+    """消息投递失败（包括超时进入死信）时记录系统日志"""
+    if result['status'] != 'delivered':
+        chat_manager.add_system_log(f'向tmux实例 {result["instance_id"]} 发送消息失败: {result["error"]}')
+
 @bp.route('/send', methods=['POST'])
 def send_message():
-    """发送消息到实例"""
+    """发送消息到实例（加入发送队列后立即返回消息ID，投递结果通过 message_delivery 事件推送）"""
     try:
         data = request.get_json()
         instance_id = data.get('instance_id')
@@ -310,15 +335,14 @@ def send_message():
         if not instance_id or not message:
             return jsonify({'success': False, 'error': '缺少必要参数'}), 400
         
-        result = instance_manager.send_message(instance_id, message)
-        
-        if result['success']:
-            # 记录用户消息到聊天历史
-            chat_manager.add_chat_message('user', message, instance_id)
-        else:
-            chat_manager.add_system_log(f'向tmux实例 {instance_id} 发送消息失败: {result["error"]}')
-        
-        return jsonify(result)
+        message_id = send_queue.submit(instance_id, message, owner=data.get('client_sid'),
+                                       on_delivered=_record_sent_message, on_finished=_log_send_failure)
+        return jsonify({
+            'success': True,
+            'queued': True,
+            'message_id': message_id,
+            'message': f'消息已加入发送队列: {instance_id}'
+        }), 202
         
     except Exception as e:
         logger.error("发送消息失败: {}\3".format(str(e)))
@@ -366,21 +390,14 @@ def send_message_new():
         
         logger.info(f"📤 发送消息到实例 {target_clean}: {message_clean}")
         
-        result = instance_manager.send_message(target_clean, message_clean)
-        
-        if result['success']:
-            logger.info(f"✅ 消息发送成功到 {target_clean}")
-            return jsonify({
-                'success': True,
-                'message': f'消息已发送给 {target_clean}',
-                'target': target_clean
-            })
-        else:
-            logger.error(f"❌ 消息发送失败到 {target_clean}: {result.get('error', 'Unknown error')}")
-            return jsonify({
-                'success': False, 
-                'error': result.get('error', '发送失败')
-            }), 500
+        message_id = send_queue.submit(target_clean, message_clean, owner=data.get('client_sid'))
+        return jsonify({
+            'success': True,
+            'queued': True,
+            'message_id': message_id,
+            'message': f'消息已加入发送队列: {target_clean}',
+            'target': target_clean
+        }), 202
             
     except UnicodeDecodeError as e:
         logger.error(f"UTF-8编码错误: {e}")
@@ -389,6 +406,27 @@ def send_message_new():
         logger.error(f"发送消息异常: {e}")
         return jsonify({'success': False, 'error': '服务器内部错误'}), 500
 
+@bp.route('/send/<message_id>', methods=['GET'])
+def get_send_status(message_id):
+    """查询消息投递状态"""
+    status = send_queue.get(message_id)
+    if status is None:
+        return jsonify({'success': False, 'error': f'消息 {message_id} 不存在'}), 404
+    return jsonify({'success': True, **status})
+
+@bp.route('/send/dead-letters', methods=['GET'])
+def get_dead_letters():
+    """获取用尽重试次数的消息"""
+    return jsonify({'success': True, 'dead_letters': send_queue.dead_letters()})
+
+@bp.route('/send/dead-letters/<message_id>/retry', methods=['POST'])
+def retry_dead_letter(message_id):
+    """重新投递死信消息"""
+    new_message_id = send_queue.retry_dead_letter(message_id)
+    if new_message_id is None:
+        return jsonify({'success': False, 'error': f'死信消息 {message_id} 不存在'}), 404
+    return jsonify({'success': True, 'message_id': new_message_id}), 202
+
 @bp.route('/test-status', methods=['GET'])
 def test_status_reading():
     """测试状态文件读取 - 用于验证新格式"""
@@ -488,14 +526,23 @@ def clean_all():
 
 @bp.route('/chat/history', methods=['GET'])
 def get_chat_history():
-    """获取聊天历史"""
+    """获取聊天历史
+    
+    支持按消息ID游标读取：since_id 只返回新消息，before_id 向前翻页；
+    指定 since_id 时可用 wait（秒）长轮询，直到有新消息或超时
+    """
     try:
         limit = request.args.get('limit', type=int)
         namespace = request.args.get('namespace', 'q_cli')
+        since_id = request.args.get('since_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+        wait = request.args.get('wait', 0, type=float)
+        wait = max(0.0, min(wait, Config.CHAT_LONG_POLL_MAX_WAIT))
         
         # 获取聊天历史，支持namespace参数
-        history = chat_manager.get_chat_history(limit=limit, namespace=namespace)
-        return jsonify({'success': True, 'history': history})
+        page = chat_manager.get_chat_page(namespace=namespace, limit=limit, since_id=since_id,
+                                          before_id=before_id, wait=wait)
+        return jsonify({'success': True, **page})
     except Exception as e:
         logger.error("获取聊天历史失败: {}\3".format(str(e)))
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -515,7 +562,8 @@ def get_system_logs():
 def clear_chat():
     """清空聊天历史"""
     try:
-        chat_manager.clear_chat_history()
+        namespace = (request.get_json(silent=True) or {}).get('namespace')
+        chat_manager.clear_chat_history(namespace)
         chat_manager.add_system_log('聊天历史已清空')
         return jsonify({'success': True, 'message': '聊天历史已清空'})
     except Exception as e:
@@ -538,13 +586,17 @@ def get_instance_conversations(instance_id):
     """获取实例的对话历史"""
     try:
         namespace = request.args.get('namespace')
-        conversations = instance_manager.get_conversation_history(instance_id, namespace)
+        limit = request.args.get('limit', Config.CONVERSATION_PAGE_SIZE, type=int)
+        offset = request.args.get('offset', 0, type=int)
+        conversations = instance_manager.get_conversation_history(instance_id, namespace, limit, offset)
         
         return jsonify({
             'success': True,
             'instance_id': instance_id,
             'namespace': namespace,
-            'conversations': conversations
+            'conversations': conversations,
+            'offset': offset,
+            'has_more': len(conversations) == limit
         })
     except Exception as e:
         logger.error("获取实例 {instance_id} 对话历史失败: {}\3".format(str(e)))
@@ -574,21 +626,87 @@ def save_instance_conversation(instance_id):
 
 @bp.route('/namespaces/<namespace>/conversations', methods=['GET'])
 def get_namespace_conversations(namespace):
-    """获取namespace的所有对话历史"""
+    """获取namespace的对话历史（按时间倒序，before 为时间戳游标）"""
     try:
         limit = int(request.args.get('limit', 100))
-        conversations = instance_manager.get_namespace_conversation_history(namespace, limit)
+        before = request.args.get('before')
+        # 多取一条用于判断是否还有更早的记录
+        conversations = instance_manager.get_namespace_conversation_history(namespace, limit + 1, before)
+        has_more = len(conversations) > limit
+        conversations = conversations[:limit]
         
         return jsonify({
             'success': True,
             'namespace': namespace,
             'conversations': conversations,
-            'total': len(conversations)
+            'total': len(conversations),
+            'has_more': has_more,
+            'next_before': conversations[-1].get('timestamp') if has_more else None
         })
     except Exception as e:
         logger.error("获取namespace {namespace} 对话历史失败: {}\3".format(str(e)))
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bp.route('/conversations/search', methods=['GET'])
+def search_conversations():
+    """在对话记录数据库中查询（q 全文搜索，可按 namespace / instance_id / sender / since / until 过滤）"""
+    try:
+        limit = max(1, min(request.args.get('limit', 100, type=int), Config.CONVERSATION_PAGE_SIZE))
+        result = conversation_db.query(
+            namespace=request.args.get('namespace'),
+            instance_id=request.args.get('instance_id'),
+            sender=request.args.get('sender'),
+            text=request.args.get('q'),
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            cursor=request.args.get('cursor'),
+            limit=limit
+        )
+        return jsonify({'success': True, **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'无效的查询参数: {str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"搜索对话记录失败: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/utilization/instances/<instance_id>', methods=['GET'])
+def get_instance_utilization(instance_id):
+    """实例利用率时间序列（window=1m/1h/1d，可选 since / until）：忙碌秒数、利用率、完成次数、最长连续忙碌时间"""
+    try:
+        utilization_recorder.start()
+        result = utilization_recorder.instance_series(
+            instance_id,
+            request.args.get('window', '1m'),
+            since=to_epoch(request.args.get('since')),
+            until=to_epoch(request.args.get('until'))
+        )
+        if result is None:
+            return jsonify({'success': False, 'error': f'实例 {instance_id} 没有状态记录'}), 404
+        return jsonify({'success': True, **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'无效的查询参数: {str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"获取实例 {instance_id} 利用率失败: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/utilization/namespaces/<namespace>', methods=['GET'])
+def get_namespace_utilization(namespace):
+    """namespace利用率时间序列（window=1m/1h/1d，可选 since / until）：平均/峰值忙碌实例数、利用率、吞吐量"""
+    try:
+        utilization_recorder.start()
+        result = utilization_recorder.namespace_series(
+            namespace,
+            request.args.get('window', '1m'),
+            since=to_epoch(request.args.get('since')),
+            until=to_epoch(request.args.get('until'))
+        )
+        return jsonify({'success': True, **result})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'无效的查询参数: {str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"获取namespace {namespace} 利用率失败: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @bp.route('/replay/<target_type>/<target_name>', methods=['GET'])
 def replay_conversations(target_type, target_name):
     """回放对话记录"""
@@ -612,110 +730,38 @@ def replay_conversations(target_type, target_name):
 def get_instance_session_info(instance_id):
     """获取实例的tmux会话信息"""
     try:
-        # 首先尝试从实例管理器获取信息
-        instance_manager.sync_screen_instances()
-        instances = instance_manager.get_instances()
-        
-        # 查找指定实例
-        target_instance = None
-        for instance in instances:
-            if instance.get('id') == instance_id:
-                target_instance = instance
-                break
+        # 从实例注册表快照查找指定实例
+        target_instance = instance_registry.get_instance(instance_id)
         
-        if target_instance:
-            session_name = target_instance.get('screen_session', '')
-            
-            # 检查 tmux 会话是否真的存在
-            try:
-                result = subprocess.run(['tmux', 'list-sessions'], capture_output=True, text=True)
-                session_exists = result.returncode == 0 and session_name in result.stdout
-            except:
-                session_exists = False
-            
-            if not session_exists:
-                return jsonify({
-                    'success': False,
-                    'error': f'实例 {instance_id} 的 tmux 会话不存在或已停止，请重新启动实例'
-                }), 404
-            
+        if not target_instance:
+            # 快照中没有该实例，请求后台尽快刷新
+            instance_registry.request_refresh()
             return jsonify({
-                'success': True,
-                'instance_id': instance_id,
-                'session': session_name,
-                'status': target_instance.get('status', ''),
-                'namespace': target_instance.get('namespace', 'default'),
-                'project_path': target_instance.get('project_path', ''),
-                'role': target_instance.get('role', ''),
-                'attach_command': "tmux attach-session -t {}\3".format(session_name)
-            })
-        
-        # 如果实例管理器中没有找到，尝试使用cliExtra命令
-        result = subprocess.run(
-            ['cliExtra', 'list', instance_id, '--json'],
-            capture_output=True, text=True, timeout=10
-        )
+                'success': False,
+                'error': f'实例 {instance_id} 不存在'
+            }), 404
         
-        if result.returncode == 0:
-            import json
-            data = json.loads(result.stdout.strip())
-            
-            # 适配新的JSON格式
-            if 'instances' in data and data['instances']:
-                instance_data = data['instances'][0]  # 单个实例查询返回数组
-            else:
-                instance_data = data.get('instance', {})
-            
-            if instance_data:
-                session_name = instance_data.get('session', '')
-                status = instance_data.get('status', '')
-                
-                # 检查实例状态
-                if status.lower() in ['not running', 'stopped', 'detached']:
-                    return jsonify({
-                        'success': False,
-                        'error': f'实例 {instance_id} 当前状态为 "{status}"，无法创建 Web 终端。请先启动实例。'
-                    }), 400
-                
-                # 检查 tmux 会话是否真的存在
-                try:
-                    tmux_result = subprocess.run(['tmux', 'list-sessions'], capture_output=True, text=True)
-                    session_exists = tmux_result.returncode == 0 and session_name in tmux_result.stdout
-                except:
-                    session_exists = False
-                
-                if not session_exists:
-                    return jsonify({
-                        'success': False,
-                        'error': f'实例 {instance_id} 的 tmux 会话 "{session_name}" 不存在。请重新启动实例。'
-                    }), 404
-                
-                return jsonify({
-                    'success': True,
-                    'instance_id': instance_id,
-                    'session': session_name,
-                    'status': status,
-                    'namespace': instance_data.get('namespace', 'default'),
-                    'project_path': instance_data.get('project_path', ''),
-                    'role': instance_data.get('role', ''),
-                    'attach_command': instance_data.get('attach_command', '')
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': f'实例 {instance_id} 不存在'
-                }), 404
-        else:
+        session_name = target_instance.get('screen_session', '')
+        status = target_instance.get('status', '')
+
+        # 检查 tmux 会话是否真的存在（通过tmux控制连接）
+        if not tmux_session_exists(session_name):
             return jsonify({
                 'success': False,
-                'error': f'获取实例信息失败: {result.stderr}'
-            }), 500
-            
-    except subprocess.TimeoutExpired:
+                'error': f'实例 {instance_id} 的 tmux 会话不存在或已停止，请重新启动实例'
+            }), 404
+        
         return jsonify({
-            'success': False,
-            'error': '获取实例信息超时'
-        }), 500
+            'success': True,
+            'instance_id': instance_id,
+            'session': session_name,
+            'status': status,
+            'namespace': target_instance.get('namespace', 'default'),
+            'project_path': target_instance.get('path', ''),
+            'role': target_instance.get('role', ''),
+            'attach_command': f"tmux attach-session -t {session_name}"
+        })
+            
     except Exception as e:
         logger.error(f'获取实例 {instance_id} 会话信息失败: {str(e)}')
         return jsonify({
@@ -1064,47 +1110,68 @@ def update_role_content(role_name):
 
 @bp.route('/broadcast', methods=['POST'])
 def broadcast_message():
-    """广播消息到指定namespace的所有实例"""
+    """广播消息到指定namespace（或角色）的所有实例
+    
+    默认立即返回广播ID和目标实例，各实例结果通过 broadcast_result 事件推送，结束后推送 broadcast_complete；
+    wait=true 时等待全部完成并返回汇总
+    """
     try:
         data = request.get_json()
         message = data.get('message', '').strip()
         namespace = data.get('namespace', '').strip()
+        role = (data.get('role') or '').strip()
         broadcast_all = data.get('broadcast_all', True)  # 默认广播给所有namespace
         
         if not message:
             return jsonify({'success': False, 'error': '消息不能为空'}), 400
         
-        logger.info(f"📢 广播消息 - namespace: {namespace or 'None'}, broadcast_all: {broadcast_all}")
-        
-        # 调用修改后的广播方法
-        result = instance_manager.broadcast_message(message, namespace, broadcast_all)
+        logger.info(f"📢 广播消息 - namespace: {namespace or 'None'}, role: {role or 'None'}, broadcast_all: {broadcast_all}")
         
-        if result['success']:
-            # 根据参数生成不同的日志消息
-            if namespace:
-                log_msg = f'广播消息到namespace "{namespace}": {message}'
-                response_msg = f'消息已广播给namespace "{namespace}" 中的 {result.get("sent_count", 0)} 个实例'
-            elif broadcast_all:
-                log_msg = f'广播消息到所有namespace: {message}'
-                response_msg = f'消息已广播给所有namespace中的 {result.get("sent_count", 0)} 个实例'
-            else:
-                log_msg = f'广播消息到default namespace: {message}'
-                response_msg = f'消息已广播给default namespace中的 {result.get("sent_count", 0)} 个实例'
-            
-            chat_manager.add_system_log(log_msg)
+        # 根据参数生成不同的日志消息
+        if namespace:
+            scope_desc = f'namespace "{namespace}"'
+        elif broadcast_all:
+            scope_desc = '所有namespace'
+        else:
+            scope_desc = 'default namespace'
+        if role:
+            scope_desc += f' 中角色为 "{role}"'
+        broadcast_scope = 'specific' if namespace else ('all' if broadcast_all else 'default')
+        chat_manager.add_system_log(f'广播消息到{scope_desc}: {message}')
+        
+        if data.get('wait'):
+            result = instance_manager.broadcast_message(message, namespace, broadcast_all, role)
+            if not result['success']:
+                logger.error(f'广播消息失败: {result.get("error", "未知错误")}')
+                return jsonify(result), 500
             return jsonify({
-                'success': True,
-                'sent_count': result.get('sent_count', 0),
-                'message': response_msg,
-                'broadcast_scope': 'specific' if namespace else ('all' if broadcast_all else 'default')
+                **result,
+                'message': f'消息已广播给{scope_desc}中的 {result["sent_count"]}/{result["total"]} 个实例',
+                'broadcast_scope': broadcast_scope
             })
-        else:
-            logger.error(f'广播消息失败: {result.get("error", "未知错误")}')
-            return jsonify({'success': False, 'error': result.get('error', '广播失败')}), 500
+        
+        started = broadcast_engine.start(message, namespace, role, broadcast_all, owner=data.get('client_sid'))
+        return jsonify({
+            'success': True,
+            'queued': True,
+            **started,
+            'total': len(started['targets']),
+            'message': f'正在广播给{scope_desc}中的 {len(started["targets"])} 个实例',
+            'broadcast_scope': broadcast_scope
+        }), 202
             
     except Exception as e:
         logger.error(f'广播消息失败: {str(e)}')
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/broadcast/<broadcast_id>', methods=['GET'])
+def get_broadcast_status(broadcast_id):
+    """查询广播进度和各实例结果"""
+    status = broadcast_engine.get(broadcast_id)
+    if status is None:
+        return jsonify({'success': False, 'error': '广播不存在或已过期'}), 404
+    return jsonify({'success': True, **status})
+
 @bp.route('/tools', methods=['GET'])
 def get_tools():
     """获取可用工具列表"""
@@ -1461,8 +1528,7 @@ def test_chat_cache():
         namespace = request.args.get('namespace', 'q_cli')
         
         # 强制重新加载缓存
-        chat_manager.namespace_cache_loaded = False
-        chat_manager.load_namespace_cache_history(namespace)
+        chat_manager.refresh_cache_history(namespace)
         
         # 获取历史记录
         history = chat_manager.get_chat_history(limit=10, namespace=namespace)
@@ -1472,7 +1538,7 @@ def test_chat_cache():
             'message': '缓存测试完成',
             'history': history,
             'count': len(history),
-            'cache_loaded': chat_manager.namespace_cache_loaded
+            'cache_loaded': chat_manager.is_namespace_cache_loaded(namespace)
         })
         
     except Exception as e:
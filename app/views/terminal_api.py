@@ -61,6 +61,8 @@ def search_terminal_output(instance_id):
     try:
         query = request.args.get('q', '')
         max_results = int(request.args.get('max_results', 50))
+        regex = request.args.get('regex', 'false').lower() == 'true'
+        cursor = int(request.args.get('cursor', 0))
         
         if not query:
             return jsonify({'error': 'Search query is required'}), 400
@@ -68,7 +70,7 @@ def search_terminal_output(instance_id):
         from app.services.instance_manager import InstanceManager
         manager = InstanceManager()
         
-        result = manager.search_terminal_output(instance_id, query, max_results)
+        result = manager.search_terminal_output(instance_id, query, max_results, regex, cursor)
         return jsonify(result)
         
     except Exception as e:
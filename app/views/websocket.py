@@ -1,25 +1,26 @@
 """
 WebSocket handlers for real-time communication
 """
-from flask import Blueprint
+from flask import Blueprint, request
 from flask_socketio import emit, join_room, leave_room
-import threading
-import time
+import re
 import logging
-import subprocess
 
 from app import socketio
 from app.services.instance_manager import instance_manager
 from app.services.chat_manager import chat_manager
 from app.services.content_filter import content_filter  # 导入内容过滤器
+from app.services.conversation_stream import conversation_streams
+from app.services.output_hub import output_hub
+from app.services.fleet_search import fleet_search
+from app.services.tmux_control import tmux_session_exists
+from app.services.send_queue import send_queue
+from app.services.broadcast_engine import broadcast_engine
+from app.services.status_stream import status_stream, status_room
 
 bp = Blueprint('websocket', __name__)
 logger = logging.getLogger(__name__)
 
-# 存储客户端监控的实例
-client_monitors = {}
-monitor_positions = {}  # 跟踪每个监控会话的文件读取位置
-
 @socketio.on('connect')
 def handle_connect():
     """客户端连接"""
@@ -46,20 +47,14 @@ def handle_join_monitoring(data):
         join_room(f'instance_{instance_id}')
         logger.info(f'✅ 客户端已加入房间: instance_{instance_id}')
         
-        # 启动监控线程
-        if instance_id not in client_monitors:
-            client_monitors[instance_id] = True
-            monitor_positions[instance_id] = 0  # 初始化文件位置
-            thread = threading.Thread(
-                target=monitor_instance_output, 
-                args=(instance_id,), 
-                daemon=True,
-                name=f"monitor_{instance_id}"
-            )
-            thread.start()
-            logger.info(f'🚀 监控线程已启动: {instance_id}')
+        # 实例变为空闲时结束当前的对话消息
+        conversation_streams.start()
+        
+        # 订阅实例输出（同一实例只有一个读取者，每个订阅者独立游标和队列）
+        if output_hub.subscribe(instance_id, request.sid, deliver_instance_outputs):
+            logger.info(f'🚀 实例输出读取者已创建: {instance_id}')
         else:
-            logger.info(f'📊 监控线程已存在: {instance_id}')
+            logger.info(f'📊 实例输出读取者已存在: {instance_id}')
         
         emit('monitoring_started', {'instance_id': instance_id})
         logger.info(f'📤 发送监控启动确认: {instance_id}')
@@ -82,15 +77,9 @@ def handle_leave_monitoring(data):
         # 离开房间
         leave_room(f'instance_{instance_id}')
         
-        # 停止监控
-        if instance_id in client_monitors:
-            client_monitors[instance_id] = False
-            del client_monitors[instance_id]
-            logger.info(f'🛑 停止监控实例 {instance_id}')
-        
-        # 清理文件位置跟踪
-        if instance_id in monitor_positions:
-            del monitor_positions[instance_id]
+        # 取消本客户端的订阅，不影响其它客户端
+        output_hub.unsubscribe(instance_id, request.sid)
+        logger.info(f'🛑 客户端停止监控实例 {instance_id}')
         
         emit('monitoring_stopped', {'instance_id': instance_id})
         logger.info(f'📤 发送监控停止确认: {instance_id}')
@@ -99,174 +88,107 @@ def handle_leave_monitoring(data):
         logger.error(f'❌ 停止监控时出错: {str(e)}')
         emit('error', {'message': f'停止监控失败: {str(e)}'})
 
-def monitor_instance_output(instance_id):
-    """监控tmux实例输出（支持流式输出和偏移量跟踪）"""
-    logger.info(f'🔄 开始监控tmux实例输出: {instance_id}')
+def process_instance_outputs(instance_id, outputs):
+    """处理tmux实例新输出（由输出分发中心的读取者调用，每个实例只处理一次）
     
-    while client_monitors.get(instance_id, False):
-        try:
-            # 获取当前文件位置
-            current_position = monitor_positions.get(instance_id, 0)
-            
-            # 获取新输出
-            outputs = instance_manager.get_instance_output(instance_id, current_position)
-            
-            if outputs:
-                logger.info(f'📥 tmux实例 {instance_id} 收到 {len(outputs)} 个输出')
+    Returns:
+        需要分发给各订阅者的流式输出条目
+    """
+    items = []
+    
+    try:
+        logger.info(f'📥 tmux实例 {instance_id} 收到 {len(outputs)} 个输出')
+        
+        for output in outputs:
+            # 增量解析对话：每行只解析一次，实时推送 message_started/message_delta/message_completed
+            try:
+                content = output['content'] if output.get('is_partial') else output['content'] + '\n'
+                # 只有日志读取器的输出带字节偏移和文件标识，可用于跳过重新订阅时重放的内容、发现日志被截断或重建
+                end = output.get('new_position') if 'offset' in output else None
+                conversation_streams.feed(instance_id, content, end=end, log_id=output.get('log_id'),
+                                          rewound=output.get('rewound', False))
+            except Exception as e:
+                logger.error(f'❌ 解析对话输出时出错: {str(e)}')
             
-            for output in outputs:
-                # 更新文件位置
-                if 'new_position' in output:
-                    monitor_positions[instance_id] = output['new_position']
-                
-                if output.get('is_streaming', False):
-                    # 流式输出 - 实时推送每个片段
-                    logger.info(f'📤 发送流式输出: {instance_id} - {output["content"][:30]}...')
-                    
-                    try:
-                        # 对内容进行清理
-                        raw_content = output['content']
-                        cleaned_content = content_filter.clean_content(raw_content)
-                        
-                        if socketio:  # 检查socketio是否可用
-                            socketio.emit('instance_streaming_response', {
-                                'instance_id': instance_id,
-                                'content': cleaned_content,  # 清理后的内容
-                                'raw_content': raw_content,  # 原始内容
-                                'timestamp': output['timestamp'],
-                                'is_streaming': True
-                            }, room=f'instance_{instance_id}')
-                            logger.info(f'✅ 流式输出已发送到房间: instance_{instance_id} (清理后: {len(cleaned_content)}字符)')
-                        else:
-                            logger.warning('⚠️  socketio 不可用，跳过流式输出推送')
-                    except Exception as e:
-                        logger.error(f'❌ 发送流式输出时出错: {str(e)}')
-                    
-                elif output.get('is_complete', False):
-                    # 完整回复完成
-                    logger.info(f'🎯 完整回复完成: {instance_id} - {len(output["content"])} 字符')
+            if output.get('is_streaming', False):
+                # 流式输出 - 清理一次后交给分发中心推送给每个订阅者
+                try:
+                    # 对内容进行清理
+                    raw_content = output['content']
+                    cleaned_content = content_filter.clean_content(raw_content)
                     
-                    try:
-                        # 使用新的对话解析功能
-                        raw_content = output.get('raw_content', output['content'])
-                        
-                        # 解析对话内容，区分发言者
-                        conversations = content_filter.parse_conversation(raw_content)
-                        
-                        logger.info(f'📝 对话解析完成: 解析出 {len(conversations)} 条消息')
-                        
-                        # 处理每条对话消息
-                        for conv in conversations:
-                            # 为每条消息添加实例信息
-                            conv['instance_id'] = instance_id
-                            conv['timestamp'] = conv.get('timestamp', output['timestamp'])
-                            
-                            # 根据消息类型进行不同处理
-                            if conv['type'] == 'user':
-                                # 用户消息
-                                chat_manager.add_chat_message(
-                                    sender=f'用户@{instance_id}',
-                                    message=conv['content'],
-                                    instance_id=instance_id,
-                                    message_type='user'
-                                )
-                                
-                                # 发送用户消息事件
-                                if socketio:
-                                    socketio.emit('user_message', {
-                                        'instance_id': instance_id,
-                                        'content': conv['content'],
-                                        'timestamp': conv['timestamp'],
-                                        'needs_rich_text': conv.get('needs_rich_text', False)
-                                    }, room=f'instance_{instance_id}')
-                                    
-                            elif conv['type'] == 'assistant':
-                                # AI助手消息
-                                formatted_content = content_filter.format_for_display(conv['content'])
-                                
-                                chat_manager.add_chat_message(
-                                    sender=f'AI助手@{instance_id}',
-                                    message=formatted_content,
-                                    instance_id=instance_id,
-                                    message_type='assistant'
-                                )
-                                
-                                # 发送AI消息事件
-                                if socketio:
-                                    socketio.emit('assistant_message', {
-                                        'instance_id': instance_id,
-                                        'content': formatted_content,
-                                        'raw_content': conv['content'],
-                                        'timestamp': conv['timestamp'],
-                                        'needs_rich_text': conv.get('needs_rich_text', True),
-                                        'is_markdown': True
-                                    }, room=f'instance_{instance_id}')
-                                    
-                            elif conv['type'] == 'system':
-                                # 系统消息
-                                chat_manager.add_chat_message(
-                                    sender=f'系统@{instance_id}',
-                                    message=conv['content'],
-                                    instance_id=instance_id,
-                                    message_type='system'
-                                )
-                                
-                                # 发送系统消息事件
-                                if socketio:
-                                    socketio.emit('system_message', {
-                                        'instance_id': instance_id,
-                                        'content': conv['content'],
-                                        'timestamp': conv['timestamp'],
-                                        'needs_rich_text': False
-                                    }, room=f'instance_{instance_id}')
-                        
-                        # 发送完整对话解析完成事件
-                        if socketio:
-                            socketio.emit('conversation_parsed', {
-                                'instance_id': instance_id,
-                                'conversations': conversations,
-                                'total_messages': len(conversations),
-                                'timestamp': output['timestamp']
-                            }, room=f'instance_{instance_id}')
-                            
-                        logger.info(f'✅ 对话消息已全部处理完成: {instance_id}')
-                        
-                    except Exception as e:
-                        logger.error(f'❌ 处理对话解析时出错: {str(e)}')
-                        # 降级处理：使用原有的简单处理方式
-                        raw_content = output.get('raw_content', output['content'])
-                        cleaned_content = content_filter.clean_content(raw_content)
-                        formatted_content = content_filter.format_for_display(cleaned_content)
-                        
-                        chat_manager.add_chat_message(
-                            sender=f'实例{instance_id}',
-                            message=formatted_content,
-                            instance_id=instance_id
-                        )
-                        
-                        if socketio:
-                            socketio.emit('instance_complete_response', {
-                                'instance_id': instance_id,
-                                'content': formatted_content,
-                                'timestamp': output['timestamp'],
-                                'is_fallback': True
-                            }, room=f'instance_{instance_id}')
-            
-            time.sleep(0.2)  # 更频繁的检查以支持流式输出
-            
-        except Exception as e:
-            logger.error(f'❌ 监控tmux实例 {instance_id} 输出时出错: {str(e)}')
-            time.sleep(1)
-    
-    # 清理监控状态
-    if instance_id in monitor_positions:
-        del monitor_positions[instance_id]
+                    items.append({
+                        'instance_id': instance_id,
+                        'content': cleaned_content,  # 清理后的内容
+                        'raw_content': raw_content,  # 原始内容
+                        'timestamp': output['timestamp'],
+                        'offset': output.get('offset'),  # 行起始字节偏移
+                        'is_streaming': True
+                    })
+                except Exception as e:
+                    logger.error(f'❌ 处理流式输出时出错: {str(e)}')
+        
+    except Exception as e:
+        logger.error(f'❌ 处理tmux实例 {instance_id} 输出时出错: {str(e)}')
     
-    logger.info(f'🛑 tmux实例 {instance_id} 监控线程已停止')
+    return items
+
+def emit_conversation_event(event, data, room):
+    """推送流式对话事件，解析完成的消息同时保存到聊天记录"""
+    socketio.emit(event, data, to=room)
+    if event != 'message_completed' or data['discarded']:
+        return
+    senders = {'user': '用户', 'assistant': 'AI助手', 'system': '系统'}
+    instance_id = data['instance_id']
+    message = data['content']
+    if data['type'] == 'assistant':
+        message = content_filter.format_for_display(message)
+    chat_manager.add_chat_message(
+        sender=f'{senders[data["type"]]}@{instance_id}',
+        message=message,
+        instance_id=instance_id,
+        message_type=data['type']
+    )
+
+def deliver_instance_outputs(sid, items, dropped):
+    """把流式输出条目推送给单个订阅者"""
+    for item in items:
+        socketio.emit('instance_streaming_response', {**item, 'dropped': dropped}, to=sid)
+
+output_hub.set_processor(process_instance_outputs)
+# 输出读取者停止时结束实例当前的对话消息
+output_hub.set_stop_handler(conversation_streams.flush)
+
+def emit_message_delivery(event, data, room):
+    """推送发送队列的投递状态和广播结果（发起方socket或实例房间）"""
+    socketio.emit(event, data, to=room)
+
+send_queue.set_emitter(emit_message_delivery)
+broadcast_engine.set_emitter(emit_message_delivery)
+
+status_stream.set_emitter(lambda event, data, room: socketio.emit(event, data, to=room))
+
+conversation_streams.set_emitter(emit_conversation_event)
+
+@socketio.on('subscribe_instance_status')
+def handle_subscribe_instance_status(data=None):
+    """订阅namespace的实例忙碌/空闲状态（namespace为空表示全部），立即返回精简快照，之后推送 instance_status_changed"""
+    namespace = ((data or {}).get('namespace') or '').strip() or None
+    join_room(status_room(namespace))
+    snapshot = status_stream.snapshot(namespace)
+    emit('instance_status_snapshot', snapshot)
+    return {'success': True, 'count': len(snapshot['instances'])}
+
+@socketio.on('unsubscribe_instance_status')
+def handle_unsubscribe_instance_status(data=None):
+    """取消订阅namespace的实例状态"""
+    namespace = ((data or {}).get('namespace') or '').strip() or None
+    leave_room(status_room(namespace))
+    return {'success': True}
 
 @socketio.on('send_message')
 def handle_send_message(data):
-    """通过WebSocket发送消息"""
+    """通过WebSocket发送消息（加入发送队列，确认中返回各实例的消息ID，投递结果通过 message_delivery 事件推送）"""
     try:
         instance_ids = data.get('instance_ids', [])
         message = data.get('message', '')
@@ -275,27 +197,16 @@ def handle_send_message(data):
             emit('error', {'message': '缺少必要参数'})
             return
         
-        success_count = 0
-        errors = []
-        
-        for instance_id in instance_ids:
-            result = instance_manager.send_message(instance_id, message)
-            if result['success']:
-                success_count += 1
-            else:
-                errors.append(f'tmux实例{instance_id}: {result["error"]}')
-        
-        if errors:
-            emit('message_result', {
-                'success': False,
-                'message': f'成功发送到 {success_count} 个tmux实例，失败: {len(errors)}',
-                'errors': errors
-            })
-        else:
-            emit('message_result', {
-                'success': True,
-                'message': f'成功发送到 {success_count} 个tmux实例'
-            })
+        message_ids = {instance_id: send_queue.submit(instance_id, message, owner=request.sid)
+                       for instance_id in instance_ids}
+        result = {
+            'success': True,
+            'queued': True,
+            'message_ids': message_ids,
+            'message': f'已加入发送队列: {len(message_ids)} 个tmux实例'
+        }
+        emit('message_result', result)
+        return result
             
     except Exception as e:
         logger.error(f'WebSocket发送消息失败: {str(e)}')
@@ -311,6 +222,39 @@ def handle_get_instances():
         logger.error(f'获取tmux实例列表失败: {str(e)}')
         emit('error', {'message': f'获取tmux实例列表失败: {str(e)}'})
 
+@socketio.on('search_logs')
+def handle_search_logs(data):
+    """跨实例搜索日志，结果通过 log_search_started / log_search_results / log_search_completed 事件推送"""
+    data = data or {}
+    query = data.get('query', '')
+    if not query:
+        emit('log_search_error', {'error': '缺少搜索内容'})
+        return
+    
+    sid = request.sid
+    
+    def emit_to_client(event, payload):
+        socketio.emit(event, payload, to=sid)
+    
+    try:
+        search_id = fleet_search.start(
+            query, emit_to_client, owner=sid,
+            regex=bool(data.get('regex', False)),
+            namespace=data.get('namespace') or None,
+            max_results=data.get('max_results')
+        )
+        logger.info(f'跨实例搜索已开始: {search_id} ({query})')
+        return {'search_id': search_id}
+    except re.error as e:
+        emit('log_search_error', {'error': f'正则表达式无效: {str(e)}'})
+
+@socketio.on('cancel_log_search')
+def handle_cancel_log_search(data):
+    """取消跨实例搜索"""
+    search_id = (data or {}).get('search_id')
+    if search_id and fleet_search.cancel(search_id):
+        logger.info(f'跨实例搜索已取消: {search_id}')
+
 # Web终端相关WebSocket事件
 @socketio.on('join_terminal')
 def handle_join_terminal(data):
@@ -332,9 +276,8 @@ def handle_join_terminal(data):
         join_room(f'terminal_{instance_id}')
         
         # 检查tmux会话是否存在
-        result = subprocess.run(['tmux', 'list-sessions'], capture_output=True, text=True)
-        if result.returncode != 0 or session_name not in result.stdout:
-            logger.error(f'tmux会话 {session_name} 不存在。当前会话: {result.stdout}')
+        if not tmux_session_exists(session_name):
+            logger.error(f'tmux会话 {session_name} 不存在')
             emit('terminal_error', {
                 'instance_id': instance_id,
                 'error': f'tmux会话 {session_name} 不存在'
@@ -556,6 +499,10 @@ def handle_disconnect():
     """客户端断开连接时清理Web终端"""
     logger.info('客户端已断开连接，清理Web终端资源')
     
+    # 清理该客户端的实例输出订阅
+    output_hub.unsubscribe_all(request.sid)
+    fleet_search.cancel_owner(request.sid)
+    
     try:
         from app.services.web_terminal import web_terminal_manager
         # 注意：这里不能清理所有终端，因为可能有多个客户端
@@ -12,14 +12,82 @@ class Config:
     Q_CLI_COMMAND = 'q'
     Q_CLI_TIMEOUT = 30
     MAX_INSTANCES = 10
-    
+
+    # Instance registry settings
+    INSTANCE_REGISTRY_INTERVAL = 5  # 定时全量同步间隔（秒）
+    INSTANCE_REGISTRY_WATCH_INTERVAL = 1  # 目录变化检测间隔（秒）
+    INSTANCE_DETAIL_WORKERS = 8  # 并发获取实例详细信息的最大线程数
+    INSTANCE_DETAIL_CACHE_TTL = 30  # 实例详细信息缓存的最长有效期（秒）
+
     # Chat settings
     MAX_CHAT_HISTORY = 100
+    CHAT_NAMESPACE_CACHE_SIZE = 8  # 缓存已解析聊天历史的namespace数
+    CHAT_LONG_POLL_MAX_WAIT = 30  # 聊天历史长轮询最长等待秒数
+    CHAT_LONG_POLL_CHECK_INTERVAL = 1.0  # 长轮询期间重新检查namespace缓存文件的间隔（秒）
     MAX_SYSTEM_LOGS = 50
     
     # WebSocket settings
     SOCKETIO_ASYNC_MODE = 'threading'
     
+    # Log watcher settings
+    LOG_WATCH_POLL_INTERVAL = 0.5  # 无inotify时的stat轮询间隔（秒）
+    LOG_WATCH_RETRY_INTERVAL = 2  # 日志目录尚未创建时的重试间隔（秒）
+    STATUS_WATCH_POLL_INTERVAL = 1.0  # 无inotify时扫描状态目录的间隔（秒）
+    LOG_READ_MAX_BYTES = 256 * 1024  # 每次增量读取的最大字节数
+    LOG_MAX_LINE_BYTES = 64 * 1024  # 未完成行超过该长度时先行输出
+    LOG_IDENTITY_BYTES = 4096  # 计算日志文件标识时最多读取的首行字节数
+    LOG_INDEX_STRIDE = 1000  # 行索引每隔多少行记录一个字节偏移
+    LOG_INDEX_SYNC_BYTES = 64 * 1024 * 1024  # 未建立索引的内容超过该大小时在后台建立索引，请求中返回 indexing
+    LOG_SEARCH_BLOCK_BYTES = 256 * 1024  # 搜索索引每个块的大小
+    LOG_SEARCH_CACHED_QUERIES = 32  # 每个日志缓存匹配计数的查询数
+    LOG_SEARCH_MAX_INDEX_BYTES = 256 * 1024 * 1024  # 所有日志搜索索引的内存上限，超过时淘汰最久未使用的索引
+    LOG_SEARCH_SCAN_BYTES = 4 * 1024 * 1024  # 无索引顺序扫描时每次读取的字节数
+    
+    # Fleet search settings
+    FLEET_SEARCH_WORKERS = 4  # 跨实例搜索的扫描进程数
+    FLEET_SEARCH_MAX_RESULTS = 500  # 单次跨实例搜索返回的最大结果数
+    FLEET_SEARCH_PER_LOG_RESULTS = 50  # 每个日志最多返回的结果数
+    
+    # Conversation store settings
+    CONVERSATION_SEGMENT_BYTES = 4 * 1024 * 1024  # 单个对话记录分段的最大字节数
+    CONVERSATION_COMPACT_BYTES = 32 * 1024 * 1024  # 已封存分段合并后的最大字节数（减少读取时打开的分段数）
+    CONVERSATION_FSYNC_INTERVAL = 0.5  # 批量fsync的间隔（秒）
+    CONVERSATION_PAGE_SIZE = 1000  # 对话历史接口默认返回的条数
+    CONVERSATION_READ_BLOCK_BYTES = 64 * 1024  # 反向读取分段时每次读取的字节数
+    
+    # Conversation database settings
+    CONVERSATION_DB_PATH = None  # 为空时使用 <cliExtra工作目录>/conversations.db
+    CONVERSATION_DB_BATCH_SIZE = 500  # 写线程单个事务最多插入的消息数
+    CONVERSATION_DB_FLUSH_INTERVAL = 0.2  # 写线程攒批的最长等待时间（秒）
+    
+    # Utilization settings
+    UTILIZATION_PATH = None  # 为空时使用 <cliExtra工作目录>/utilization.json
+    UTILIZATION_SAVE_INTERVAL = 60  # 利用率数据写入文件的间隔（秒）
+    
+    # Send queue settings
+    SEND_QUEUE_WORKERS = 8  # 并发投递消息的实例数上限
+    SEND_MAX_ATTEMPTS = 3  # 失败（非超时）的消息最多尝试投递次数
+    SEND_RETRY_DELAY = 2  # 重试间隔（秒），按已尝试次数递增
+    SEND_HISTORY_SIZE = 1000  # 保留投递状态的最近消息数
+    SEND_DEAD_LETTER_SIZE = 200  # 死信列表最大条数
+    
+    # Broadcast settings
+    BROADCAST_TIMEOUT = 30  # 同步广播等待全部实例完成的最长时间（秒）
+    BROADCAST_HISTORY_SIZE = 100  # 保留进度的最近广播数
+    
+    # Tmux control settings
+    TMUX_CONTROL_CLIENTS = 2  # 常驻 tmux -C 控制连接数
+    TMUX_CONTROL_SESSION = 'cliextra_web_control'  # 控制连接附加的专用会话
+    TMUX_COMMAND_TIMEOUT = 5  # 单个tmux命令的超时时间（秒）
+    TMUX_DIRECT_SEND = True  # 消息直接通过tmux写入实例会话，失败时才使用 qq send
+    TMUX_SEND_KEYS_MAX_CHARS = 1024  # 不超过该长度的单行消息用 send-keys 发送，否则通过粘贴缓冲区
+    
+    # Output hub settings
+    OUTPUT_HUB_QUEUE_SIZE = 200  # 每个订阅者待发送队列的最大条目数
+    OUTPUT_HUB_BACKLOG = 100  # 新订阅者补发的最近条目数
+    OUTPUT_HUB_MAX_COALESCE_CHARS = 65536  # 积压时单个合并条目的最大字符数
+    OUTPUT_HUB_SENDERS = 4  # 发送线程数
+    
     # Logging
     LOG_LEVEL = 'INFO'
     LOG_FILE = 'logs/app.log'
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ANSI/VT序列去除：ECMA-48各类序列、bytes快速路径，以及在数MB tmux日志上与原实现的耗时对比
+"""
+
+import os
+import re
+import sys
+import time
+import random
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ansi_stripper import strip_ansi, strip_ansi_bytes
+from app.services.content_filter import ContentFilter
+
+def legacy_remove_ansi(text):
+    """原 ContentFilter._remove_ansi_sequences 的实现（对照组）"""
+    ansi_pattern = re.compile(r'\x1b\[[0-9;]*[mK]')
+    text = ansi_pattern.sub('', text)
+    control_pattern = re.compile(r'\x1b\[[?]?\d*[hl]')
+    text = control_pattern.sub('', text)
+    return text
+
+SEQUENCES = [
+    '\x1b[0m', '\x1b[1;32m', '\x1b[38;5;208m', '\x1b[2K', '\x1b[1G', '\x1b[3A', '\x1b[12;40H',
+    '\x1b[?25l', '\x1b[?25h', '\x1b[?2004h', '\x1b]0;q chat\x07', '\x1b]8;;https://example.com\x1b\\',
+    '\x1bP1$r0m\x1b\\', '\x1b(B', '\x1b7', '\x1b8', '\x1b=', '\r'
+]
+WORDS = ['部署', 'build', '完成', 'error', 'thinking', '测试', 'tmux', 'response', '>', '!>']
+
+def make_log(target_bytes, density=0.35):
+    """生成类似 tmux 日志的内容：普通文本中夹杂颜色、光标移动、OSC、DCS 等序列（density为每个词前插入序列的概率）"""
+    rnd = random.Random(7)
+    lines = []
+    size = 0
+    while size < target_bytes:
+        parts = []
+        for _ in range(rnd.randint(3, 12)):
+            if rnd.random() < density:
+                parts.append(rnd.choice(SEQUENCES))
+            parts.append(rnd.choice(WORDS) + ' ')
+        line = ''.join(parts)
+        lines.append(line)
+        size += len(line.encode('utf-8')) + 1
+    return '\n'.join(lines)
+
+def test_sequences():
+    """各类序列的去除结果"""
+    cases = {
+        '\x1b[31mred\x1b[0m': 'red',
+        '\x1b[2K\x1b[1G> prompt': '> prompt',
+        '\x1b[?25lhidden\x1b[?25h': 'hidden',
+        '\x1b]0;title\x07text': 'text',
+        '\x1b]8;;http://x\x1b\\link\x1b]8;;\x1b\\': 'link',
+        '\x1bP1$r0m\x1b\\after': 'after',
+        '\x9b1;2Hcsi8': 'csi8',
+        '\x1b(B\x1b7saved\x1b8': 'saved',
+        'a\rb\x08c\td': 'abc\td',
+        '中文\x1b[1;32m测试\x1b[m': '中文测试',
+        'tail\x1b': 'tail',
+        '\x1b]unterminated\nnext line': '\nnext line',
+    }
+    for raw, expected in cases.items():
+        assert strip_ansi(raw) == expected, (raw, strip_ansi(raw))
+        if '\x9b' not in raw:
+            assert strip_ansi_bytes(raw.encode('utf-8')).decode('utf-8') == expected, raw
+    # bytes快速路径：不含ESC时只删除控制字节，UTF-8多字节字符不受影响
+    assert strip_ansi_bytes('忙碌\r\n空闲\x07'.encode('utf-8')) == '忙碌\n空闲'.encode('utf-8')
+
+def test_ansi_stripper_benchmark():
+    """在数MB日志上对比原实现与新实现（序列密集的界面刷新输出和以文本为主的普通输出）"""
+    print("🧪 测试ANSI序列去除性能")
+    for density in (0.35, 0.03):
+        benchmark(make_log(4 * 1024 * 1024, density))
+    print("✅ ANSI序列去除工作正常")
+
+def benchmark(log):
+    data = log.encode('utf-8')
+    lines = log.split('\n')
+    print(f"📋 日志 {len(data) / 1024 / 1024:.1f}MB，{len(lines)} 行，{log.count(chr(27))} 个ESC")
+
+    started = time.time()
+    legacy = [legacy_remove_ansi(line) for line in lines]
+    legacy_time = time.time() - started
+
+    started = time.time()
+    per_line = [strip_ansi(line) for line in lines]
+    per_line_time = time.time() - started
+
+    started = time.time()
+    whole = strip_ansi(log)
+    whole_time = time.time() - started
+
+    started = time.time()
+    raw = strip_ansi_bytes(data)
+    bytes_time = time.time() - started
+
+    print(f"⏱️  原实现（逐行，每次编译两个正则）: {legacy_time * 1000:.0f}ms，残留ESC {sum(l.count(chr(27)) for l in legacy)} 个")
+    print(f"⏱️  新实现逐行: {per_line_time * 1000:.0f}ms")
+    print(f"⏱️  新实现整段: {whole_time * 1000:.0f}ms")
+    print(f"⏱️  新实现bytes: {bytes_time * 1000:.0f}ms")
+
+    assert '\x1b' not in whole and '\r' not in whole
+    assert whole.split('\n') == per_line
+    assert raw.decode('utf-8') == whole
+    assert whole_time < legacy_time
+
+    started = time.time()
+    ContentFilter().clean_content(log)
+    print(f"⏱️  ContentFilter.clean_content: {(time.time() - started) * 1000:.0f}ms")
+
+if __name__ == '__main__':
+    test_sequences()
+    test_ansi_stripper_benchmark()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试并行广播：按namespace/角色解析目标、并发投递、逐实例结果推送、部分失败汇总
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.send_queue import SendQueue
+from app.services.broadcast_engine import BroadcastEngine
+
+class FakeRegistry:
+    """模拟实例注册表：两个namespace共100个实例，其中一个已停止"""
+
+    def __init__(self):
+        self.instances = [
+            {'id': f'inst{i:03d}', 'namespace': 'frontend' if i % 2 else 'backend',
+             'role': 'reviewer' if i % 10 == 0 else 'dev',
+             'status': 'Not Running' if i == 99 else 'running'}
+            for i in range(100)
+        ]
+
+    def get_instances(self, namespace=None):
+        return [inst for inst in self.instances if not namespace or inst['namespace'] == namespace]
+
+class FakeManager:
+    """模拟发送：每条耗时delay秒，broken中的实例发送失败"""
+
+    def __init__(self, delay=0.1, broken=()):
+        self.delay = delay
+        self.broken = set(broken)
+        self.delivered = []
+        self.lock = threading.Lock()
+
+    def send_message(self, instance_id, message):
+        time.sleep(self.delay)
+        if instance_id in self.broken:
+            return {'success': False, 'error': f'实例 {instance_id} 不存在'}
+        with self.lock:
+            self.delivered.append(instance_id)
+        return {'success': True}
+
+def test_broadcast_engine():
+    """测试并行广播"""
+    print("🧪 测试并行广播")
+
+    manager = FakeManager(broken={'inst003', 'inst007'})
+    engine = BroadcastEngine(queue=SendQueue(manager=manager, workers=50, retry_delay=0.01),
+                             registry=FakeRegistry())
+    events = []
+    engine.set_emitter(lambda event, data, owner: events.append((event, data, owner)))
+
+    # 目标解析
+    assert len(engine.resolve_targets()) == 99
+    assert len(engine.resolve_targets('backend')) == 50
+    assert engine.resolve_targets('backend', role='reviewer') == [f'inst{i:03d}' for i in range(0, 100, 10)]
+    assert engine.resolve_targets(broadcast_all=False) == []
+
+    # 99个实例，每个耗时0.1秒，50个并发时总耗时约0.2秒而不是9.9秒
+    started = time.time()
+    summary = engine.broadcast('部署开始', owner='sid1')
+    elapsed = time.time() - started
+    print(f"📋 广播到 {summary['total']} 个实例耗时 {elapsed * 1000:.0f}ms")
+    assert summary['finished'] and elapsed < 1.0
+    assert summary['total'] == 99 and summary['sent_count'] == 97 and summary['failed_count'] == 2
+    assert sorted(item['instance_id'] for item in summary['failed']) == ['inst003', 'inst007']
+    assert summary['max_latency'] >= 0.1
+
+    results = [data for event, data, owner in events if event == 'broadcast_result']
+    assert len(results) == 99 and all(owner == 'sid1' for _, _, owner in events)
+    assert all(r['latency'] >= 0.1 for r in results)
+    assert events[-1][0] == 'broadcast_complete' and events[-1][1]['sent_count'] == 97
+
+    status = engine.get(summary['broadcast_id'])
+    assert len(status['results']) == 99 and status['finished']
+
+    # 异步开始立即返回
+    events.clear()
+    started = time.time()
+    result = engine.start('仅review', namespace='backend', role='reviewer')
+    assert time.time() - started < 0.05 and len(result['targets']) == 10
+    assert not engine.get(result['broadcast_id'])['finished']
+    deadline = time.time() + 5
+    while not engine.get(result['broadcast_id'])['finished'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert engine.get(result['broadcast_id'])['sent_count'] == 10
+    # 发起方未知时结果只推送到实例房间，不推送汇总
+    assert sorted(room for _, _, room in events) == [f'instance_inst{i:03d}' for i in range(0, 100, 10)]
+
+    # 没有目标时立即完成
+    empty = engine.broadcast('hello', namespace='nobody')
+    assert empty['finished'] and empty['total'] == 0
+    print("✅ 并行广播工作正常")
+
+if __name__ == '__main__':
+    test_broadcast_engine()
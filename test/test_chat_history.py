@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试聊天记录环形缓冲区：O(1)去重、容量淘汰、按ID顺序切取尾部和二分查找游标、大缓存文件加载耗时；
+以及按namespace缓存的聊天历史：切换namespace不重新解析、缓存文件追加时增量解析；
+按消息ID游标增量读取、向前翻页和长轮询，重新加载后消息ID不变，消息按自身的namespace归档
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.instance import ChatMessage
+from app.services.chat_manager import ChatHistoryBuffer, ChatManager
+
+BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+def _msg(text, seconds, instance_id='a'):
+    return ChatMessage(sender=instance_id, message=text, timestamp=BASE_TIME + timedelta(seconds=seconds),
+                       instance_id=instance_id)
+
+def test_ring_buffer():
+    """测试环形缓冲区去重和淘汰"""
+    print("🧪 测试聊天记录环形缓冲区")
+
+    buffer = ChatHistoryBuffer(3)
+    buffer.append(_msg('hello', 10.2))
+    assert buffer.is_duplicate(_msg('hello', 10.9))
+    assert buffer.is_duplicate(_msg('hello', 9.5))
+    assert not buffer.is_duplicate(_msg('hello', 11.3))
+    assert not buffer.is_duplicate(_msg('hello', 10.2, instance_id='b'))
+
+    for i in range(4):
+        buffer.append(_msg(f'm{i}', 20 + i))
+    assert [m.message for m in buffer.tail()] == ['m1', 'm2', 'm3']
+    # 被淘汰的消息同时从索引中移除
+    assert not buffer.is_duplicate(_msg('hello', 10.2))
+
+    # 记录按ID（加入）顺序保存，与游标顺序一致
+    buffer.append(_msg('late', 22.5))
+    assert [m.message for m in buffer.tail()] == ['m2', 'm3', 'late']
+    assert [m.message for m in buffer.tail(2)] == ['m3', 'late']
+    print("✅ 环形缓冲区工作正常")
+
+def test_cursor_bisect():
+    """测试按ID游标二分查找（含沿用较小ID的乱序加入）"""
+    print("🧪 测试按ID游标读取")
+
+    buffer = ChatHistoryBuffer(50)
+    ids = list(range(2, 160, 3))
+    ids[30], ids[31] = ids[31], ids[30]
+    for i, message_id in enumerate(ids):
+        msg = _msg(f'm{message_id}', i)
+        msg.id = message_id
+        buffer.append(msg)
+    kept = sorted(ids)[-50:]
+    for cursor in range(0, 165):
+        for limit in (None, 1, 7):
+            newer = [i for i in kept if i > cursor]
+            older = [i for i in kept if i < cursor]
+            messages, has_more = buffer.after(cursor, limit)
+            assert [m.id for m in messages] == newer[:limit] and has_more == (limit is not None and len(newer) > limit)
+            messages, has_more = buffer.before(cursor, limit)
+            assert [m.id for m in messages] == (older[-limit:] if limit else older)
+            assert has_more == (limit is not None and len(older) > limit)
+    print("✅ 按ID游标读取正确")
+
+def test_load_large_namespace_cache():
+    """测试加载2万条消息的namespace缓存"""
+    print("🧪 测试加载大型namespace缓存")
+
+    home = tempfile.mkdtemp(prefix='chat_history_')
+    old_home = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    try:
+        cache_dir = os.path.join(home, 'Library', 'Application Support', 'cliExtra', 'namespaces', 'big')
+        os.makedirs(cache_dir)
+        history = []
+        for i in range(20000):
+            timestamp = (BASE_TIME + timedelta(seconds=i)).isoformat().replace('+00:00', 'Z')
+            history.append({'instance_id': f'inst{i % 5}', 'message': f'消息 {i}', 'timestamp': timestamp})
+        # 重复消息
+        history.extend(history[-50:])
+        with open(os.path.join(cache_dir, 'namespace_cache.json'), 'w') as f:
+            json.dump({'message_history': history}, f)
+
+        manager = ChatManager()
+        manager.config.MAX_CHAT_HISTORY = 20000
+        started = time.time()
+        manager.load_namespace_cache_history('big')
+        print(f"⏱️  加载耗时: {(time.time() - started) * 1000:.1f}ms")
+        assert len(manager.get_chat_history(namespace='big')) == 20000
+
+        recent = manager.get_chat_history(limit=3, namespace='big')
+        assert [m['message'] for m in recent] == ['消息 19997', '消息 19998', '消息 19999']
+        print("✅ 大型缓存加载正常")
+    finally:
+        if old_home is not None:
+            os.environ['HOME'] = old_home
+        shutil.rmtree(home, ignore_errors=True)
+
+def _write_cache(home, namespace, entries):
+    cache_dir = os.path.join(home, 'Library', 'Application Support', 'cliExtra', 'namespaces', namespace)
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, 'namespace_cache.json'), 'w') as f:
+        json.dump({'message_history': entries}, f)
+
+def _entry(namespace, i):
+    timestamp = (BASE_TIME + timedelta(seconds=i)).isoformat()
+    return {'instance_id': f'{namespace}_inst', 'message': f'{namespace} {i}', 'timestamp': timestamp}
+
+def test_namespace_cache_switching():
+    """测试多个namespace交替读取和缓存文件追加"""
+    print("🧪 测试按namespace缓存的聊天历史")
+
+    home = tempfile.mkdtemp(prefix='chat_namespaces_')
+    old_home = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    try:
+        _write_cache(home, 'ns_a', [_entry('ns_a', i) for i in range(5)])
+        _write_cache(home, 'ns_b', [_entry('ns_b', i) for i in range(3)])
+
+        manager = ChatManager()
+        parsed = []
+        original = manager._parse_cache_message
+        manager._parse_cache_message = lambda data: parsed.append(data) or original(data)
+
+        for _ in range(10):
+            assert len(manager.get_chat_history(namespace='ns_a')) == 5
+            assert len(manager.get_chat_history(namespace='ns_b')) == 3
+        assert len(parsed) == 8, '切换namespace不应重新解析缓存文件'
+
+        # 缓存文件追加新消息时只解析新增条目
+        time.sleep(0.01)
+        _write_cache(home, 'ns_a', [_entry('ns_a', i) for i in range(7)])
+        history = manager.get_chat_history(namespace='ns_a')
+        assert [m['message'] for m in history[-2:]] == ['ns_a 5', 'ns_a 6']
+        assert len(parsed) == 10
+
+        # 文件被改写时整体重新加载
+        _write_cache(home, 'ns_a', [_entry('ns_a', i) for i in range(100, 102)])
+        assert [m['message'] for m in manager.get_chat_history(namespace='ns_a')] == ['ns_a 100', 'ns_a 101']
+        print("✅ namespace聊天历史缓存工作正常")
+    finally:
+        if old_home is not None:
+            os.environ['HOME'] = old_home
+        shutil.rmtree(home, ignore_errors=True)
+
+def test_cursor_and_long_poll():
+    """测试since_id/before_id游标和长轮询"""
+    print("🧪 测试聊天历史游标与长轮询")
+
+    home = tempfile.mkdtemp(prefix='chat_cursor_')
+    old_home = os.environ.get('HOME')
+    os.environ['HOME'] = home
+    try:
+        _write_cache(home, 'ns_c', [_entry('ns_c', i) for i in range(10)])
+        manager = ChatManager()
+
+        page = manager.get_chat_page('ns_c', limit=3)
+        assert [m['message'] for m in page['history']] == ['ns_c 7', 'ns_c 8', 'ns_c 9'] and page['has_more']
+        latest_id = page['latest_id']
+        assert page['history'][-1]['id'] == latest_id
+
+        # 向前翻页
+        older = manager.get_chat_page('ns_c', limit=5, before_id=page['history'][0]['id'])
+        assert [m['message'] for m in older['history']] == [f'ns_c {i}' for i in range(2, 7)] and older['has_more']
+
+        # 没有新消息时不返回任何内容
+        assert manager.get_chat_page('ns_c', since_id=latest_id)['history'] == []
+
+        # 长轮询：另一个线程加入消息后立即返回
+        timer = threading.Timer(0.2, manager.add_chat_message, args=('user', '新消息'), kwargs={'namespace': 'ns_c'})
+        timer.start()
+        started = time.time()
+        delta = manager.get_chat_page('ns_c', since_id=latest_id, wait=5)
+        elapsed = time.time() - started
+        print(f"⏱️  长轮询等待: {elapsed * 1000:.0f}ms")
+        assert [m['message'] for m in delta['history']] == ['新消息'] and elapsed < 2
+        assert delta['latest_id'] > latest_id
+
+        # 超时后返回空结果
+        started = time.time()
+        assert manager.get_chat_page('ns_c', since_id=delta['latest_id'], wait=0.3)['history'] == []
+        assert time.time() - started >= 0.3
+
+        # 强制刷新、清空和改写缓存文件后，同一条消息的ID不变，长轮询不会把旧消息当作新消息
+        ids = {m['message']: m['id'] for m in manager.get_chat_page('ns_c')['history']}
+        manager.refresh_cache_history('ns_c')
+        assert manager.get_chat_page('ns_c', since_id=latest_id)['history'] == []
+        manager.clear_chat_history('ns_c')
+        reloaded = manager.get_chat_page('ns_c')['history']
+        assert all(ids[m['message']] == m['id'] for m in reloaded)
+        time.sleep(0.01)
+        _write_cache(home, 'ns_c', [_entry('ns_c', i) for i in range(1, 10)] + [_entry('ns_c', 50)])
+        delta = manager.get_chat_page('ns_c', since_id=latest_id)
+        assert [m['message'] for m in delta['history']] == ['ns_c 50']
+        assert [m['id'] for m in manager.get_chat_page('ns_c', limit=2)['history']][0] == ids['ns_c 9']
+
+        # 查看其它namespace不改变消息的归属
+        manager.get_chat_page('ns_other')
+        manager.add_chat_message('user', '默认namespace的消息')
+        manager.add_chat_message('user', 'ns_c的消息', namespace='ns_c')
+        assert manager.get_chat_page('ns_other')['history'] == []
+        assert [m['message'] for m in manager.get_chat_page('ns_c', limit=1)['history']] == ['ns_c的消息']
+        print("✅ 聊天历史游标与长轮询工作正常")
+    finally:
+        if old_home is not None:
+            os.environ['HOME'] = old_home
+        shutil.rmtree(home, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_ring_buffer()
+    test_cursor_bisect()
+    test_load_large_namespace_cache()
+    test_namespace_cache_switching()
+    test_cursor_and_long_poll()
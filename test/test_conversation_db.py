@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试对话记录数据库：批量写入、按namespace/实例/时间范围查询、全文搜索、游标翻页、查询耗时、回填去重
+"""
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.conversation_db import ConversationDatabase, TRIGGER_SCHEMA
+from app.services.conversation_store import conversation_store
+from app.services.instance_manager import instance_manager
+
+BASE = 1735689600.0  # 2025-01-01
+
+WORDS = ['部署完成', 'build failed', 'retry later', '测试通过', 'timeout waiting', 'ok']
+
+def test_conversation_db():
+    """测试对话记录数据库"""
+    print("🧪 测试对话记录数据库")
+
+    tmp_dir = tempfile.mkdtemp(prefix='conversation_db_')
+    try:
+        db = ConversationDatabase(path=os.path.join(tmp_dir, 'conversations.db'), backfill=False)
+
+        # 多个线程同时写入，由写线程批量插入
+        def writer(n):
+            for i in range(5000):
+                db.record(f'ns{n % 2}', f'inst{n}', 'user' if i % 2 else f'AI助手@inst{n}',
+                          f'{WORDS[i % len(WORDS)]} #{i}', BASE + i * 10 + n)
+
+        started = time.time()
+        threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        db.flush()
+        print(f"📋 写入20000条耗时 {(time.time() - started) * 1000:.0f}ms")
+
+        result = db.query(namespace='ns1', limit=5)
+        assert len(result['messages']) == 5 and result['has_more']
+        assert all(m['namespace'] == 'ns1' for m in result['messages'])
+        timestamps = [m['timestamp'] for m in result['messages']]
+        assert timestamps == sorted(timestamps, reverse=True)
+
+        # 游标翻页不重复、不遗漏
+        seen = []
+        cursor = None
+        while True:
+            page = db.query(instance_id='inst2', since=BASE, until=BASE + 2000, cursor=cursor, limit=7)
+            seen.extend(m['id'] for m in page['messages'])
+            if not page['has_more']:
+                break
+            cursor = page['next_cursor']
+        assert len(seen) == len(set(seen)) == 200
+
+        # 全文搜索（中文子串与英文短语）
+        hits = db.query(text='部署', instance_id='inst0', limit=10000)['messages']
+        assert len(hits) == 834 and all('部署完成' in m['message'] for m in hits)
+        assert len(db.query(text='build fail', limit=10000)['messages']) == 4 * 834
+        assert db.query(text='kubernetes')['messages'] == []
+        assert len(db.query(text='ok', sender='user', namespace='ns0', limit=10000)['messages']) == 2 * 833
+
+        started = time.time()
+        for _ in range(100):
+            db.query(namespace='ns0', since=BASE + 10000, limit=50)
+        print(f"⏱️  按namespace和时间范围查询: {(time.time() - started) * 10:.2f}ms/次")
+
+        started = time.time()
+        for _ in range(100):
+            db.query(text='timeout', namespace='ns1', limit=50)
+        print(f"⏱️  全文搜索: {(time.time() - started) * 10:.2f}ms/次")
+        print("✅ 对话记录数据库工作正常")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_backfill_dedup():
+    """测试回填与实时写入重叠时不重复，旧数据库中已有的重复记录被清理"""
+    print("🧪 测试对话记录回填去重")
+
+    tmp_dir = tempfile.mkdtemp(prefix='conversation_db_backfill_')
+    old_work_dir = instance_manager.work_dir
+    try:
+        # 旧版本数据库：没有去重索引，已有两条重复记录
+        db_path = os.path.join(tmp_dir, 'conversations.db')
+        conn = sqlite3.connect(db_path)
+        conn.execute("""
+            CREATE TABLE messages (id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, instance_id TEXT,
+                sender TEXT, message_type TEXT, source TEXT, message TEXT NOT NULL, timestamp REAL NOT NULL)
+        """)
+        ConversationDatabase._create_fts_table(conn)
+        conn.executescript(TRIGGER_SCHEMA)
+        conn.executescript("""
+            INSERT INTO messages (namespace, instance_id, sender, message, timestamp) VALUES
+                ('ns', 'old', 'user', 'hello', 1.0), ('ns', 'old', 'user', 'hello', 1.0), ('ns', 'old', 'user', 'bye', 1.0);
+        """)
+        conn.commit()
+        conn.close()
+
+        instance_manager.work_dir = tmp_dir
+        messages = [('user' if i % 2 else 'AI助手@inst', f'消息 {i}', f'2025-01-01T00:00:{i:02d}.123456')
+                    for i in range(50)]
+        for sender, message, timestamp in messages:
+            conversation_store.append('inst', 'ns', {'timestamp': timestamp, 'sender': sender, 'message': message})
+
+        # 回填在后台进行的同时，实时写入同样的消息
+        db = ConversationDatabase(path=db_path)
+        for sender, message, timestamp in messages:
+            db.record('ns', 'inst', sender, message, timestamp)
+        for _ in range(100):
+            conn = sqlite3.connect(db_path)
+            done = conn.execute('PRAGMA user_version').fetchone()[0] > 0
+            conn.close()
+            if done:
+                break
+            time.sleep(0.05)
+        assert done, '回填没有完成'
+        db.flush()
+
+        assert len(db.query(instance_id='inst', limit=1000)['messages']) == 50
+        assert sorted(m['message'] for m in db.query(instance_id='old')['messages']) == ['bye', 'hello']
+        assert len(db.query(text='消息 1', limit=1000)['messages']) == 11
+
+        # 回填完成后重新打开不再回填
+        reopened = ConversationDatabase(path=db_path)
+        reopened._ensure_initialized()
+        assert not any(t.name == 'conversation_db_backfill' for t in threading.enumerate())
+        print("✅ 回填与实时写入重叠的消息只保存一次")
+    finally:
+        instance_manager.work_dir = old_work_dir
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_conversation_db()
+    test_backfill_dedup()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试对话记录存储：追加写入、分段切换与合并、旧记录迁移、不完整行、tail/offset读取；
+namespace对话历史的k路归并与before游标
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import random
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.conversation_store import ConversationStore
+
+class FakeManager:
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+
+    def get_namespace_conversations_dir(self, namespace='default'):
+        return os.path.join(self.work_dir, 'namespaces', namespace, 'conversations')
+
+    def get_instance_conversation_path(self, instance_id, namespace='default'):
+        return os.path.join(self.get_namespace_conversations_dir(namespace), f'{instance_id}.json')
+
+def _message(i):
+    return {'timestamp': f'2025-01-01T00:00:{i:06d}', 'sender': 'user', 'message': f'消息 {i}'}
+
+def test_conversation_store():
+    """测试对话记录存储"""
+    print("🧪 测试对话记录存储")
+
+    work_dir = tempfile.mkdtemp(prefix='conversation_store_')
+    try:
+        manager = FakeManager(work_dir)
+
+        # 旧格式记录在首次访问时迁移
+        legacy_path = manager.get_instance_conversation_path('inst', 'ns')
+        os.makedirs(os.path.dirname(legacy_path))
+        with open(legacy_path, 'w') as f:
+            json.dump({'conversations': [_message(i) for i in range(5)]}, f)
+
+        store = ConversationStore(manager=manager, segment_bytes=2048, fsync_interval=0.05)
+        assert [m['message'] for m in store.read('inst', 'ns')] == [f'消息 {i}' for i in range(5)]
+        assert os.path.exists(legacy_path + '.migrated')
+
+        # 多线程追加，不再限制1000条
+        def writer(start):
+            for i in range(start, start + 300):
+                store.append('inst', 'ns', _message(i))
+
+        started = time.time()
+        threads = [threading.Thread(target=writer, args=(5 + n * 300,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"📋 并发追加1200条耗时 {(time.time() - started) * 1000:.1f}ms")
+
+        messages = store.read('inst', 'ns')
+        assert len(messages) == 1205
+        assert sorted(int(m['message'].split()[1]) for m in messages) == list(range(1205))
+        segments = store._segments(os.path.join(manager.get_namespace_conversations_dir('ns'), 'inst'))
+        print(f"📋 分段数: {len(segments)}")
+        assert len(segments) > 1
+
+        # tail + offset
+        assert store.read('inst', 'ns', limit=3) == messages[-3:]
+        assert store.read('inst', 'ns', limit=3, offset=3) == messages[-6:-3]
+
+        # 写入中断留下的半行不影响读取和后续写入
+        with open(segments[-1], 'ab') as f:
+            f.write(b'{"sender": "user", "mess')
+        fresh = ConversationStore(manager=manager, segment_bytes=2048)
+        fresh.append('inst', 'ns', _message(9999))
+        tail = fresh.read('inst', 'ns', limit=2)
+        assert tail[-1]['message'] == '消息 9999' and tail[0] == messages[-1]
+
+        # 合并已封存分段：每个分段都不小于segment_bytes，凑满compact_bytes的一组合并为一个
+        stream = fresh._get_stream('inst', 'ns')
+        before = fresh.read('inst', 'ns')
+        fresh.compact_bytes = 5 * 2048
+        fresh.compact(stream)
+        merged = fresh._segments(stream.directory)
+        print(f"📋 合并后分段数: {len(segments)} -> {len(merged)}")
+        assert len(merged) < len(segments) and merged[-1] == segments[-1]
+        assert fresh.read('inst', 'ns') == before and len(before) == 1206
+        sizes = [os.path.getsize(segment) for segment in merged[:-1]]
+        assert all(size <= fresh.compact_bytes for size in sizes)
+        # 末尾未凑满的分段留到以后合并，已合并的分段不再重写
+        fresh.compact(stream)
+        assert fresh._segments(stream.directory) == merged
+        assert [os.path.getsize(segment) for segment in merged[:-1]] == sizes
+        assert fresh.list_instances('ns') == ['inst']
+        store.flush()
+        print("✅ 对话记录存储工作正常")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_namespace_history_merge():
+    """测试namespace对话历史的堆归并读取"""
+    print("🧪 测试namespace对话历史归并")
+
+    from app.services.instance_manager import instance_manager
+    from app.services.conversation_store import conversation_store
+
+    work_dir = tempfile.mkdtemp(prefix='conversation_merge_')
+    old_work_dir, old_block = instance_manager.work_dir, conversation_store.read_block_bytes
+    instance_manager.work_dir = work_dir
+    # 使用较小的块，覆盖跨块拼接的情况
+    conversation_store.read_block_bytes = 100
+    try:
+        rng = random.Random(7)
+        everything = []
+        for n in range(20):
+            timestamps = sorted(rng.sample(range(100000), 200))
+            for t in timestamps:
+                message = {'timestamp': f'2025-01-01T{t:08d}', 'sender': f'inst{n}', 'message': f'inst{n} {t}'}
+                conversation_store.append(f'inst{n}', 'merge', message)
+                everything.append(message)
+        everything.sort(key=lambda m: m['timestamp'], reverse=True)
+
+        started = time.time()
+        recent = instance_manager.get_namespace_conversation_history('merge', 100)
+        print(f"⏱️  20个实例×200条中取最近100条: {(time.time() - started) * 1000:.1f}ms")
+        assert [m['timestamp'] for m in recent] == [m['timestamp'] for m in everything[:100]]
+
+        # before 游标翻页
+        page = instance_manager.get_namespace_conversation_history('merge', 50, before=recent[-1]['timestamp'])
+        assert [m['timestamp'] for m in page] == [m['timestamp'] for m in everything[100:150]]
+
+        assert len(instance_manager.get_namespace_conversation_history('merge', 10000)) == 4000
+        assert instance_manager.get_namespace_conversation_history('empty', 10) == []
+        print("✅ namespace对话历史归并正常")
+    finally:
+        instance_manager.work_dir = old_work_dir
+        conversation_store.read_block_bytes = old_block
+        conversation_store._streams.clear()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_conversation_store()
+    test_namespace_history_merge()
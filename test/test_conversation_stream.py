@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试流式对话解析：任意切分的字节块与整段解析结果一致、事件顺序、重放跳过、日志截断、重启后不重复推送历史、空闲时结束消息、增量解析开销
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.content_filter import content_filter
+from app.services.conversation_stream import ConversationParser, ConversationStreams
+
+LINES = [
+    '!> 请帮我写一个函数\n', '\x1b[32m>\x1b[0m \n', '> 好的，下面是代码：\n', '```python\n', 'def f(x):\n',
+    '    return x * 2\n', '```\n', '\n', 'User: hello there\n', 'Assistant: Sure, **bold** answer\n',
+    'line two of answer\n', 'Thinking...\n', 'System: 已连接 12:30:45\n', '[INFO] started ok\n', '=====\n',
+    'AI: hi\n', '回答: 这是一个中文回答\n', '继续回答\n', '\r\n', '你: 问题\n', 'Answer: 1. first\n', '2. second\n',
+    '>\n', 'plain text\n'
+]
+
+def make_transcript(count, seed=1):
+    rng = random.Random(seed)
+    return ''.join(rng.choice(LINES) for _ in range(count))
+
+def without_timestamp(conversations):
+    return [{key: value for key, value in conv.items() if key != 'timestamp'} for conv in conversations]
+
+def completed(events):
+    fields = ('type', 'content', 'raw_content', 'needs_rich_text', 'id')
+    return [{key: data[key] for key in fields}
+            for event, data in events if event == 'message_completed' and not data['discarded']]
+
+def test_chunked_feed():
+    """测试任意切分的字节块与整段解析结果一致"""
+    print("🧪 测试任意切分的字节块")
+
+    text = make_transcript(500)
+    expected = without_timestamp(content_filter.parse_conversation(text))
+    data = text.encode('utf-8')
+    rng = random.Random(7)
+
+    for _ in range(5):
+        parser = ConversationParser('demo')
+        events = []
+        pos = 0
+        while pos < len(data):
+            # 切分点可能落在多字节字符和ANSI序列中间
+            size = rng.randint(1, 40)
+            events += parser.feed(data[pos:pos + size])
+            pos += size
+        events += parser.flush()
+        assert completed(events) == expected, '分块解析结果与整段解析不一致'
+
+    print(f"✅ {len(expected)} 条消息，分块解析与整段解析一致")
+
+def test_event_sequence():
+    """测试事件顺序和内容"""
+    print("🧪 测试事件顺序")
+
+    parser = ConversationParser('demo')
+    assert parser.feed(b'!> \xe4\xbd\xa0\xe5') == []  # 未完成的行不产生事件
+    events = parser.feed('\xa5\xbd world\n'.encode('latin-1'))
+    assert [event for event, _ in events] == ['message_started']
+    assert events[0][1]['type'] == 'user' and events[0][1]['content'] == '你好 world'
+    user_id = events[0][1]['message_id']
+
+    events = parser.feed('Assistant: 第一行\n第二行\n')
+    assert [event for event, _ in events] == ['message_completed', 'message_started', 'message_delta']
+    assert events[0][1]['message_id'] == user_id and events[0][1]['content'] == '你好 world'
+    assistant_id = events[1][1]['message_id']
+    assert events[2][1] == {'instance_id': 'demo', 'message_id': assistant_id, 'type': 'assistant', 'delta': '\n第二行'}
+
+    events = parser.feed('\nThinking...\n')
+    assert [event for event, _ in events] == ['message_completed']
+    assert events[0][1]['content'] == '第一行\n第二行' and not events[0][1]['discarded']
+
+    # 被过滤的噪音消息：先推送了开始事件，结束时标记为discarded
+    events = parser.feed('AI: Thinking...\n') + parser.flush()
+    assert [event for event, _ in events] == ['message_started', 'message_completed']
+    assert events[1][1]['discarded']
+    assert parser.flush() == []
+
+    print("✅ 事件顺序正确")
+
+class FakeEntry:
+    def __init__(self, state):
+        self.state = state
+
+class FakeIndex:
+    def __init__(self):
+        self.listeners = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def start(self):
+        pass
+
+class FakeManager:
+    def __init__(self, log_dir=None):
+        self.log_dir = log_dir or tempfile.gettempdir()
+
+    def get_instance_log_path(self, instance_id):
+        return os.path.join(self.log_dir, f'{instance_id}_missing_tmux.log')
+
+def test_streams_replay():
+    """测试按实例推送事件，重新订阅时重放的内容被跳过，日志被截断或重建时从头解析"""
+    print("🧪 测试重放跳过与日志截断")
+
+    streams = ConversationStreams(index=FakeIndex(), manager=FakeManager())
+    emitted = []
+    streams.set_emitter(lambda event, data, room: emitted.append((event, data['instance_id'], room)))
+
+    lines = ['User: first question\n', 'Assistant: answer\n', 'more answer\n', '\n']
+    position = 0
+    for line in lines:
+        position += len(line.encode('utf-8'))
+        streams.feed('a1', line, end=position, log_id='1:100')
+    streams.feed('b2', 'User: other instance\n', end=21)
+    count = len(emitted)
+    assert count == 6
+    assert all(room == f'instance_{instance_id}' for _, instance_id, room in emitted)
+
+    # 读取者重建后从头重放同一文件，已解析的内容不再产生事件
+    position = 0
+    for line in lines:
+        position += len(line.encode('utf-8'))
+        assert streams.feed('a1', line, end=position, log_id='1:100') == []
+    assert len(emitted) == count
+
+    events = streams.feed('a1', 'User: next\n', end=position + 11, log_id='1:100')
+    assert [event for event, _ in events] == ['message_started']
+
+    # 日志被截断（rewound）：先结束旧日志的消息，再从头解析
+    events = streams.feed('a1', '> hello\n', end=8, log_id='1:100', rewound=True)
+    assert [event for event, _ in events] == ['message_completed', 'message_started']
+    assert events[1][1]['content'] == 'hello'
+
+    # 日志文件被重建（文件标识变化），即使新位置更大也从头解析
+    events = streams.feed('a1', 'x' * 100 + '\nUser: restarted\n', end=5000, log_id='1:200')
+    assert [event for event, _ in events] == ['message_completed', 'message_started']
+
+    # 没有文件标识时位置回退视为日志被截断
+    streams.feed('b2', 'User: long history\n', end=5000)
+    events = streams.feed('b2', '> hello\n', end=40)
+    assert [event for event, _ in events] == ['message_completed', 'message_started']
+
+    print("✅ 重放跳过，日志截断或重建后从头解析")
+
+def test_streams_flush():
+    """测试实例变为空闲和读取者停止时结束当前消息"""
+    print("🧪 测试空闲时结束消息")
+
+    index = FakeIndex()
+    streams = ConversationStreams(index=index, manager=FakeManager())
+    emitted = []
+    streams.set_emitter(lambda event, data, room: emitted.append((event, data)))
+    streams.start()
+    streams.start()
+    assert len(index.listeners) == 1
+
+    streams.feed('a1', 'Assistant: 最后一条回复\n第二行\n> partial')
+    assert [event for event, _ in emitted] == ['message_started', 'message_delta']
+
+    # busy -> idle 时结束当前消息，未完成的行保留
+    index.listeners[0]({'a1': (FakeEntry('1'), FakeEntry('0')), 'zz': (FakeEntry('1'), FakeEntry('0'))})
+    assert [event for event, _ in emitted][-1] == 'message_completed'
+    assert emitted[-1][1]['content'] == '最后一条回复\n第二行'
+    # idle -> idle 或没有当前消息时不产生事件
+    index.listeners[0]({'a1': (FakeEntry('0'), FakeEntry('0'))})
+    assert streams.flush('a1') == [] and len(emitted) == 3
+
+    streams.feed('a1', ' line\n')
+    assert emitted[-1][0] == 'message_started' and emitted[-1][1]['content'] == 'partial line'
+    assert [event for event, _ in streams.flush('a1')] == ['message_completed']
+    assert streams.flush('unknown') == []
+
+    print("✅ 空闲时结束消息")
+
+def test_streams_history():
+    """测试服务重启后重放日志中已有的历史时不推送、不保存，之后的新输出正常推送"""
+    print("🧪 测试重启后的历史重放")
+
+    log_dir = tempfile.mkdtemp(prefix='conversation_history_')
+    try:
+        manager = FakeManager(log_dir)
+        log_path = os.path.join(log_dir, 'a1_missing_tmux.log')
+        history = ['User: old question\n', 'Assistant: old answer\n', 'User: still typing\n']
+        with open(log_path, 'w', encoding='utf-8') as f:
+            f.writelines(history)
+
+        streams = ConversationStreams(index=FakeIndex(), manager=manager)
+        emitted = []
+        streams.set_emitter(lambda event, data, room: emitted.append((event, data)))
+
+        # 输出读取者从头读取日志，历史内容只重建解析状态
+        position = 0
+        for line in history:
+            position += len(line.encode('utf-8'))
+            assert streams.feed('a1', line, end=position, log_id='1:100') == []
+        assert emitted == []
+
+        # 开始于历史中的消息结束时也不推送，之后的新消息正常推送
+        events = streams.feed('a1', 'more typing\n', end=position + 12, log_id='1:100')
+        events += streams.feed('a1', 'Assistant: new answer\n', end=position + 34, log_id='1:100')
+        assert [event for event, _ in events] == ['message_started']
+        assert events[0][1]['content'] == 'new answer'
+        assert [event for event, _ in streams.flush('a1')] == ['message_completed']
+        assert [data['content'] for event, data in emitted if event == 'message_completed'] == ['new answer']
+
+        # 日志在运行期间被截断后的内容都是新输出
+        events = streams.feed('a1', 'User: after restart\n', end=20, log_id='1:200', rewound=True)
+        assert [event for event, _ in events] == ['message_started']
+        print("✅ 历史输出不重复推送和保存")
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+def test_incremental_cost():
+    """测试增量解析开销：每行只解析一次，与重复整段解析对比"""
+    print("🧪 测试增量解析开销")
+
+    lines = make_transcript(2000, seed=3).splitlines(keepends=True)
+
+    start = time.perf_counter()
+    parser = ConversationParser('demo')
+    events = []
+    for line in lines:
+        events += parser.feed(line.encode('utf-8'))
+    events += parser.flush()
+    stream_time = time.perf_counter() - start
+
+    # 原有方式：每次新输出都重新解析整个对话
+    start = time.perf_counter()
+    transcript = ''
+    for i, line in enumerate(lines):
+        transcript += line
+        if i % 20 == 0:
+            content_filter.parse_conversation(transcript)
+    full_time = (time.perf_counter() - start) * 20
+
+    print(f"⏱️ {len(lines)} 行：增量解析 {stream_time * 1000:.1f}ms，"
+          f"每行重新整段解析约 {full_time * 1000:.0f}ms")
+    assert completed(events) == without_timestamp(content_filter.parse_conversation(''.join(lines)))
+    assert stream_time * 10 < full_time
+
+    print("✅ 增量解析开销与新增内容成正比")
+
+if __name__ == '__main__':
+    test_chunked_feed()
+    test_event_sequence()
+    test_streams_replay()
+    test_streams_flush()
+    test_streams_history()
+    test_incremental_cost()
+    print("\n🎉 所有测试通过")
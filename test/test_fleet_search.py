@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试跨实例日志搜索：多namespace、已索引与进程池扫描混合、全局上限、取消
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.fleet_search import FleetSearch
+from app.services.log_search import get_search_index
+
+class FakeManager:
+    def __init__(self, work_dir):
+        self.work_dir = work_dir
+
+def _make_fleet(work_dir, namespaces=3, instances=4, lines=2000):
+    for n in range(namespaces):
+        for i in range(instances):
+            instance_dir = os.path.join(work_dir, 'namespaces', f'ns{n}', 'instances', f'inst{n}_{i}')
+            os.makedirs(instance_dir)
+            with open(os.path.join(instance_dir, 'tmux.log'), 'w') as f:
+                for line in range(lines):
+                    marker = 'ERROR disk full' if line % 500 == i else 'ok'
+                    f.write(f'\x1b[31m{line}\x1b[0m {marker}\n')
+
+def _run_search(fleet, **kwargs):
+    events = []
+    finished = threading.Event()
+
+    def emit(event, data):
+        events.append((event, data))
+        if event == 'log_search_completed':
+            finished.set()
+
+    search_id = fleet.start(emit=emit, **kwargs)
+    return search_id, events, finished
+
+def test_fleet_search():
+    """测试跨实例搜索"""
+    print("🧪 测试跨实例日志搜索")
+
+    work_dir = tempfile.mkdtemp(prefix='fleet_search_')
+    fleet = FleetSearch(manager=FakeManager(work_dir), workers=2)
+    try:
+        _make_fleet(work_dir)
+        assert len(fleet.list_logs()) == 12 and len(fleet.list_logs('ns1')) == 4
+
+        # 其中一个日志已建立索引，走索引搜索
+        indexed = fleet.list_logs('ns0')[0]['log_path']
+        get_search_index(indexed).update()
+
+        started = time.time()
+        _, events, finished = _run_search(fleet, query='error DISK')
+        assert finished.wait(60)
+        summary = events[-1][1]
+        batches = [data for event, data in events if event == 'log_search_results']
+        print(f"📋 {summary['searched']}/{summary['targets']} 个日志，{summary['total_matches']} 行匹配，"
+              f"耗时 {time.time() - started:.2f}s")
+        assert summary['total_matches'] == 48 and summary['returned'] == 48
+        assert len(batches) == 12 and not summary['failed']
+        assert all(hit['content'].endswith('ERROR disk full') for b in batches for hit in b['results'])
+
+        # 单个namespace + 全局上限
+        _, events, finished = _run_search(fleet, query='disk', namespace='ns2', max_results=5)
+        assert finished.wait(60)
+        summary = events[-1][1]
+        assert summary['returned'] == 5 and summary['limit_reached']
+        assert sum(len(d['results']) for e, d in events if e == 'log_search_results') == 5
+
+        # 取消
+        search_id, events, finished = _run_search(fleet, query=r'ERR\w+', regex=True)
+        fleet.cancel(search_id)
+        assert finished.wait(60)
+        print(f"📋 取消后的汇总: cancelled={events[-1][1]['cancelled']}, searched={events[-1][1]['searched']}")
+        print("✅ 跨实例搜索工作正常")
+    finally:
+        if fleet._pool is not None:
+            fleet._pool.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_fleet_search()
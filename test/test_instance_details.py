@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试实例详细信息缓存：会话不变时命中缓存，实例目录变化或超过有效期时重新获取
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.instance_manager import instance_manager
+from config.config import Config
+
+def test_detail_cache_invalidation():
+    """测试实例详细信息缓存的失效"""
+    print("🧪 测试实例详细信息缓存")
+
+    work_dir = tempfile.mkdtemp(prefix='instance_details_')
+    old_work_dir, old_ttl = instance_manager.work_dir, Config.INSTANCE_DETAIL_CACHE_TTL
+    fetched = []
+
+    def fake_fetch(instance_id):
+        fetched.append(instance_id)
+        return {'project_dir': '/tmp/demo', 'role': f'role{len(fetched)}', 'pid': '', 'namespace': 'ns'}
+
+    instance_manager.work_dir = work_dir
+    instance_manager._fetch_instance_detail = fake_fetch
+    try:
+        instance_dir = os.path.join(instance_manager.get_namespace_instances_dir('ns'), 'demo')
+        os.makedirs(instance_dir)
+        instances_data = [{'id': 'demo', 'session': 'q_instance_demo', 'namespace': 'ns'}]
+
+        assert instance_manager._fetch_instance_details(instances_data)['demo']['role'] == 'role1'
+        assert instance_manager._fetch_instance_details(instances_data)['demo']['role'] == 'role1'
+        assert len(fetched) == 1
+
+        # cliExtra更新实例文件（写临时文件再替换）后重新获取
+        time.sleep(0.01)
+        with open(os.path.join(instance_dir, 'info.tmp'), 'w') as f:
+            f.write('role=reviewer\n')
+        os.replace(os.path.join(instance_dir, 'info.tmp'), os.path.join(instance_dir, 'info'))
+        assert instance_manager._fetch_instance_details(instances_data)['demo']['role'] == 'role2'
+
+        # 超过有效期后重新获取
+        Config.INSTANCE_DETAIL_CACHE_TTL = 0
+        assert instance_manager._fetch_instance_details(instances_data)['demo']['role'] == 'role3'
+        assert len(fetched) == 3
+        print("✅ 实例详细信息缓存按目录变化和有效期失效")
+    finally:
+        del instance_manager._fetch_instance_detail
+        instance_manager._detail_cache.clear()
+        instance_manager.work_dir = old_work_dir
+        Config.INSTANCE_DETAIL_CACHE_TTL = old_ttl
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_detail_cache_invalidation()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试tmux日志增量读取器：字节偏移、未完成行、多字节字符被截断、单次读取上限、文件被截断或重建；
+日志行索引的增量更新、持久化和后台建立
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.log_reader import LogTailReader, LogLineIndex, read_last_lines
+from app.services.instance_manager import instance_manager
+from config.config import Config
+
+def _append(path, data):
+    with open(path, 'ab') as f:
+        f.write(data)
+
+def test_tail_reader_offsets():
+    """测试增量读取的字节偏移和未完成行"""
+    print("🧪 测试日志增量读取器")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_reader_')
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        text = '第一行\n'.encode('utf-8')
+        _append(log_path, text + '第二'.encode('utf-8')[:4])
+
+        reader = LogTailReader(log_path, max_read_bytes=5)
+        outputs = []
+        while True:
+            outputs.extend(reader.read())
+            if not reader.has_more:
+                break
+        assert [o['content'] for o in outputs] == ['第一行']
+        assert outputs[0]['offset'] == 0 and outputs[0]['new_position'] == len(text)
+
+        # 补全被截断的多字节字符和行尾
+        _append(log_path, '第二'.encode('utf-8')[4:] + b'\n\n')
+        outputs = reader.read()
+        assert [o['content'] for o in outputs] == ['第二', '']
+        assert outputs[0]['offset'] == len(text)
+        assert outputs[1]['is_streaming'] is False
+        assert reader.position == os.path.getsize(log_path)
+
+        # 无状态读取：只按完整行推进位置
+        _append(log_path, b'partial')
+        outputs = instance_manager._read_tmux_log_file(log_path, 0)
+        assert outputs[-1]['new_position'] == reader.position
+        assert instance_manager._read_tmux_log_file(log_path, reader.position) == []
+
+        # 超长的未完成行先行输出，多字节字符不被拆开
+        reader = LogTailReader(log_path, offset=reader.position, max_line_bytes=8)
+        _append(log_path, '超长'.encode('utf-8')[:5])
+        outputs = reader.read()
+        assert outputs[0]['is_partial'] and outputs[0]['content'] == 'partial超'
+        assert reader.position == os.path.getsize(log_path) - 2
+
+        # 文件被截断后从头读取，第一个片段标记 rewound
+        log_id = outputs[0]['log_id']
+        with open(log_path, 'wb') as f:
+            f.write(b'new\n')
+        outputs = reader.read()
+        assert [o['content'] for o in outputs] == ['new']
+        assert outputs[0]['rewound']
+        log_id = outputs[0]['log_id']
+        _append(log_path, b'more\n')
+        outputs = reader.read()
+        assert 'rewound' not in outputs[0] and outputs[0]['log_id'] == log_id
+
+        # 文件被重建（即使比已读取的位置更大）也从头读取
+        os.remove(log_path)
+        _append(log_path, b'recreated line one\nrecreated line two\n')
+        outputs = reader.read()
+        assert [o['content'] for o in outputs] == ['recreated line one', 'recreated line two']
+        assert outputs[0]['rewound'] and outputs[0]['log_id'] != log_id
+        print("✅ 增量读取器工作正常")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_line_index_pagination():
+    """测试稀疏行索引与逐行读取结果一致，并支持增量更新和持久化"""
+    print("🧪 测试日志行索引")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_index_')
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        expected = [f'行 {i} ' + 'x' * (i % 7) for i in range(2500)]
+        _append(log_path, ''.join(line + '\n' for line in expected[:1234]).encode('utf-8'))
+
+        index = LogLineIndex(log_path, stride=100)
+        assert index.update()[0] == 1234
+        assert index.read_lines(95, 105) == expected[95:105]
+
+        # 追加内容后增量更新（包含末尾未完成的行）
+        _append(log_path, ''.join(line + '\n' for line in expected[1234:]).encode('utf-8') + b'tail')
+        total_lines, file_size = index.update()
+        assert total_lines == 2501 and file_size == os.path.getsize(log_path)
+        assert index.read_lines(2490, 2501) == expected[2490:] + ['tail']
+
+        # 重新加载 .idx 文件后无需重新扫描
+        reloaded = LogLineIndex(log_path, stride=100)
+        reloaded.update()
+        assert reloaded._offsets == index._offsets
+        assert reloaded.read_lines(1999, 2001) == expected[1999:2001]
+
+        # 与原来的整文件读取结果一致
+        result = instance_manager._read_file_with_pagination(log_path, 1, 50, 'forward', 700)
+        assert [line['content'] for line in result['lines']] == expected[700:750]
+        assert result['total_lines'] == 2501
+
+        # 文件被重建后重新建立索引
+        os.remove(log_path)
+        _append(log_path, b'a\nb\n')
+        assert reloaded.update()[0] == 2
+        assert reloaded.read_lines(0, 5) == ['a', 'b']
+
+        # 原地清空后重新写入超过原索引大小的内容（inode不变）同样重新建立索引
+        _append(log_path, ''.join(line + '\n' for line in expected[:300]).encode('utf-8'))
+        reloaded.update()
+        with open(log_path, 'r+b') as f:
+            f.truncate(0)
+            f.write(''.join(f'新{line}\n' for line in expected).encode('utf-8'))
+        assert reloaded.update()[0] == 2500
+        assert reloaded.read_lines(1500, 1502) == [f'新{line}' for line in expected[1500:1502]]
+        print("✅ 行索引工作正常")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_line_index_background_build():
+    """测试大日志的行索引在后台建立，分页请求不阻塞"""
+    print("🧪 测试后台建立行索引")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_index_bg_')
+    old_sync_bytes = Config.LOG_INDEX_SYNC_BYTES
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        expected = [f'行 {i}' for i in range(5000)]
+        _append(log_path, ''.join(line + '\n' for line in expected).encode('utf-8'))
+        Config.LOG_INDEX_SYNC_BYTES = 1024
+
+        result = instance_manager._read_file_with_pagination(log_path, 1, 10, 'forward', 100)
+        assert result['success'] and result['indexing'] and result['total_lines'] is None
+
+        # 后台建立完成后正常分页
+        for _ in range(100):
+            result = instance_manager._read_file_with_pagination(log_path, 1, 10, 'forward', 100)
+            if not result.get('indexing'):
+                break
+            time.sleep(0.05)
+        assert [line['content'] for line in result['lines']] == expected[100:110]
+        assert result['total_lines'] == 5000
+        print("✅ 大日志在后台建立行索引")
+    finally:
+        Config.LOG_INDEX_SYNC_BYTES = old_sync_bytes
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_read_last_lines():
+    """测试从文件末尾反向读取最近的行"""
+    print("🧪 测试反向读取最近的行")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_tail_')
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        expected = [f'第 {i} 行' for i in range(300)]
+        _append(log_path, '\r\n'.join(expected).encode('utf-8') + b'\r\n')
+
+        lines, start_offset, end_offset = read_last_lines(log_path, 10)
+        assert lines == expected[-10:]
+        assert end_offset == os.path.getsize(log_path)
+        assert read_last_lines(log_path, 1000)[0] == expected
+
+        # 继续向前读取
+        lines, _, _ = read_last_lines(log_path, 5, end_offset=start_offset)
+        assert lines == expected[-15:-10]
+
+        # 行号与整文件分页一致
+        _append(log_path, b'partial')
+        result = instance_manager._read_file_with_pagination(log_path, 1, 3, 'backward', 0)
+        assert [line['content'] for line in result['lines']] == expected[-2:] + ['partial']
+        assert result['start_line'] == 299 and result['total_lines'] == 301
+        assert result['has_previous']
+        print("✅ 反向读取工作正常")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_tail_reader_offsets()
+    test_line_index_pagination()
+    test_line_index_background_build()
+    test_read_last_lines()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试tmux日志全文搜索索引：与逐行扫描结果一致、ANSI序列、正则、分页游标、增量更新、内存上限淘汰
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ansi_stripper import strip_ansi
+from app.services import log_search
+from app.services.log_search import LogSearchIndex, get_search_index, peek_search_index
+from config.config import Config
+
+WORDS = ['build', 'error', 'warning', 'deploy', 'timeout', 'retry', '完成', '失败', 'ok']
+
+def _write_log(path, count, seed):
+    rng = random.Random(seed)
+    lines = []
+    for i in range(count):
+        words = rng.sample(WORDS, 3)
+        # 用颜色序列把单词拆开，搜索时应当忽略
+        lines.append(f'\x1b[32m[{i}]\x1b[0m ' + ' '.join(words).replace('error', 'er\x1b[1mror'))
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\r\n'.join(lines) + '\r\n')
+
+def _brute_force(path, pattern):
+    with open(path, 'r', encoding='utf-8', errors='ignore', newline='\n') as f:
+        return [i for i, line in enumerate(f, 1) if pattern.search(strip_ansi(line))]
+
+def _collect_all(index, query, regex=False, limit=37):
+    """按游标翻页取回全部结果"""
+    lines = []
+    cursor = 0
+    while True:
+        result = index.search(query, regex=regex, limit=limit, cursor=cursor)
+        lines.extend(r['line_number'] for r in result['results'])
+        if not result['has_more']:
+            return lines, result['total_matches']
+        cursor = result['next_cursor']
+
+def test_search_index():
+    """测试索引搜索结果与逐行扫描一致"""
+    print("🧪 测试日志搜索索引")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_search_')
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        _write_log(log_path, 3000, seed=1)
+
+        index = LogSearchIndex(log_path, block_bytes=4096)
+        index.update()
+        # 追加内容后部分内容尚未索引，搜索仍然完整
+        _write_log(log_path, 500, seed=2)
+
+        for query, regex in [('ERROR', False), ('失败', False), ('ok', False),
+                             (r'deploy\s+timeout', True), (r'^\[12\d\]', True)]:
+            pattern = re.compile(query if regex else re.escape(query), re.IGNORECASE)
+            expected = _brute_force(log_path, pattern)
+            lines, total = _collect_all(index, query, regex=regex)
+            assert lines == expected, f'{query}: 结果不一致'
+            assert total == len(expected)
+            print(f"📋 {query!r}: {total} 行匹配")
+
+        result = index.search('error', limit=1)
+        match = result['results'][0]
+        start, end = match['match_positions'][0]['start'], match['match_positions'][0]['end']
+        assert match['content'][start:end].lower() == 'error'
+
+        # 不存在的词不需要扫描任何已索引的块
+        index.update()
+        result = index.search('kubernetes')
+        assert result['candidate_blocks'] == 0 and result['total_matches'] == 0
+        print("✅ 搜索索引工作正常")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_search_index_eviction():
+    """测试索引总内存超过上限时淘汰最久未使用的索引"""
+    print("🧪 测试日志搜索索引淘汰")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_search_evict_')
+    old_limit, old_block_bytes = Config.LOG_SEARCH_MAX_INDEX_BYTES, Config.LOG_SEARCH_BLOCK_BYTES
+    Config.LOG_SEARCH_BLOCK_BYTES = 16 * 1024
+    paths = []
+    try:
+        for i in range(3):
+            path = os.path.join(tmp_dir, f'tmux_{i}.log')
+            _write_log(path, 5000, seed=0)
+            paths.append(path)
+
+        # 上限只够容纳两个索引
+        probe = LogSearchIndex(paths[0])
+        probe.update()
+        Config.LOG_SEARCH_MAX_INDEX_BYTES = probe.memory_bytes * 5 // 2
+
+        for path in paths[:2]:
+            get_search_index(path).update()
+        # 访问第一个索引后，第二个成为最久未使用的索引
+        assert peek_search_index(paths[0]) is not None
+        get_search_index(paths[2]).update()
+
+        assert peek_search_index(paths[0]) is not None
+        assert peek_search_index(paths[1]) is None
+        assert peek_search_index(paths[2]) is not None
+        total = sum(index.memory_bytes for index in log_search._search_indexes.values())
+        assert total <= Config.LOG_SEARCH_MAX_INDEX_BYTES
+        print("✅ 索引总内存不超过上限")
+    finally:
+        Config.LOG_SEARCH_MAX_INDEX_BYTES, Config.LOG_SEARCH_BLOCK_BYTES = old_limit, old_block_bytes
+        for path in paths:
+            log_search._search_indexes.pop(path, None)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_search_performance():
+    """对比索引搜索与逐行扫描的耗时"""
+    print("🧪 测试日志搜索性能")
+
+    tmp_dir = tempfile.mkdtemp(prefix='log_search_perf_')
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        _write_log(log_path, 200000, seed=3)
+        with open(log_path, 'a') as f:
+            f.write('Traceback: needle_in_haystack\n')
+        size_mb = os.path.getsize(log_path) / 1024 / 1024
+
+        index = LogSearchIndex(log_path)
+        started = time.time()
+        index.update()
+        print(f"📋 日志 {size_mb:.1f}MB，建立索引耗时 {time.time() - started:.2f}s")
+
+        started = time.time()
+        result = index.search('needle_in_haystack')
+        indexed_time = time.time() - started
+        assert result['total_matches'] == 1
+
+        started = time.time()
+        with open(log_path, 'r', encoding='utf-8', errors='ignore') as f:
+            legacy = [n for n, line in enumerate(f, 1) if 'needle_in_haystack' in line.lower()]
+        legacy_time = time.time() - started
+        assert legacy == [result['results'][0]['line_number']]
+
+        print(f"⏱️  索引搜索: {indexed_time * 1000:.1f}ms，逐行扫描: {legacy_time * 1000:.1f}ms")
+        print("✅ 搜索性能测试完成")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_search_index()
+    test_search_index_eviction()
+    test_search_performance()
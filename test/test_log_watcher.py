@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试日志文件监听器（inotify 与 stat 轮询两种模式）
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.log_watcher import LogWatcher
+
+def _check_watcher(use_inotify):
+    """写入日志并统计通知延迟"""
+    tmp_dir = tempfile.mkdtemp(prefix='log_watcher_')
+    watcher = LogWatcher(use_inotify=use_inotify)
+    try:
+        log_path = os.path.join(tmp_dir, 'instance_a', 'tmux.log')
+        events = []
+        notified = threading.Event()
+
+        def on_change(path):
+            events.append((path, time.time()))
+            notified.set()
+
+        token = watcher.watch(log_path, on_change)
+        print(f"📋 监听模式: {watcher.mode}")
+
+        # 注册时会立即回调一次
+        assert len(events) == 1
+        notified.clear()
+
+        # 日志目录和文件在监听之后才创建
+        os.makedirs(os.path.dirname(log_path))
+        with open(log_path, 'a') as f:
+            f.write('hello\n')
+        assert notified.wait(5), '创建文件后未收到通知'
+
+        latencies = []
+        for i in range(5):
+            notified.clear()
+            written_at = time.time()
+            with open(log_path, 'a') as f:
+                f.write(f'line {i}\n')
+            assert notified.wait(5), '追加内容后未收到通知'
+            latencies.append(events[-1][1] - written_at)
+
+        print(f"⏱️  平均通知延迟: {sum(latencies) / len(latencies) * 1000:.1f}ms")
+
+        # 无变化时不应唤醒订阅者
+        count = len(events)
+        time.sleep(0.5)
+        assert len(events) == count, '文件未变化却收到通知'
+
+        # 取消监听后不再通知
+        watcher.unwatch(token)
+        with open(log_path, 'a') as f:
+            f.write('after unwatch\n')
+        time.sleep(0.5)
+        assert len(events) == count
+
+        # 频繁监听/取消监听时唤醒管道写满也不会阻塞调用方
+        def churn():
+            for _ in range(40000):
+                watcher.unwatch(watcher.watch(log_path, lambda _path: None))
+        worker = threading.Thread(target=churn, daemon=True)
+        worker.start()
+        worker.join(30)
+        assert not worker.is_alive(), '监听/取消监听被唤醒管道阻塞'
+        print("✅ 监听器工作正常")
+    finally:
+        watcher.stop()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_log_watcher_inotify():
+    """测试inotify模式（不支持时自动回退为轮询）"""
+    _check_watcher(use_inotify=True)
+
+def test_log_watcher_poll():
+    """测试stat轮询模式"""
+    _check_watcher(use_inotify=False)
+
+if __name__ == '__main__':
+    test_log_watcher_inotify()
+    test_log_watcher_poll()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试实例输出分发中心：单读取者、多订阅者独立游标、慢客户端合并/丢弃
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.log_reader import LogTailReader
+from app.services.log_watcher import LogWatcher
+from app.services.output_hub import OutputHub
+
+class CountingManager:
+    """固定日志路径并统计日志读取次数"""
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.reads = 0
+
+    def get_instance_log_path(self, instance_id):
+        return self.log_path
+
+    def create_reader(self, path):
+        manager = self
+
+        class CountingReader(LogTailReader):
+            def read(self):
+                manager.reads += 1
+                return super().read()
+
+        return CountingReader(path)
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_output_hub_fan_out():
+    """测试多个订阅者共享一个读取者"""
+    print("🧪 测试输出分发中心")
+
+    tmp_dir = tempfile.mkdtemp(prefix='output_hub_')
+    watcher = LogWatcher()
+    try:
+        log_path = os.path.join(tmp_dir, 'tmux.log')
+        with open(log_path, 'w') as f:
+            f.write('')
+
+        manager = CountingManager(log_path)
+        hub = OutputHub(manager=manager, watcher=watcher, queue_size=5, max_coalesce_chars=1000,
+                        reader_factory=manager.create_reader)
+
+        received = {}
+        slow_gate = threading.Event()
+
+        def deliver(sid, items, dropped):
+            if sid == 'slow':
+                slow_gate.wait(5)
+            received.setdefault(sid, []).extend(item['content'] for item in items)
+
+        subscribers = ['tab_a', 'tab_b', 'slow']
+        created = [hub.subscribe('inst', sid, deliver) for sid in subscribers]
+        assert created == [True, False, False], '同一实例应只创建一个读取者'
+
+        reads_before = manager.reads
+        for i in range(20):
+            with open(log_path, 'a') as f:
+                f.write(f'line {i}\n')
+            time.sleep(0.01)
+
+        assert _wait_for(lambda: len(received.get('tab_a', [])) == 20)
+        assert _wait_for(lambda: len(received.get('tab_b', [])) == 20)
+        print(f"📋 写入20行，日志读取次数: {manager.reads - reads_before}（与订阅者数量无关）")
+
+        # 慢客户端积压被合并，内容不丢失
+        stats = hub.get_stats()['inst']['subscribers']['slow']
+        print(f"📋 慢客户端统计: {stats}")
+        slow_gate.set()
+        assert _wait_for(lambda: '\n'.join(received.get('slow', [])).count('line') == 20)
+
+        # 一个标签页离开不影响另一个
+        hub.unsubscribe('inst', 'tab_a')
+        with open(log_path, 'a') as f:
+            f.write('after leave\n')
+        assert _wait_for(lambda: 'after leave' in received.get('tab_b', []))
+        assert 'after leave' not in received['tab_a']
+
+        # 最后一个订阅者离开后停止读取，并通知停止回调
+        stopped = []
+        hub.set_stop_handler(stopped.append)
+        hub.unsubscribe_all('tab_b')
+        assert stopped == []
+        hub.unsubscribe_all('slow')
+        assert hub.get_stats() == {}
+        assert stopped == ['inst']
+        assert watcher.watched_paths() == []
+        print("✅ 输出分发中心工作正常")
+    finally:
+        watcher.stop()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_output_hub_fan_out()
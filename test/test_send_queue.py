@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试消息发送队列：立即返回、同一实例严格保序、跨实例并发、失败重试、超时不自动重试、死信与重新投递、事件推送目标
+"""
+
+import os
+import sys
+import time
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.send_queue import SendQueue
+
+class FakeManager:
+    """模拟发送：每条耗时delay秒；flaky中的实例前几次失败，dead中的实例总是超时"""
+
+    def __init__(self, delay=0.05, flaky=None, dead=()):
+        self.delay = delay
+        self.flaky = dict(flaky or {})
+        self.dead = set(dead)
+        self.delivered = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def send_message(self, instance_id, message):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if instance_id in self.dead:
+                return {'success': False, 'error': '发送消息超时', 'timeout': True}
+            if instance_id == 'typed':
+                return {'success': False, 'error': '消息已写入，但提交失败', 'uncertain': True}
+            if self.flaky.get(instance_id, 0) > 0:
+                self.flaky[instance_id] -= 1
+                return {'success': False, 'error': 'tmux暂时不可用'}
+            if instance_id == 'missing':
+                return {'success': False, 'error': '实例不存在'}
+            with self.lock:
+                self.delivered.append((instance_id, message))
+            return {'success': True}
+        finally:
+            with self.lock:
+                self.active -= 1
+
+def test_send_queue():
+    """测试消息发送队列"""
+    print("🧪 测试消息发送队列")
+
+    manager = FakeManager(flaky={'inst1': 2}, dead={'inst_dead'})
+    sender = SendQueue(manager=manager, workers=4, max_attempts=3, retry_delay=0.05)
+    events = []
+    finished = []
+    sender.set_emitter(lambda event, data, room: events.append((data['message_id'], data['status'], room)))
+
+    started = time.time()
+    ids = {}
+    for i in range(10):
+        for n in range(8):
+            ids[(n, i)] = sender.submit(f'inst{n}', f'msg {i}', owner='sid1')
+    dead_id = sender.submit('inst_dead', 'hello', on_finished=finished.append)
+    failed_id = sender.submit('missing', 'hello')
+    typed_id = sender.submit('typed', 'hello')
+    submit_time = time.time() - started
+    assert submit_time < 0.05, '提交不应等待投递'
+
+    assert sender.wait_idle(30)
+    elapsed = time.time() - started
+    print(f"📋 83条消息（8个实例×10条 + 3条失败），4个线程，耗时 {elapsed:.2f}s，最大并发 {manager.max_active}")
+    assert manager.max_active <= 4
+
+    # 同一实例严格按提交顺序，重试不会打乱顺序
+    for n in range(8):
+        assert [m for inst, m in manager.delivered if inst == f'inst{n}'] == [f'msg {i}' for i in range(10)]
+    assert sender.get(ids[(1, 0)])['attempts'] == 3 and sender.get(ids[(1, 0)])['status'] == 'delivered'
+    statuses = [status for message_id, status, _ in events if message_id == ids[(1, 0)]]
+    assert statuses[0] == 'queued' and statuses[-1] == 'delivered' and statuses.count('retrying') == 2
+
+    # 用尽重试次数后进入死信
+    assert sender.get(failed_id)['status'] == 'dead_letter' and sender.get(failed_id)['attempts'] == 3
+    # 超时或已写入实例时消息可能已经送达，不自动重试，直接进入死信
+    assert sender.get(dead_id)['status'] == 'dead_letter' and sender.get(dead_id)['attempts'] == 1
+    assert sender.get(typed_id)['status'] == 'dead_letter' and sender.get(typed_id)['attempts'] == 1
+    assert sorted(d['message_id'] for d in sender.dead_letters()) == sorted([dead_id, failed_id, typed_id])
+
+    statuses = [status for message_id, status, _ in events if message_id == ids[(2, 0)]]
+    assert statuses == ['queued', 'sending', 'delivered']
+    # 有提交方时只推送给它，否则推送到实例房间
+    assert all(room == 'sid1' for message_id, _, room in events if message_id == ids[(0, 0)])
+    assert all(room == 'instance_missing' for message_id, _, room in events if message_id == failed_id)
+
+    # 死信重新投递，结束回调随之保留
+    manager.dead.clear()
+    new_id = sender.retry_dead_letter(dead_id)
+    assert sender.wait_idle(10)
+    assert sender.get(new_id)['status'] == 'delivered'
+    assert sorted(d['message_id'] for d in sender.dead_letters()) == sorted([failed_id, typed_id])
+    assert [result['status'] for result in finished] == ['dead_letter', 'delivered']
+    print("✅ 消息发送队列工作正常")
+
+if __name__ == '__main__':
+    test_send_queue()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试状态文件索引：任意namespace、文件更新/删除、新建namespace、inotify与轮询模式、全量查询耗时
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.status_index import StatusIndex
+
+def write_status(work_dir, namespace, instance_id, content):
+    status_dir = os.path.join(work_dir, 'namespaces', namespace, 'status')
+    os.makedirs(status_dir, exist_ok=True)
+    with open(os.path.join(status_dir, f'{instance_id}.status'), 'w') as f:
+        f.write(content)
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+def check_index(use_inotify):
+    work_dir = tempfile.mkdtemp(prefix='status_index_')
+    index = StatusIndex(work_dir=work_dir, poll_interval=0.05, use_inotify=use_inotify)
+    try:
+        # 旧实现只查找5个固定namespace，这里使用任意namespace
+        for n in range(20):
+            for i in range(50):
+                write_status(work_dir, f'team{n}', f'inst_{n}_{i}', str(i % 2))
+        index.start()
+        print(f"📋 模式: {index.mode}")
+
+        snapshot = index.snapshot()
+        assert len(snapshot) == 1000
+        assert snapshot['inst_7_3'].state == '1' and snapshot['inst_7_3'].namespace == 'team7'
+        assert snapshot['inst_7_4'].state == '0'
+
+        # 更新、删除、新建namespace
+        write_status(work_dir, 'team3', 'inst_3_0', '1')
+        os.remove(os.path.join(work_dir, 'namespaces', 'team4', 'status', 'inst_4_0.status'))
+        write_status(work_dir, 'brand_new', 'fresh', '1')
+        assert wait_for(lambda: index.get('inst_3_0').state == '1')
+        assert wait_for(lambda: index.get('inst_4_0') is None)
+        assert wait_for(lambda: index.get('fresh') is not None)
+        assert index.get('fresh').namespace == 'brand_new'
+
+        # 新namespace目录中后续的写入
+        write_status(work_dir, 'brand_new', 'fresh', '0')
+        write_status(work_dir, 'brand_new', 'second', '1')
+        assert wait_for(lambda: index.get('fresh').state == '0' and index.get('second') is not None)
+
+        started = time.time()
+        for _ in range(1000):
+            index.snapshot()
+        print(f"⏱️  1000个实例的全量状态: {(time.time() - started):.3f}ms/次")
+    finally:
+        index.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_status_index():
+    """测试状态文件索引"""
+    print("🧪 测试状态文件索引")
+    check_index(use_inotify=True)
+    check_index(use_inotify=False)
+    print("✅ 状态文件索引工作正常")
+
+if __name__ == '__main__':
+    test_status_index()
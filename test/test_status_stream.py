@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试实例状态推送：订阅快照、只推送busy/idle翻转的实例、按namespace分组、推送延迟
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.status_index import StatusIndex
+from app.services.status_stream import StatusStream, status_room
+
+def write_status(work_dir, namespace, instance_id, content):
+    status_dir = os.path.join(work_dir, 'namespaces', namespace, 'status')
+    os.makedirs(status_dir, exist_ok=True)
+    with open(os.path.join(status_dir, f'{instance_id}.status'), 'w') as f:
+        f.write(content)
+
+def test_status_stream():
+    """测试实例状态推送"""
+    print("🧪 测试实例状态推送")
+
+    work_dir = tempfile.mkdtemp(prefix='status_stream_')
+    index = StatusIndex(work_dir=work_dir)
+    stream = StatusStream(index=index)
+    events = []
+    stream.set_emitter(lambda event, data, room: events.append((time.time(), event, data, room)))
+    try:
+        for i in range(10):
+            write_status(work_dir, 'frontend', f'fe{i}', '0')
+            write_status(work_dir, 'backend', f'be{i}', '1' if i < 3 else '0')
+
+        snapshot = stream.snapshot('backend')
+        assert len(snapshot['instances']) == 10
+        assert snapshot['instances']['be0']['status'] == 'busy'
+        assert snapshot['instances']['be5']['status'] == 'idle'
+        assert len(stream.snapshot()['instances']) == 20
+        assert events == []
+
+        # 只改mtime、状态不变的实例不推送
+        written = time.time()
+        write_status(work_dir, 'frontend', 'fe1', '1')
+        write_status(work_dir, 'frontend', 'fe2', '0')
+        write_status(work_dir, 'backend', 'be0', '0')
+        deadline = time.time() + 3
+        while len(events) < 4 and time.time() < deadline:
+            time.sleep(0.005)
+        time.sleep(0.1)
+
+        rooms = {room: data['instances'] for _, event, data, room in events if event == 'instance_status_changed'}
+        assert rooms[status_room('frontend')] == {'fe1': rooms[status_room('frontend')]['fe1']}
+        assert rooms[status_room('frontend')]['fe1']['status'] == 'busy'
+        assert list(rooms[status_room('backend')]) == ['be0']
+        assert rooms[status_room('backend')]['be0']['status'] == 'idle'
+        assert status_room(None) in rooms
+        print(f"⏱️  写入到推送: {(events[0][0] - written) * 1000:.1f}ms")
+
+        # 删除状态文件：busy实例变为idle
+        events.clear()
+        os.remove(os.path.join(work_dir, 'namespaces', 'frontend', 'status', 'fe1.status'))
+        deadline = time.time() + 3
+        while not events and time.time() < deadline:
+            time.sleep(0.005)
+        assert events and events[0][2]['instances'] == {'fe1': {'status': 'idle', 'last_activity': ''}}
+        print("✅ 实例状态推送工作正常")
+    finally:
+        index.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_status_stream()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实例同步性能基准测试
+使用假的 qq / cliExtra 命令模拟 10、50、200 个实例，统计 sync_screen_instances 耗时
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FAKE_CLI = '''#!/usr/bin/env python3
+import json, os, sys
+with open(os.environ['FAKE_INSTANCES_FILE']) as f:
+    instances = json.load(f)
+args = sys.argv[1:]
+if len(args) >= 2 and args[0] == 'list' and not args[1].startswith('-'):
+    inst = next((i for i in instances if i['id'] == args[1]), None)
+    print(json.dumps({'instance': {
+        'id': args[1], 'project_dir': '/tmp/' + args[1], 'role': 'fullstack',
+        'pid': '4242', 'namespace': inst['namespace'] if inst else 'default',
+        'log_modified': ''
+    }}))
+elif args and args[0] == 'list':
+    print(json.dumps({'instances': instances}))
+'''
+
+INSTANCE_COUNTS = [10, 50, 200]
+
+def _setup_fake_cli(tmp_dir, count):
+    """创建假的命令和实例数据"""
+    bin_dir = os.path.join(tmp_dir, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for name in ('qq', 'cliExtra'):
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(FAKE_CLI)
+        os.chmod(path, 0o755)
+
+    instances = [{
+        'id': f'bench_{i}',
+        'status': 'Detached',
+        'session': f'q_instance_bench_{i}',
+        'namespace': ['default', 'frontend', 'backend'][i % 3],
+        'attach_command': f'tmux attach-session -t q_instance_bench_{i}'
+    } for i in range(count)]
+
+    instances_file = os.path.join(tmp_dir, 'instances.json')
+    with open(instances_file, 'w') as f:
+        json.dump(instances, f)
+
+    os.environ['FAKE_INSTANCES_FILE'] = instances_file
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+    return bin_dir
+
+def _legacy_detail_loop(count):
+    """旧实现的参考耗时：每个实例串行fork一次 cliExtra list <id> --json"""
+    start_time = time.time()
+    for i in range(count):
+        subprocess.run(['cliExtra', 'list', f'bench_{i}', '--json'],
+                       capture_output=True, text=True, timeout=5)
+    return time.time() - start_time
+
+def run_benchmark(count, include_legacy=True):
+    """运行单个规模的基准测试"""
+    from app.services.instance_manager import InstanceManager
+
+    tmp_dir = tempfile.mkdtemp(prefix='sync_bench_')
+    old_path = os.environ.get('PATH', '')
+    try:
+        bin_dir = _setup_fake_cli(tmp_dir, count)
+
+        manager = InstanceManager()
+        manager.work_dir = tmp_dir
+
+        start_time = time.time()
+        manager.sync_screen_instances()
+        cold = time.time() - start_time
+
+        start_time = time.time()
+        manager.sync_screen_instances()
+        warm = time.time() - start_time
+
+        assert len(manager.instances) == count, f'期望 {count} 个实例，实际 {len(manager.instances)}'
+        assert all(inst.path for inst in manager.instances.values()), '详细信息未填充'
+
+        legacy = _legacy_detail_loop(count) if include_legacy else None
+        return {'count': count, 'cold': cold, 'warm': warm, 'legacy': legacy}
+    finally:
+        os.environ['PATH'] = old_path
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_sync_performance():
+    """测试不同实例数量下的同步耗时"""
+    print("🧪 测试实例同步性能")
+
+    for count in INSTANCE_COUNTS:
+        result = run_benchmark(count)
+        print(f"\n📋 实例数量: {count}")
+        print(f"⏱️  首次同步（并发获取详情）: {result['cold'] * 1000:.1f}ms")
+        print(f"⏱️  再次同步（详情缓存命中）: {result['warm'] * 1000:.1f}ms")
+        print(f"⏱️  旧实现串行详情参考耗时: {result['legacy'] * 1000:.1f}ms")
+
+        # 缓存命中后只需要一次 qq list
+        assert result['warm'] < result['legacy']
+
+def main():
+    """主测试函数"""
+    print("🚀 开始实例同步性能测试\n")
+    test_sync_performance()
+    print("\n" + "=" * 50)
+    print("📊 性能测试完成")
+
+if __name__ == '__main__':
+    main()
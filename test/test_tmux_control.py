@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试tmux控制连接池：命令与响应对应、参数引号（$变量等不被展开）、错误响应、并发调用、通知、断线重连、超时不重复执行
+"""
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.tmux_control import TmuxControlPool, TmuxCommandError, TmuxCommandTimeout, format_command, tmux_query
+
+CONTROL_SESSION = 'cliextra_test_control'
+TARGET_SESSION = "q_test it's"
+# 使用独立的tmux服务器，不影响开发者正在使用的tmux
+SOCKET = f'cliextra_test_{os.getpid()}'
+
+def tmux(*args):
+    return subprocess.run(['tmux', '-L', SOCKET, *args], capture_output=True, text=True)
+
+def test_format_command():
+    """测试参数引号：tmux会展开的字符必须加引号"""
+    print("🧪 测试参数引号")
+    assert format_command(['send-keys', '-t', '=q:', '-l', '--', 'plain.txt']) == 'send-keys -t =q: -l -- plain.txt'
+    for arg in ('$HOME', '${HOME}', '~', '~/x', '%if', 'cost $5', "it's", '#{pane_id}', 'a;b', '{x}'):
+        assert format_command([arg]).startswith("'"), arg
+    print("✅ 参数引号正确")
+
+def test_literal_arguments():
+    """测试send-keys按字面发送 $HOME、~ 等内容"""
+    print("🧪 测试参数按字面发送")
+    if not shutil.which('tmux'):
+        print("⚠️  未安装tmux，跳过")
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix='tmux_control_')
+    received = os.path.join(tmp_dir, 'received.txt')
+    pool = TmuxControlPool(size=1, session_name=CONTROL_SESSION, socket_name=SOCKET)
+    try:
+        pool.command('new-session', '-d', '-s', 'literal', f'stty -echo; cat > {received}')
+        time.sleep(0.3)
+        payloads = ['$HOME', '${HOME}', '~', '%if', 'echo $PATH', 'cost $5']
+        for payload in payloads:
+            pool.command('send-keys', '-t', '=literal:', '-l', '--', payload)
+            pool.command('send-keys', '-t', '=literal:', 'Enter')
+        time.sleep(0.3)
+        with open(received, encoding='utf-8') as f:
+            assert f.read() == ''.join(f'{payload}\n' for payload in payloads)
+        print("✅ 参数按字面发送")
+    finally:
+        pool.close()
+        tmux('kill-server')
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def test_timeout_not_repeated():
+    """测试命令已发出但响应超时或连接断开时不退回到直接执行，命令只执行一次"""
+    print("🧪 测试超时不重复执行")
+    if not shutil.which('tmux'):
+        print("⚠️  未安装tmux，跳过")
+        return
+
+    pool = TmuxControlPool(size=1, session_name=CONTROL_SESSION, socket_name=SOCKET)
+    try:
+        # wait-for 阻塞控制连接的命令队列，之后的命令都会超时，但仍会在解除阻塞后执行
+        pool.command('wait-for', 'cliextra_gate')
+        assert tmux_query('set-buffer', '-a', '-b', 'runs', 'x', timeout=0.2, pool=pool) is None
+        try:
+            tmux_query('set-buffer', '-a', '-b', 'runs', 'y', timeout=0.2, pool=pool, raise_timeout=True)
+            assert False, '应当抛出TmuxCommandTimeout'
+        except TmuxCommandTimeout:
+            pass
+        tmux('wait-for', '-S', 'cliextra_gate')
+        # 超时命令的响应按顺序丢弃，不会错配给后续命令
+        assert pool.command('display-message', '-p', 'next', timeout=5) == ['next']
+        assert tmux('show-buffer', '-b', 'runs').stdout == 'xy'
+
+        # 连接在响应前断开：同样视为结果不确定，之后自动重连
+        errors = []
+
+        def slow():
+            try:
+                pool.command('display-message', '-p', 'blocked', timeout=5)
+            except TmuxCommandTimeout as e:
+                errors.append(e)
+
+        pool.command('wait-for', 'cliextra_gate')
+        thread = threading.Thread(target=slow)
+        thread.start()
+        time.sleep(0.3)
+        pool._clients[0]._process.kill()
+        thread.join(5)
+        assert len(errors) == 1
+        assert pool.command('display-message', '-p', 'again') == ['again']
+        print("✅ 超时和断线时命令不重复执行")
+    finally:
+        pool.close()
+        tmux('kill-server')
+
+def test_tmux_control():
+    """测试tmux控制连接池"""
+    print("🧪 测试tmux控制连接池")
+    if not shutil.which('tmux'):
+        print("⚠️  未安装tmux，跳过")
+        return
+
+    pool = TmuxControlPool(size=2, session_name=CONTROL_SESSION, socket_name=SOCKET)
+    events = []
+    pool.add_listener(lambda event, data: events.append(event))
+    try:
+        pool.command('new-session', '-d', '-s', TARGET_SESSION, 'echo ready; sleep 30')
+        time.sleep(0.2)
+        names = pool.command('list-sessions', '-F', '#{session_name}')
+        assert TARGET_SESSION in names
+        assert pool.command('display-message', '-t', f'={TARGET_SESSION}:', '-p',
+                            "a'b \"c\" #{session_name} ;") == [f'a\'b "c" {TARGET_SESSION} ;']
+
+        try:
+            pool.command('has-session', '-t', '=no_such_session')
+            assert False, '应当抛出TmuxCommandError'
+        except TmuxCommandError:
+            pass
+
+        # 多线程并发调用，各自拿到自己的响应
+        errors = []
+
+        def worker(n):
+            for i in range(50):
+                if pool.command('display-message', '-p', f'{n}-{i}') != [f'{n}-{i}']:
+                    errors.append((n, i))
+
+        started = time.time()
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.time() - started
+        assert not errors
+        print(f"⏱️  200条命令耗时 {elapsed * 1000:.0f}ms")
+
+        started = time.time()
+        for _ in range(20):
+            tmux('display-message', '-p', 'x')
+        print(f"⏱️  对比：每条命令fork一次 {(time.time() - started) / 20 * 1000:.1f}ms/条")
+
+        assert 'sessions-changed' in events
+
+        # 控制会话被关闭后，下一次调用自动重连
+        tmux('kill-session', '-t', f'={CONTROL_SESSION}')
+        time.sleep(0.3)
+        assert pool.command('display-message', '-p', 'again') == ['again']
+        print("✅ tmux控制连接池工作正常")
+    finally:
+        pool.close()
+        tmux('kill-server')
+
+if __name__ == '__main__':
+    test_format_command()
+    test_literal_arguments()
+    test_timeout_not_repeated()
+    test_tmux_control()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试直接通过tmux发送消息：单行、以"-"开头和含引号的文本、不加空格的 $变量、多行和大段文本、无法解析的实例、超时不重复发送
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.instance import QInstance
+from app.services.tmux_control import TmuxControlPool
+from app.services.tmux_sender import TmuxSender
+from config.config import Config
+
+SESSION = 'q_sender_test'
+# 使用独立的tmux服务器，不影响开发者正在使用的tmux
+SOCKET = f'cliextra_sender_test_{os.getpid()}'
+
+class FakeManager:
+    def __init__(self, instances):
+        self.instances = instances
+
+    def get_instance(self, instance_id):
+        return self.instances.get(instance_id)
+
+class EmptyRegistry:
+    def get_instance(self, instance_id):
+        return None
+
+def test_tmux_sender():
+    """测试tmux消息发送"""
+    print("🧪 测试tmux直接发送消息")
+    if not shutil.which('tmux'):
+        print("⚠️  未安装tmux，跳过")
+        return
+
+    tmp_dir = tempfile.mkdtemp(prefix='tmux_sender_')
+    received = os.path.join(tmp_dir, 'received.txt')
+    pool = TmuxControlPool(size=1, session_name='cliextra_sender_control', socket_name=SOCKET)
+    sender = TmuxSender(manager=FakeManager({'inst': QInstance(id='inst', screen_session=SESSION)}),
+                        pool=pool, registry=EmptyRegistry())
+    try:
+        # 窗格中运行 cat，收到的内容写入文件（终端规范模式下单行不能超过4095字符）
+        subprocess.run(['tmux', '-L', SOCKET, 'new-session', '-d', '-s', SESSION, f'stty -echo; cat > {received}'], check=True)
+        time.sleep(0.3)
+
+        assert sender.send('unknown', 'hello') is None
+
+        messages = [
+            "-n 你好 $HOME 'quoted' \"double\" ; \\",
+            '$HOME',
+            'echo $PATH',
+            'cost is $5 ~ %if',
+            '第一行\n第二行\n  缩进的第三行',
+            '\n'.join(f'{i:03d} ' + 'x' * 60 for i in range(200)),
+            'y' * 3000
+        ]
+        for message in messages:
+            started = time.time()
+            result = sender.send('inst', message)
+            print(f"⏱️  发送 {len(message)} 字符耗时 {(time.time() - started) * 1000:.1f}ms")
+            assert result and result['success'] and result['method'] == 'tmux'
+
+        # 控制连接被阻塞时发送超时：返回 timeout 结果，不退回到直接执行或 qq send，解除阻塞后只送达一次
+        old_timeout = Config.TMUX_COMMAND_TIMEOUT
+        Config.TMUX_COMMAND_TIMEOUT = 0.3
+        try:
+            pool.command('wait-for', 'sender_gate')
+            result = sender.send('inst', 'only once')
+        finally:
+            Config.TMUX_COMMAND_TIMEOUT = old_timeout
+        assert result['success'] is False and result['timeout']
+        subprocess.run(['tmux', '-L', SOCKET, 'wait-for', '-S', 'sender_gate'], check=True)
+        # 超时的文本解除阻塞后写入（没有回车），随下一条消息一起提交
+        assert sender.send('inst', ' then next')['success']
+
+        time.sleep(0.5)
+        with open(received, encoding='utf-8') as f:
+            content = f.read()
+        assert content.count('only once') == 1 and 'only once then next\n' in content
+        assert messages[0] + '\n' in content
+        # 不含空格的 $变量 也按字面送达，不被tmux展开
+        assert '\n$HOME\necho $PATH\ncost is $5 ~ %if\n' in content
+        assert '第一行\n第二行\n  缩进的第三行\n' in content
+        assert messages[2] + '\n' in content and 'y' * 3000 + '\n' in content
+        print("✅ tmux直接发送消息正常")
+    finally:
+        pool.close()
+        subprocess.run(['tmux', '-L', SOCKET, 'kill-server'], capture_output=True)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_tmux_sender()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试tmux会话快照：list-panes输出解析、合并到QInstance、实际tmux会话
+"""
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.models.instance import QInstance
+from app.services.tmux_snapshot import parse_pane_lines, collect_session_snapshot
+
+def test_parse_and_merge():
+    """测试解析和合并"""
+    print("🧪 测试tmux会话快照解析")
+
+    sessions = parse_pane_lines([
+        'q_instance_a|1234|1735689600|1735689900|120x40',
+        'q_instance_a|1240|1735689600|1735689900|60x40',  # 同一会话的第二个窗格
+        'odd|name|42|1735689600|1735689600|80x24',
+        'broken line'
+    ])
+    assert set(sessions) == {'q_instance_a', 'odd|name'}
+    assert sessions['q_instance_a'].pane_pid == 1234 and sessions['q_instance_a'].pane_size == '120x40'
+    assert sessions['odd|name'].pane_pid == 42
+
+    instance = QInstance(id='a', screen_session='q_instance_a')
+    instance.apply_session_info(sessions['q_instance_a'])
+    data = instance.to_dict()
+    assert data['pid'] == '1234' and data['pane_size'] == '120x40'
+    assert (instance.last_activity - instance.created_at).total_seconds() == 300
+    print("✅ 解析与合并正常")
+
+def test_live_snapshot():
+    """测试从实际tmux会话获取快照"""
+    print("🧪 测试tmux会话快照")
+    if not shutil.which('tmux'):
+        print("⚠️  未安装tmux，跳过")
+        return
+
+    names = [f'q_snapshot_test_{i}' for i in range(5)]
+    try:
+        for name in names:
+            subprocess.run(['tmux', 'new-session', '-d', '-s', name, '-x', '100', '-y', '30', 'sleep 30'], check=True)
+        started = time.time()
+        sessions = collect_session_snapshot()
+        print(f"⏱️  {len(sessions)} 个会话，耗时 {(time.time() - started) * 1000:.1f}ms")
+        for name in names:
+            assert sessions[name].pane_pid and sessions[name].created and sessions[name].pane_size == '100x30'
+        print("✅ tmux会话快照正常")
+    finally:
+        for name in names:
+            subprocess.run(['tmux', 'kill-session', '-t', f'={name}'], capture_output=True)
+
+if __name__ == '__main__':
+    test_parse_and_merge()
+    test_live_snapshot()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试实例利用率时间序列：忙碌区间跨桶切分、完成次数与连续忙碌时间、namespace峰值、保存与恢复
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.utilization import UtilizationRecorder
+
+def test_utilization():
+    """测试实例利用率时间序列"""
+    print("🧪 测试实例利用率时间序列")
+
+    tmp_dir = tempfile.mkdtemp(prefix='utilization_')
+    path = os.path.join(tmp_dir, 'utilization.json')
+    try:
+        recorder = UtilizationRecorder(path=path)
+        base = (int(time.time()) // 86400 - 2) * 86400  # 两天前的0点（UTC）
+
+        # inst_a: 00:00:30 ~ 00:02:00 忙碌（跨两个分钟桶的边界），00:05:00 ~ 00:05:10 忙碌
+        recorder.record('inst_a', 'backend', True, base + 30)
+        recorder.record('inst_a', 'backend', True, base + 40)  # 状态未变化，忽略
+        recorder.record('inst_a', 'backend', False, base + 120)
+        recorder.record('inst_a', 'backend', True, base + 300)
+        recorder.record('inst_a', 'backend', False, base + 310)
+        # inst_b: 00:01:00 ~ 00:01:30 忙碌，与inst_a重叠
+        recorder.record('inst_b', 'backend', True, base + 60)
+        recorder.record('inst_b', 'backend', False, base + 90)
+        recorder.record('inst_c', 'frontend', False, base)
+
+        result = recorder.instance_series('inst_a', '1m', since=base, until=base + 359)
+        points = result['points']
+        assert len(points) == 6
+        assert [p['busy_seconds'] for p in points] == [30, 60, 0, 0, 0, 10]
+        assert points[2]['completed'] == 1 and points[2]['longest_streak'] == 90  # 在结束的桶中计数
+        summary = result['summary']
+        assert summary['busy_seconds'] == 100 and summary['completed'] == 2
+        assert summary['longest_streak'] == 90 and summary['state'] == 'idle'
+
+        hourly = recorder.instance_series('inst_a', '1h', since=base, until=base + 3599)
+        assert hourly['points'][0]['busy_seconds'] == 100 and hourly['points'][0]['completed'] == 2
+
+        ns = recorder.namespace_series('backend', '1m', since=base, until=base + 359)
+        assert ns['summary']['instances'] == 2
+        assert ns['points'][1]['busy_seconds'] == 90 and ns['points'][1]['peak_busy'] == 2
+        assert ns['points'][1]['avg_busy'] == 1.5 and ns['points'][1]['utilization'] == 0.75
+        assert ns['summary']['completed'] == 3 and ns['summary']['peak_busy'] == 2
+
+        # 当前仍在忙碌的实例计入进行中的区间
+        recorder.record('inst_c', 'frontend', True, time.time() - 5)
+        live = recorder.instance_series('inst_c', '1m')
+        assert live['summary']['state'] == 'busy' and live['summary']['current_streak'] >= 5
+        assert 4 < live['summary']['busy_seconds'] <= 6
+
+        try:
+            recorder.instance_series('inst_a', '5m')
+            assert False, '应拒绝不支持的粒度'
+        except ValueError:
+            pass
+
+        # 保存后恢复
+        recorder.save()
+        print(f"📋 3个实例的数据文件大小: {os.path.getsize(path) / 1024:.0f}KB")
+        restored = UtilizationRecorder(path=path)
+        restored.load()
+        again = restored.instance_series('inst_a', '1m', since=base, until=base + 359)
+        assert [p['busy_seconds'] for p in again['points']] == [30, 60, 0, 0, 0, 10]
+        assert restored.namespace_series('backend', '1m', since=base, until=base + 359)['points'][1]['peak_busy'] == 2
+
+        # 查询耗时：100个实例的namespace，1分钟粒度24小时
+        for i in range(100):
+            for k in range(50):
+                t = base + i * 7 + k * 600
+                restored.record(f'bulk{i}', 'bulk', True, t)
+                restored.record(f'bulk{i}', 'bulk', False, t + 120)
+        started = time.time()
+        day = restored.namespace_series('bulk', '1m', since=base, until=base + 86399)
+        print(f"⏱️  100个实例×1440个桶的namespace汇总: {(time.time() - started) * 1000:.0f}ms")
+        assert day['summary']['completed'] == 5000
+        print("✅ 实例利用率时间序列工作正常")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    test_utilization()